@@ -0,0 +1,294 @@
+import hashlib
+import os
+import stat as stat_module
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from byte_ranges import file_response, parse_range
+
+# On-disk cache of remote audioUrl tracks, so a play streams from local disk
+# instead of from the upstream host. A track is downloaded once, in the
+# background, and streamed to every listener from the growing file while the
+# download is still running; finished tracks are kept, least recently played
+# first out, within a byte budget.
+AUDIO_CACHE_DIR = os.environ.get("MUSIC_AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("MUSIC_AUDIO_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+UPSTREAM_TIMEOUT = float(os.environ.get("MUSIC_AUDIO_UPSTREAM_TIMEOUT", "30"))
+# How long a request holds its worker thread waiting for upstream's response
+# headers before giving up with 504; the download itself carries on
+START_TIMEOUT = float(os.environ.get("MUSIC_AUDIO_START_TIMEOUT", "5"))
+# Part files untouched for this long belong to a download that died with
+# its process; live ones are written to at least every UPSTREAM_TIMEOUT
+STALE_PART_SECONDS = max(600.0, UPSTREAM_TIMEOUT * 4)
+CHUNK_SIZE = 64 * 1024
+# How often a listener ahead of the download checks for new bytes. Waiting
+# this way holds no worker thread, which the database requests need.
+POLL_INTERVAL = 0.05
+# A seek this far past what has been downloaded is fetched from upstream with
+# its own range request instead of waiting for the download to get there
+PROXY_AHEAD_BYTES = 2 * 1024 * 1024
+
+def is_remote(audio_url: str) -> bool:
+    return audio_url.startswith(("http://", "https://"))
+
+class Download:
+    """One upstream fetch of a track into `<path>.<pid>.part`, renamed to `path` when complete.
+
+    The pid keeps workers downloading the same track from sharing a part file.
+    """
+
+    def __init__(self, url: str, path: str, opener: Callable):
+        self.url = url
+        self.path = path
+        self.part = f"{path}.{os.getpid()}.part"
+        self.opener = opener
+        self.size: Optional[int] = None  # from Content-Length, None if upstream sent none
+        self.written = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.started = threading.Event()  # set once the size is known or the fetch failed
+
+    def run(self):
+        try:
+            request = urllib.request.Request(self.url, headers={"User-Agent": "Self-Music"})
+            with self.opener(request, timeout=UPSTREAM_TIMEOUT) as upstream, open(self.part, "wb") as file:
+                length = upstream.headers.get("Content-Length")
+                self.size = int(length) if length and length.isdigit() else None
+                self.started.set()
+                while True:
+                    chunk = upstream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file.write(chunk)
+                    file.flush()
+                    self.written += len(chunk)
+            if self.size is not None and self.written != self.size:
+                raise IOError(f"Upstream sent {self.written} of {self.size} bytes")
+            self.size = self.written
+            os.replace(self.part, self.path)
+        except Exception as e:
+            self.error = e
+            try:
+                os.remove(self.part)
+            except OSError:
+                pass
+        finally:
+            self.done = True
+            self.started.set()
+
+    def _open(self):
+        try:
+            return open(self.part, "rb")
+        except FileNotFoundError:
+            # Finished (or failed) between the check and the open
+            return open(self.path, "rb")
+
+    async def chunks(self, first: int, last: Optional[int]) -> AsyncIterator[bytes]:
+        """Bytes first..last (inclusive, None for the end) as they arrive from upstream"""
+        try:
+            file = self._open()
+        except FileNotFoundError:
+            return
+        with file:
+            position = first
+            while last is None or position <= last:
+                deadline = time.monotonic() + UPSTREAM_TIMEOUT
+                while self.written <= position and not self.done and time.monotonic() < deadline:
+                    await anyio.sleep(POLL_INTERVAL)
+                available = self.written if self.error is None else 0
+                if available <= position:
+                    # Complete, failed or stalled: end the body here
+                    return
+                end = available if last is None else min(available, last + 1)
+                # Just written, so this reads from the page cache
+                file.seek(position)
+                chunk = file.read(min(CHUNK_SIZE, end - position))
+                if not chunk:
+                    return
+                position += len(chunk)
+                yield chunk
+
+def _upstream_range(upstream, first: int, last: int) -> Iterator[bytes]:
+    with upstream:
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = upstream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+class AudioCache:
+    """LRU of downloaded tracks under `directory`, bounded by `max_bytes`.
+
+    Concurrent plays of a track share one download. The index is read from
+    the directory on first use; `.part` files left by downloads that died
+    are removed then, while those of other workers' downloads are left alone.
+    """
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES,
+                 opener: Callable = urllib.request.urlopen):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.opener = opener  # urlopen-compatible; swap for a stand-in upstream
+        self._lock = threading.Lock()
+        self._files: Optional[OrderedDict] = None  # path -> size, least recently played first
+        self._downloads: Dict[str, Download] = {}  # url -> in-flight download
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _ensure_loaded(self):
+        if self._files is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(".part"):
+                if time.time() - stat.st_mtime > STALE_PART_SECONDS:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            elif stat_module.S_ISREG(stat.st_mode):
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self._files = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.bytes = sum(self._files.values())
+
+    def _path(self, url: str) -> str:
+        # Keep the extension so the cached file still tells its audio type
+        extension = os.path.splitext(urlparse(url).path)[1][:8]
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + extension)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                # Listeners still streaming it keep their open handle
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _finished(self, download: Download):
+        with self._lock:
+            self._downloads.pop(download.url, None)
+            if download.error is None:
+                self._files[download.path] = download.size
+                self.bytes += download.size
+                self._evict()
+
+    def _run(self, download: Download):
+        download.run()
+        self._finished(download)
+
+    def fetch(self, url: str):
+        """The cached file of a track, or the download filling it (started if need be)"""
+        with self._lock:
+            self._ensure_loaded()
+            path = self._path(url)
+            if path in self._files:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return path, None
+            self.misses += 1
+            download = self._downloads.get(url)
+            if download is None:
+                download = self._downloads[url] = Download(url, path, self.opener)
+                threading.Thread(target=self._run, args=(download,), daemon=True).start()
+            return None, download
+
+    def response(self, request: Request, url: str, media_type: str) -> Response:
+        path, download = self.fetch(url)
+        if path is not None:
+            try:
+                return file_response(request, path, media_type)
+            except FileNotFoundError:
+                # Evicted in the meantime
+                path, download = self.fetch(url)
+                if path is not None:
+                    return file_response(request, path, media_type)
+
+        if not download.started.wait(START_TIMEOUT):
+            raise HTTPException(status_code=504, detail="Audio upstream is not responding")
+        if download.error is not None:
+            raise HTTPException(status_code=502, detail="Audio file unavailable upstream")
+        size = download.size
+        range_header = request.headers.get("range")
+        if size is None or not range_header or request.headers.get("if-range") is not None:
+            # Without a known size ranges cannot be served; a partial copy
+            # has no validator yet, so If-Range always gets the whole track
+            headers = {"Accept-Ranges": "bytes" if size is not None else "none"}
+            if size is not None:
+                headers["Content-Length"] = str(size)
+            return StreamingResponse(download.chunks(0, None), media_type=media_type, headers=headers)
+
+        ranges = parse_range(range_header, size)
+        if ranges is None or len(ranges) > 1:
+            # Several ranges of a track still downloading: send all of it
+            return StreamingResponse(download.chunks(0, None), media_type=media_type,
+                                     headers={"Accept-Ranges": "bytes", "Content-Length": str(size)})
+        first, last = ranges[0]
+        headers = {"Accept-Ranges": "bytes", "Content-Range": f"bytes {first}-{last}/{size}",
+                   "Content-Length": str(last - first + 1)}
+        body = None
+        if first > download.written + PROXY_AHEAD_BYTES and not download.done:
+            body = self._proxy_range(url, first, last)
+        return StreamingResponse(body or download.chunks(first, last), status_code=206, media_type=media_type,
+                                 headers=headers)
+
+    def _proxy_range(self, url: str, first: int, last: int) -> Optional[Iterator[bytes]]:
+        """The range straight from upstream, or None if upstream will not serve ranges"""
+        request = urllib.request.Request(url, headers={"User-Agent": "Self-Music", "Range": f"bytes={first}-{last}"})
+        try:
+            upstream = self.opener(request, timeout=UPSTREAM_TIMEOUT)
+        except Exception:
+            return None
+        if upstream.status != 206 or not upstream.headers.get("Content-Range", "").startswith(f"bytes {first}-"):
+            upstream.close()
+            return None
+        return _upstream_range(upstream, first, last)
+
+    def clear(self):
+        """Forget and delete every finished track; downloads in flight carry on"""
+        with self._lock:
+            self._ensure_loaded()
+            for path in self._files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._files.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._ensure_loaded()
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "downloading": len(self._downloads),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+audio_cache = AudioCache()
@@ -0,0 +1,158 @@
+import sqlite3
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from serializers import ensure_https_url
+from search_index import ALBUMS_FTS_INSERT, SONGS_FTS_INSERT, has_search_index
+
+# Set-based import for /api/admin/import/batch. Artist, album and song names
+# are resolved with one query per table up front, new rows go in with
+# executemany, and counters and search rows are brought up to date once per
+# entity at the end instead of by a trigger per inserted row: while the
+# import's transaction holds a row in bulk_load, the insert triggers listed
+# in migrations.BULK_LOAD_TRIGGERS stand down. Other connections never see
+# that row, since it is deleted before the commit.
+MAX_IN_PARAMS = 500
+
+def _select_in(conn: sqlite3.Connection, sql: str, values: List) -> List:
+    rows = []
+    for start in range(0, len(values), MAX_IN_PARAMS):
+        chunk = values[start:start + MAX_IN_PARAMS]
+        rows += conn.execute(sql.format(','.join('?' * len(chunk))), chunk).fetchall()
+    return rows
+
+def _fan_count(value) -> int:
+    digits = value.replace(',', '') if value else ''
+    return int(digits) if digits.isdigit() else 0
+
+def import_items(conn: sqlite3.Connection, items: List) -> Tuple[Dict, List, List]:
+    """Import ImportBatchItems in the caller's transaction; the caller commits.
+
+    Returns the response summary, the (kind, id, name) of new entities for
+    the suggestion index and the (id, audioUrl) of new songs.
+    """
+    artist_names = list({artist.name for item in items for artist in item.artistsInfo})
+    song_titles = list({item.songInfo.name for item in items if item.skipIfExists})
+    album_titles = list({item.albumInfo.title for item in items if item.albumInfo})
+
+    # The guard row also opens the write transaction, so the rowids read
+    # next are the last ones before this import
+    conn.execute('INSERT INTO bulk_load (active) VALUES (1)')
+    last_rowids = {table: conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+                   for table in ("songs", "artists", "albums")}
+
+    artist_ids = dict(_select_in(conn, 'SELECT name, id FROM artists WHERE name IN ({})', artist_names))
+    existing_songs = set(map(tuple, _select_in(conn, '''
+        SELECT s.title, ar.name FROM songs s JOIN artists ar ON s.artistId = ar.id
+        WHERE s.title IN ({})
+    ''', song_titles)))
+    album_ids = {(title, artist_id): album_id for title, artist_id, album_id in _select_in(
+        conn, 'SELECT title, artistId, id FROM albums WHERE title IN ({})', album_titles)}
+
+    new_artists, new_albums, new_songs = [], [], []
+    song_artists, album_artists = [], []
+    results, errors, new_names = [], [], []
+    skipped_count = 0
+    for item in items:
+        song_info = item.songInfo
+        primary_name = item.artistsInfo[0].name if item.artistsInfo else ''
+        if item.skipIfExists and (song_info.name, primary_name) in existing_songs:
+            skipped_count += 1
+            results.append({"songId": song_info.songId, "status": "skipped", "reason": "歌曲已存在"})
+            continue
+        if not item.artistsInfo:
+            errors.append(f"导入歌曲 {song_info.name} 失败: 缺少艺术家信息")
+            results.append({"songId": song_info.songId, "status": "error", "reason": "缺少艺术家信息"})
+            continue
+
+        now = datetime.now().isoformat()
+        # 导入或获取艺术家（同名只取一次，第一个艺术家作为主艺术家）
+        created_artists = []
+        for artist_info in item.artistsInfo:
+            artist_id = artist_ids.get(artist_info.name)
+            if artist_id is None:
+                artist_id = artist_ids[artist_info.name] = str(uuid.uuid4())
+                avatar = ensure_https_url(artist_info.avatarUrl)
+                new_artists.append((
+                    artist_id, artist_info.name,
+                    artist_info.intro[:500] if artist_info.intro else None,  # 限制简介长度
+                    avatar, avatar, _fan_count(artist_info.fanCount), "[]", now, now
+                ))
+                new_names.append(("artists", artist_id, artist_info.name))
+            if artist_id not in created_artists:
+                created_artists.append(artist_id)
+        primary_artist_id = created_artists[0]
+
+        # 导入或获取专辑（基于标题和主艺术家）
+        album_id = None
+        album_info = item.albumInfo
+        if album_info:
+            album_id = album_ids.get((album_info.title, primary_artist_id))
+            if album_id is None:
+                album_id = album_ids[(album_info.title, primary_artist_id)] = str(uuid.uuid4())
+                new_albums.append((
+                    album_id, album_info.title, primary_artist_id, ensure_https_url(album_info.coverUrl),
+                    album_info.releaseDate, album_info.description, now, now
+                ))
+                new_names.append(("albums", album_id, album_info.title))
+                album_artists += [(str(uuid.uuid4()), album_id, artist_id, artist_id == primary_artist_id, now)
+                                  for artist_id in created_artists]
+
+        song_id = str(uuid.uuid4())
+        new_songs.append((
+            song_id, song_info.name, primary_artist_id, album_id, song_info.duration,
+            item.audioUrl, ensure_https_url(song_info.img), item.lyrics, now, now
+        ))
+        song_artists += [(str(uuid.uuid4()), song_id, artist_id, artist_id == primary_artist_id, now)
+                         for artist_id in created_artists]
+        new_names.append(("songs", song_id, song_info.name))
+        existing_songs.add((song_info.name, primary_name))
+        results.append({"songId": song_info.songId, "status": "imported", "localId": song_id})
+
+    conn.executemany('''
+        INSERT INTO artists (id, name, bio, avatar, coverUrl, followers, songCount, albumCount, genres, verified, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, 0, 0, ?, FALSE, ?, ?)
+    ''', new_artists)
+    conn.executemany('''
+        INSERT INTO albums (id, title, artistId, coverUrl, releaseDate, songCount, duration, genre, description, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, 0, 0, NULL, ?, ?, ?)
+    ''', new_albums)
+    conn.executemany('''
+        INSERT INTO album_artists (id, albumId, artistId, isPrimary, createdAt) VALUES (?, ?, ?, ?, ?)
+    ''', album_artists)
+    conn.executemany('''
+        INSERT INTO songs (id, title, artistId, albumId, duration, audioUrl, coverUrl, lyrics, moodIds, playCount, liked, genre, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, '[]', 0, FALSE, NULL, ?, ?)
+    ''', new_songs)
+    conn.executemany('''
+        INSERT INTO song_artists (id, songId, artistId, isPrimary, createdAt) VALUES (?, ?, ?, ?, ?)
+    ''', song_artists)
+
+    # What the insert triggers would have done, once per entity
+    conn.executemany('UPDATE table_counts SET count = count + ? WHERE name = ?',
+                     [(len(new_songs), "songs"), (len(new_artists), "artists"), (len(new_albums), "albums")])
+    album_songs = Counter(row[3] for row in new_songs if row[3] is not None)
+    conn.executemany('UPDATE albums SET songCount = songCount + ? WHERE id = ?',
+                     [(count, album_id) for album_id, count in album_songs.items()])
+    artist_songs = Counter(row[2] for row in song_artists)
+    artist_albums = Counter(row[2] for row in album_artists)
+    conn.executemany('UPDATE artists SET songCount = songCount + ?, albumCount = albumCount + ? WHERE id = ?',
+                     [(artist_songs[artist_id], artist_albums[artist_id], artist_id)
+                      for artist_id in artist_songs.keys() | artist_albums.keys()])
+    if has_search_index(conn.cursor()):
+        conn.execute('INSERT INTO artists_fts (rowid, id, name, bio) SELECT rowid, id, name, bio FROM artists WHERE rowid > ?',
+                     (last_rowids["artists"],))
+        conn.execute(ALBUMS_FTS_INSERT.format('a.rowid > ?'), (last_rowids["albums"],))
+        conn.execute(SONGS_FTS_INSERT.format('s.rowid > ?'), (last_rowids["songs"],))
+    conn.execute('DELETE FROM bulk_load')
+
+    summary = {
+        "success": True,
+        "imported": len(new_songs),
+        "skipped": skipped_count,
+        "errors": errors,
+        "details": results,
+    }
+    return summary, new_names, [(row[0], row[5]) for row in new_songs]
@@ -0,0 +1,174 @@
+"""Items per second through /api/admin/import/batch, through import_items() alone, and through the per-item reference.
+
+    cd backend && python bench/batch_import.py [--items 5000] [--batch 500]
+
+The items spread over 1,000 artists and 1,500 albums, 30% of them with a
+second artist, plus 10% re-sent tracks that are skipped as existing.
+per_item_import() is the handler's loop before the set-based import (a
+lookup and an INSERT per artist, album, song and link, with the triggers
+doing the counters and search rows row by row), kept here as the baseline.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+
+from common import init_database, scratch_dir
+
+def make_items(count: int):
+    rng = random.Random(7)
+    artists = [f"Bench Artist {i}" for i in range(1000)]
+    albums = [(f"Bench Album {i}", rng.randrange(len(artists))) for i in range(1500)]
+    items = []
+    for i in range(count):
+        title, primary = albums[rng.randrange(len(albums))]
+        names = [artists[primary]] + ([rng.choice(artists)] if rng.random() < 0.3 else [])
+        items.append({
+            "songInfo": {"songId": i, "name": f"Bench Song {i}", "arName": names, "albumName": title, "albumId": 1,
+                         "interval": "03:30", "img": "https://img.example/s.jpg", "duration": 210},
+            "albumInfo": {"id": 1, "title": title, "artist": names[0], "coverUrl": "https://img.example/a.jpg",
+                          "releaseDate": "2020-01-01", "description": "d"},
+            "artistsInfo": [{"id": str(j), "name": name, "avatarUrl": "https://img.example/p.jpg", "intro": "bio",
+                             "fanCount": "1,234"} for j, name in enumerate(names)],
+            "lyrics": "[00:00.00] la",
+            "audioUrl": f"https://cdn.example/{i}.mp3",
+        })
+    return items + items[:count // 10]
+
+def through_api(items, batch: int):
+    import main
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        login = client.post("/api/auth/login", json={"username": "admin", "password": "admin123"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        imported = skipped = 0
+        started = time.perf_counter()
+        for start in range(0, len(items), batch):
+            result = client.post("/api/admin/import/batch", json={"items": items[start:start + batch]},
+                                 headers=headers).json()
+            imported += result["imported"]
+            skipped += result["skipped"]
+        elapsed = time.perf_counter() - started
+    print(f"API, {batch} per request  {len(items) / elapsed:7.0f} items/s "
+          f"({imported} imported, {skipped} skipped in {elapsed:.2f} s)")
+
+def handler_only(items):
+    import main
+    from batch_import import import_items
+    from db import connect
+
+    request = main.ImportBatchRequest(items=items)
+    conn = connect()
+    started = time.perf_counter()
+    summary, _, _ = import_items(conn, request.items)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(f"import_items() alone    {len(items) / elapsed:7.0f} items/s "
+          f"({summary['imported']} imported, {summary['skipped']} skipped in {elapsed:.2f} s)")
+
+def per_item_import(conn, items):
+    """The old batch_import handler body, minus the response bookkeeping"""
+    from serializers import ensure_https_url
+
+    cursor = conn.cursor()
+    imported = skipped = 0
+    for item in items:
+        song_info, album_info, artists_info = item.songInfo, item.albumInfo, item.artistsInfo
+        if item.skipIfExists:
+            cursor.execute('''
+                SELECT s.id FROM songs s JOIN artists ar ON s.artistId = ar.id
+                WHERE s.title = ? AND ar.name = ?
+            ''', (song_info.name, artists_info[0].name if artists_info else ''))
+            if cursor.fetchone():
+                skipped += 1
+                continue
+
+        created_artists = []
+        for artist_info in artists_info:
+            cursor.execute('SELECT id FROM artists WHERE name = ?', (artist_info.name,))
+            row = cursor.fetchone()
+            if row:
+                artist_id = row[0]
+            else:
+                artist_id = str(uuid.uuid4())
+                now = datetime.now().isoformat()
+                fans = artist_info.fanCount.replace(',', '') if artist_info.fanCount else ''
+                cursor.execute('''
+                    INSERT INTO artists (id, name, bio, avatar, coverUrl, followers, songCount, albumCount, genres, verified, createdAt, updatedAt)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (artist_id, artist_info.name, artist_info.intro[:500] if artist_info.intro else None,
+                      ensure_https_url(artist_info.avatarUrl), ensure_https_url(artist_info.avatarUrl),
+                      int(fans) if fans.isdigit() else 0, 0, 0, "[]", False, now, now))
+            # The old loop failed such items on the unique link; skip the repeat as import_items() does
+            if artist_id not in created_artists:
+                created_artists.append(artist_id)
+        primary_artist_id = created_artists[0]
+
+        cursor.execute('SELECT id FROM albums WHERE title = ? AND artistId = ?', (album_info.title, primary_artist_id))
+        row = cursor.fetchone()
+        if row:
+            album_id = row[0]
+        else:
+            album_id = str(uuid.uuid4())
+            now = datetime.now().isoformat()
+            cursor.execute('''
+                INSERT INTO albums (id, title, artistId, coverUrl, releaseDate, songCount, duration, genre, description, createdAt, updatedAt)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (album_id, album_info.title, primary_artist_id, ensure_https_url(album_info.coverUrl),
+                  album_info.releaseDate, 0, 0, None, album_info.description, now, now))
+            cursor.execute('DELETE FROM album_artists WHERE albumId = ?', (album_id,))
+            for artist_id in created_artists:
+                cursor.execute('''
+                    INSERT INTO album_artists (id, albumId, artistId, isPrimary, createdAt) VALUES (?, ?, ?, ?, ?)
+                ''', (str(uuid.uuid4()), album_id, artist_id, artist_id == primary_artist_id, now))
+
+        song_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        cursor.execute('''
+            INSERT INTO songs (id, title, artistId, albumId, duration, audioUrl, coverUrl, lyrics, moodIds, playCount, liked, genre, createdAt, updatedAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (song_id, song_info.name, primary_artist_id, album_id, song_info.duration, item.audioUrl,
+              ensure_https_url(song_info.img), item.lyrics, "[]", 0, False, None, now, now))
+        cursor.execute('DELETE FROM song_artists WHERE songId = ?', (song_id,))
+        for artist_id in created_artists:
+            cursor.execute('''
+                INSERT INTO song_artists (id, songId, artistId, isPrimary, createdAt) VALUES (?, ?, ?, ?, ?)
+            ''', (str(uuid.uuid4()), song_id, artist_id, artist_id == primary_artist_id, now))
+        imported += 1
+    return imported, skipped
+
+def reference_only(items):
+    import main
+    from db import connect
+
+    request = main.ImportBatchRequest(items=items)
+    conn = connect()
+    started = time.perf_counter()
+    imported, skipped = per_item_import(conn, request.items)
+    conn.commit()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(f"per-item reference      {len(items) / elapsed:7.0f} items/s "
+          f"({imported} imported, {skipped} skipped in {elapsed:.2f} s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=500)
+    args = parser.parse_args()
+    items = make_items(args.items)
+
+    scratch_dir()
+    through_api(items, args.batch)
+    scratch_dir()
+    init_database()
+    handler_only(items)
+    scratch_dir()
+    init_database()
+    reference_only(items)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Helpers shared by the benchmarks: a scratch working directory and a uvicorn server to measure"""
+import atexit
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+def scratch_dir() -> str:
+    """Make a temporary directory the working directory, where music.db and uploads/ go"""
+    path = tempfile.mkdtemp(prefix="self-music-bench-")
+    atexit.register(shutil.rmtree, path, True)
+    os.chdir(path)
+    return path
+
+def init_database():
+    """Create music.db (tables and migrations) in the working directory"""
+    import main
+
+    main.init_db()
+
+def add_song(audio_url: str) -> str:
+    """Insert an artist and one song playing `audio_url`; returns the song id"""
+    now = datetime.now().isoformat()
+    artist_id, song_id = str(uuid.uuid4()), str(uuid.uuid4())
+    conn = sqlite3.connect("music.db")
+    conn.execute("INSERT INTO artists (id, name, genres, createdAt, updatedAt) VALUES (?, 'Bench', '[]', ?, ?)",
+                 (artist_id, now, now))
+    conn.execute("INSERT INTO songs (id, title, artistId, audioUrl, moodIds, createdAt, updatedAt) "
+                 "VALUES (?, 'Bench', ?, ?, '[]', ?, ?)", (song_id, artist_id, audio_url, now, now))
+    conn.commit()
+    conn.close()
+    return song_id
+
+class Server:
+    """uvicorn serving `app` from the working directory, one worker.
+
+    `app` may live in backend/ or in bench/; backend/ comes first on the path
+    so a bench script (bench/batch_import.py) never shadows the module it measures.
+    """
+
+    def __init__(self, app: str = "main:app", port: int = 8765):
+        self.port = port
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join([BACKEND_DIR, BENCH_DIR])}
+        self.process = subprocess.Popen([sys.executable, "-m", "uvicorn", app, "--port", str(port),
+                                         "--log-level", "warning", "--app-dir", BACKEND_DIR], env=env)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/api/moods", timeout=1).read()
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError("Server did not start")
+                time.sleep(0.2)
+
+    def cpu_seconds(self) -> float:
+        """User and system CPU time of the server process so far (Linux)"""
+        with open(f"/proc/{self.process.pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
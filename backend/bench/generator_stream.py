@@ -0,0 +1,48 @@
+"""main:app with the original stream handler under /bench/generator/{id}, as a baseline
+
+The handler is the one /api/songs/{id}/stream had before byte_ranges: a
+StreamingResponse over a generator reading 8 KB at a time. It ignores Range,
+so a seek gets the whole file.
+"""
+import mimetypes
+import os
+import sqlite3
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import main
+
+async def stream_song(song_id: str):
+    conn = sqlite3.connect('music.db')
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT audioUrl FROM songs WHERE id = ?', (song_id,))
+    row = cursor.fetchone()
+    conn.close()
+
+    if not row or not row[0]:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+    audio_path = row[0]
+    if not os.path.exists(audio_path):
+        raise HTTPException(status_code=404, detail="Audio file not found on disk")
+
+    def file_generator():
+        with open(audio_path, "rb") as audio_file:
+            while True:
+                chunk = audio_file.read(8192)
+                if not chunk:
+                    break
+                yield chunk
+
+    media_type = mimetypes.guess_type(audio_path)[0] or "audio/mpeg"
+
+    return StreamingResponse(
+        file_generator(),
+        media_type=media_type,
+        headers={"Accept-Ranges": "bytes"}
+    )
+
+main.app.add_api_route("/bench/generator/{song_id}", stream_song, methods=["GET"])
+app = main.app
@@ -0,0 +1,7 @@
+"""main:app with uploads/ also mounted through StaticFiles under /static, as a baseline"""
+from fastapi.staticfiles import StaticFiles
+
+import main
+
+main.app.mount("/static", StaticFiles(directory="uploads"), name="static")
+app = main.app
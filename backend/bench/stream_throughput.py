@@ -0,0 +1,69 @@
+"""Throughput of /api/songs/{id}/stream for whole tracks and for 1 MB seeks.
+
+    cd backend && python bench/stream_throughput.py [--clients 8] [--port 8765]
+
+Prints MB/s and the server's CPU time per request, for the current handler
+and for the 8 KB generator it replaced (generator_stream.py). The old handler
+ignores Range, so its seeks are answered with the whole track; MB/s counts
+the bytes actually received.
+"""
+import argparse
+import http.client
+import os
+import threading
+import time
+
+from common import Server, add_song, init_database, scratch_dir
+
+TRACK_BYTES = 20 * 1024 * 1024
+SEEK = (10_000_000, 10_000_000 + 1024 * 1024 - 1)
+
+def fetch(port: int, path: str, count: int, headers: dict, received: list):
+    for _ in range(count):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        while True:
+            chunk = response.read(1024 * 1024)
+            if not chunk:
+                break
+            received.append(len(chunk))
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = scratch_dir()
+    init_database()
+    track = os.path.join(workdir, "track.mp3")
+    with open(track, "wb") as file:
+        file.write(os.urandom(TRACK_BYTES))
+    song_id = add_song(track)
+
+    with Server("generator_stream:app", port=args.port) as server:
+        for handler, path in [("byte_ranges", f"/api/songs/{song_id}/stream"),
+                              ("8 KB generator", f"/bench/generator/{song_id}")]:
+            fetch(args.port, path, 1, {}, [])  # page cache and connection pool warm-up
+            for label, per_client, headers in [
+                ("whole 20 MB tracks", 4, {}),
+                ("1 MB seeks", 40, {"Range": "bytes=%d-%d" % SEEK}),
+            ]:
+                received = []
+                cpu, started = server.cpu_seconds(), time.perf_counter()
+                threads = [threading.Thread(target=fetch, args=(args.port, path, per_client, headers, received))
+                           for _ in range(args.clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed, cpu = time.perf_counter() - started, server.cpu_seconds() - cpu
+                requests = args.clients * per_client
+                print(f"{handler:15} {label:20} {sum(received) / 2 ** 20 / elapsed:7.0f} MB/s   "
+                      f"{sum(received) / 2 ** 20 / requests:5.1f} MB/request   "
+                      f"server CPU {cpu / requests * 1000:.1f} ms/request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""/uploads against a plain StaticFiles mount of the same files.
+
+    cd backend && python bench/upload_serving.py [--clients 8] [--port 8766]
+
+Covers a small content-addressed cover (12 KB), its revalidation (304), a
+20 MB track and 1 MB ranges of it, each over keep-alive connections.
+"""
+import argparse
+import hashlib
+import http.client
+import os
+import threading
+import time
+
+from common import Server, init_database, scratch_dir
+
+def store(data: bytes, extension: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    relative = f"media/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+    os.makedirs(os.path.dirname(os.path.join("uploads", relative)), exist_ok=True)
+    with open(os.path.join("uploads", relative), "wb") as file:
+        file.write(data)
+    return relative
+
+def fetch(port: int, path: str, count: int, headers: dict):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for _ in range(count):
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        while response.read(1024 * 1024):
+            pass
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    scratch_dir()
+    init_database()
+    cover = store(os.urandom(12 * 1024), ".jpg")
+    track = store(os.urandom(20 * 1024 * 1024), ".mp3")
+
+    with Server("static_mount:app", port=args.port) as server:
+        for prefix in ("/static/", "/uploads/"):
+            conn = http.client.HTTPConnection("127.0.0.1", args.port)
+            conn.request("GET", prefix + cover)
+            response = conn.getresponse()
+            response.read()
+            etag = response.getheader("ETag")
+            conn.close()
+            for label, path, per_client, headers in [
+                ("12 KB file", cover, 500, {}),
+                ("12 KB, 304", cover, 500, {"If-None-Match": etag}),
+                ("20 MB file", track, 4, {}),
+                ("1 MB range", track, 40, {"Range": "bytes=10000000-11048575"}),
+            ]:
+                cpu, started = server.cpu_seconds(), time.perf_counter()
+                threads = [threading.Thread(target=fetch, args=(args.port, prefix + path, per_client, headers))
+                           for _ in range(args.clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed, cpu = time.perf_counter() - started, server.cpu_seconds() - cpu
+                requests = args.clients * per_client
+                print(f"{prefix:10} {label:12} {requests / elapsed:7.0f} req/s   "
+                      f"server CPU {cpu / requests * 1000:.2f} ms/request")
+
+if __name__ == "__main__":
+    main()
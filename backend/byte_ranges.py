@@ -0,0 +1,200 @@
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+# Byte-range responses for audio files (RFC 9110 section 14). A player seeks
+# by requesting the bytes it needs, so only those are read from disk.
+READ_CHUNK_SIZE = 1024 * 1024
+# More ranges than this are answered with the whole file, as nginx does;
+# a flood of tiny ranges costs more than it saves
+MAX_RANGES = 16
+
+def file_validators(stat: os.stat_result) -> Tuple[str, str]:
+    """Strong ETag and Last-Modified of a file, from its size and modification time"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', formatdate(stat.st_mtime, usegmt=True)
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Inclusive (first, last) byte ranges of a Range header, sorted and merged.
+
+    Returns None when the header should be ignored (not bytes, malformed or
+    too many ranges) and raises 416 when no range overlaps the file.
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    specs = specs.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                first, last = int(first), int(last) if last else max(int(first), size - 1)
+                if first > last:
+                    return None
+            else:
+                # Suffix range: the final `last` bytes
+                suffix = int(last)
+                first, last = max(size - suffix, 0), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if not ranges:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        if first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+def not_modified(request: Request, etag: str, stat: os.stat_result) -> bool:
+    """Whether a conditional GET of the file may be answered with 304 Not Modified"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, and it takes precedence over If-Modified-Since
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def if_range_matches(if_range: str, etag: str, stat: os.stat_result) -> bool:
+    """Whether the representation a client's partial copy came from is still current"""
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison: a weak tag never matches
+        return if_range == etag
+    try:
+        return int(stat.st_mtime) <= parsedate_to_datetime(if_range).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+class FileRangeResponse(Response):
+    """Sends byte ranges of a file, by sendfile() where the ASGI server supports it.
+
+    ASGI gives an application no access to the socket, so zero-copy sending
+    is only possible through the server: the pathsend extension for a whole
+    file (Granian, for one) and zerocopysend for ranges let it sendfile()
+    straight from the page cache. uvicorn offers neither. There the body is
+    a read loop: os.pread() of READ_CHUNK_SIZE bytes on a worker thread per
+    chunk, so a file that is not in the page cache never stalls the event
+    loop, at the cost of a copy into Python and a thread hop per chunk.
+    """
+
+    def __init__(self, path: str, ranges: List[Tuple[int, int]], parts: Optional[List[bytes]], status_code: int,
+                 media_type: str, headers: Dict[str, str]):
+        self.path = path
+        self.ranges = ranges  # inclusive (first, last), empty for an empty file
+        self.parts = parts    # multipart/byteranges delimiters around the ranges, None for a single range
+        super().__init__(status_code=status_code, media_type=media_type, headers=headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        extensions = scope.get("extensions") or {}
+        if self.parts is None and self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+        spec_version = tuple(map(int, scope.get("asgi", {}).get("spec_version", "2.0").split(".")))
+        if spec_version >= (2, 4):
+            # send() raises once the client has gone
+            await self._send_body(send, extensions)
+            return
+        async with anyio.create_task_group() as task_group:
+            async def send_body():
+                await self._send_body(send, extensions)
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(send_body)
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            task_group.cancel_scope.cancel()
+
+    async def _send_body(self, send, extensions):
+        parts = self.parts or [b""] * (len(self.ranges) + 1)
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            for part, (first, last) in zip(parts, self.ranges):
+                if part:
+                    await send({"type": "http.response.body", "body": part, "more_body": True})
+                if "http.response.zerocopysend" in extensions:
+                    await send({"type": "http.response.zerocopysend", "file": file, "offset": first,
+                                "count": last - first + 1, "more_body": True})
+                else:
+                    await self._send_read(send, file.fileno(), first, last + 1)
+        finally:
+            file.close()
+        await send({"type": "http.response.body", "body": parts[-1], "more_body": False})
+
+    @staticmethod
+    async def _send_read(send, fd: int, start: int, end: int):
+        for offset in range(start, end, READ_CHUNK_SIZE):
+            chunk = await anyio.to_thread.run_sync(os.pread, fd, min(READ_CHUNK_SIZE, end - offset), offset)
+            if not chunk:
+                # Truncated since the response was started
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+def file_response(request: Request, path: str, media_type: str, stat: Optional[os.stat_result] = None,
+                  etag: Optional[str] = None, cache_control: Optional[str] = None) -> Response:
+    """The file as 200, as 206 when the request asks for ranges of the current version, or 304.
+
+    `etag` replaces the mtime-based one, e.g. with a content hash.
+    """
+    stat = stat or os.stat(path)
+    size = stat.st_size
+    default_etag, last_modified = file_validators(stat)
+    etag = etag or default_etag
+    headers: Dict[str, str] = {"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if not_modified(request, etag, stat):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    ranges = None
+    if range_header and (if_range is None or if_range_matches(if_range, etag, stat)):
+        ranges = parse_range(range_header, size)
+
+    if ranges is None:
+        headers["Content-Length"] = str(size)
+        return FileRangeResponse(path, [(0, size - 1)] if size else [], None, 200, media_type, headers)
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        headers["Content-Length"] = str(last - first + 1)
+        return FileRangeResponse(path, ranges, None, 206, media_type, headers)
+
+    # Several ranges go out as multipart/byteranges, each part with its own
+    # Content-Range; the part headers are built up front for Content-Length
+    boundary = uuid.uuid4().hex
+    parts = [
+        (b"" if i == 0 else b"\r\n")
+        + f"--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {first}-{last}/{size}\r\n\r\n".encode()
+        for i, (first, last) in enumerate(ranges)
+    ]
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    headers["Content-Length"] = str(sum(map(len, parts)) + sum(last - first + 1 for first, last in ranges))
+    return FileRangeResponse(path, ranges, parts, 206, f"multipart/byteranges; boundary={boundary}", headers)
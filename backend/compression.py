@@ -0,0 +1,53 @@
+import gzip
+import os
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt, but without it only gzip is offered
+    brotli = None
+
+# Bodies smaller than this go out as they are: below about a packet the
+# encoding overhead outweighs the saving
+COMPRESS_MIN_BYTES = int(os.environ.get("MUSIC_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# In order of preference when the client accepts several equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+def _accepted(accept_encoding: str) -> Dict[str, float]:
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred content coding an Accept-Encoding header allows, None for identity"""
+    if not accept_encoding:
+        return None
+    weights = _accepted(accept_encoding)
+    candidates = [(weights.get(coding, weights.get("*", 0.0)), -rank, coding) for rank, coding in enumerate(ENCODINGS)]
+    weight, _, coding = max(candidates)
+    return coding if weight > 0 else None
+
+def compress(body: bytes, encoding: Optional[str]) -> Optional[bytes]:
+    """The body in the given coding, or None if it is too small to be worth it"""
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return None
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical input, as a strong ETag requires
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
@@ -0,0 +1,46 @@
+import sqlite3
+from typing import Dict
+
+# Table totals kept in table_counts by triggers (see the add_counters
+# migration), so list endpoints do not run COUNT(*) per request
+COUNTED_TABLES = {
+    "songs": "SELECT COUNT(*) FROM songs",
+    "artists": "SELECT COUNT(*) FROM artists",
+    "albums": "SELECT COUNT(*) FROM albums",
+    "public_playlists": "SELECT COUNT(*) FROM playlists WHERE isPublic = 1",
+}
+
+def get_count(cursor, name: str) -> int:
+    cursor.execute('SELECT count FROM table_counts WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def recount(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Recompute every maintained counter from the base tables; the caller commits.
+
+    Links whose song or album no longer exists are not counted, which
+    repairs drift left by deletes that ran without foreign keys enabled.
+    """
+    conn.execute('DELETE FROM table_counts')
+    for name, query in COUNTED_TABLES.items():
+        conn.execute(f'INSERT INTO table_counts (name, count) SELECT ?, ({query})', (name,))
+
+    conn.execute('''
+        UPDATE artists SET
+            songCount = (
+                SELECT COUNT(*) FROM song_artists sa JOIN songs s ON s.id = sa.songId
+                WHERE sa.artistId = artists.id
+            ),
+            albumCount = (
+                SELECT COUNT(*) FROM album_artists aa JOIN albums a ON a.id = aa.albumId
+                WHERE aa.artistId = artists.id
+            )
+    ''')
+    conn.execute('UPDATE albums SET songCount = (SELECT COUNT(*) FROM songs s WHERE s.albumId = albums.id)')
+    conn.execute('''
+        UPDATE moods SET songCount = (
+            SELECT COUNT(*) FROM song_moods sm JOIN songs s ON s.id = sm.songId
+            WHERE sm.moodId = moods.id
+        )
+    ''')
+    return dict(conn.execute('SELECT name, count FROM table_counts').fetchall())
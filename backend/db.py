@@ -0,0 +1,80 @@
+import os
+import queue
+import sqlite3
+
+import anyio.to_thread
+
+# Database configuration
+DB_PATH = os.environ.get("MUSIC_DB_PATH", "music.db")
+# Route handlers are plain functions, so FastAPI runs them (and the blocking
+# sqlite3 calls inside them) on its worker thread pool instead of the event
+# loop. This caps how many of them run at once.
+DB_MAX_WORKERS = int(os.environ.get("MUSIC_DB_MAX_WORKERS", "16"))
+DB_POOL_SIZE = int(os.environ.get("MUSIC_DB_POOL_SIZE", str(DB_MAX_WORKERS)))
+
+# Applied once when a connection is opened, not on every request
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -64000),  # negative value = KiB, i.e. ~64 MB page cache
+    ("mmap_size", 268435456),  # 256 MB
+    ("temp_store", "MEMORY"),
+)
+
+def connect(path: str = None) -> sqlite3.Connection:
+    """Open a connection to the music database with tuned PRAGMAs applied"""
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False)
+    # Rows also index by column name, which the user API serializers read them by
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+class ConnectionPool:
+    """Keeps long-lived connections around so requests skip connect/close.
+
+    A connection is checked out by exactly one request at a time. When every
+    idle connection is in use a new one is opened instead of blocking, and on
+    release connections beyond the pool size are closed.
+    """
+
+    def __init__(self, path: str = None, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn: sqlite3.Connection):
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+pool = ConnectionPool()
+
+def configure_thread_pool(max_workers: int = DB_MAX_WORKERS):
+    """Bound the worker threads used for blocking handlers; call from the running loop"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max_workers
+
+def get_db():
+    """FastAPI dependency yielding a pooled connection for the current request"""
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
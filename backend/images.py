@@ -0,0 +1,277 @@
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from byte_ranges import file_response
+from media_store import media_local_path
+
+from PIL import Image, ImageOps, features
+
+# Resized cover art for /api/images. Grid pages show 64-256px tiles of
+# images that are often thousands of pixels wide and hosted elsewhere, so
+# each (source, width, format) is rendered once and kept on disk, least
+# recently used first out, within a byte budget. Requests for a derivative
+# that is being rendered wait for that render instead of starting another.
+IMAGE_CACHE_DIR = os.environ.get("MUSIC_IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("MUSIC_IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("MUSIC_IMAGE_FETCH_TIMEOUT", "15"))
+IMAGE_SOURCE_MAX_BYTES = 20 * 1024 * 1024
+# Remote sources are fetched from public addresses only; when this is set,
+# only from these hosts as well (comma-separated)
+IMAGE_ALLOWED_HOSTS = {host.strip().lower() for host in os.environ.get("MUSIC_IMAGE_ALLOWED_HOSTS", "").split(",")
+                       if host.strip()}
+# Requested widths are rounded up to one of these, so a client asking for
+# every width in turn cannot fill the cache with near-duplicates
+IMAGE_WIDTHS = (64, 128, 256, 512, 1024, 2048)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+# The image column behind each kind of /api/images key
+IMAGE_SOURCES = {
+    "songs": "coverUrl",
+    "albums": "coverUrl",
+    "artists": "avatar",
+    "playlists": "coverUrl",
+    "moods": "coverUrl",
+}
+
+WEBP = features.check("webp")
+SIGNATURES = ((b"\xff\xd8\xff", "image/jpeg"), (b"\x89PNG", "image/png"), (b"GIF8", "image/gif"),
+              (b"RIFF", "image/webp"))
+
+def check_source_url(url: str):
+    """Refuse an image URL that is not HTTP(S), not an allowed host or not a public address"""
+    parts = urllib.parse.urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError(f"Unsupported image source: {url}")
+    if IMAGE_ALLOWED_HOSTS and host not in IMAGE_ALLOWED_HOSTS:
+        raise ValueError(f"Image host not allowed: {host}")
+    for *_, sockaddr in socket.getaddrinfo(host, None, type=socket.SOCK_STREAM):
+        address = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise ValueError(f"Image host resolves to a private address: {host}")
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # A public host must not be able to redirect the fetch to an internal one
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_source_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+_opener = urllib.request.build_opener(_CheckedRedirectHandler)
+
+def fetch_source(url: str) -> bytes:
+    """Bytes of an image URL: uploads from disk, public HTTP(S) hosts over the network.
+
+    Nothing else on the server is readable through it: coverUrl is set by
+    clients (playlists), so a bare path is refused rather than opened.
+    """
+    path = media_local_path(url)
+    if path is not None and os.path.isfile(path):
+        with open(path, "rb") as file:
+            return file.read(IMAGE_SOURCE_MAX_BYTES + 1)
+    check_source_url(url)
+    request = urllib.request.Request(url, headers={"User-Agent": "Self-Music"})
+    with _opener.open(request, timeout=IMAGE_FETCH_TIMEOUT) as upstream:
+        return upstream.read(IMAGE_SOURCE_MAX_BYTES + 1)
+
+def snap_width(width: int) -> int:
+    return next((w for w in IMAGE_WIDTHS if w >= width), IMAGE_WIDTHS[-1])
+
+def _sniff(data: bytes) -> str:
+    for signature, media_type in SIGNATURES:
+        if data.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+def render(data: bytes, width: int, media_type: str) -> bytes:
+    """The image scaled down to `width` (never up) and encoded as WebP or JPEG"""
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEGs are decoded straight at a fraction (1/2 to 1/8) of their size
+        # when that still covers the target, which is most of the work saved.
+        # Both sides are kept >= width, so an EXIF rotation cannot undercut it.
+        image.draft("RGB", (width, width))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        output = io.BytesIO()
+        if media_type == "image/webp":
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            image.save(output, "WEBP", quality=WEBP_QUALITY, method=4)
+        else:
+            if "A" in image.getbands():
+                # JPEG has no alpha: flatten onto white
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+                image = background
+            image.convert("RGB").save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return output.getvalue()
+
+class Flight:
+    """One derivative being rendered, for the requests waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+class ImageCache:
+    """LRU of rendered images under `directory`, bounded by `max_bytes`.
+
+    The index is read from the directory on first use, oldest file first.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+                 fetcher: Callable[[str], bytes] = fetch_source):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher  # url -> bytes; swap for a stand-in image host
+        self._lock = threading.Lock()
+        self._files: Optional[OrderedDict] = None  # path -> size, least recently used first
+        self._flights: Dict[str, Flight] = {}  # digest -> render in progress
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _ensure_loaded(self):
+        if self._files is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self._files = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.bytes = sum(self._files.values())
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._files:
+            path, size = self._files.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def derivative(self, source: str, width: int, webp: bool) -> str:
+        """Path of the cached rendering of `source`, rendering it first if need be"""
+        variant = f"{snap_width(width)}.{'webp' if webp and WEBP else 'jpg'}"
+        digest = hashlib.sha256(f"{source}\n{variant}".encode()).hexdigest()
+        path = os.path.join(self.directory, digest + os.path.splitext(variant)[1])
+        with self._lock:
+            self._ensure_loaded()
+            if path in self._files:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            flight = self._flights.get(digest)
+            leader = flight is None
+            if leader:
+                flight = self._flights[digest] = Flight()
+
+        if not leader:
+            flight.done.wait(IMAGE_FETCH_TIMEOUT * 2)
+            if isinstance(flight.error, HTTPException):
+                # The leader's answer (413, 415) holds for this request as well
+                raise HTTPException(status_code=flight.error.status_code, detail=flight.error.detail)
+            if flight.error is not None or not flight.done.is_set():
+                raise HTTPException(status_code=502, detail="Image unavailable")
+            return self.derivative(source, width, webp)
+
+        try:
+            self._render(source, variant, path)
+        except Exception as e:
+            flight.error = e
+            if isinstance(e, HTTPException):
+                raise
+            raise HTTPException(status_code=502, detail="Image unavailable")
+        finally:
+            with self._lock:
+                self._flights.pop(digest, None)
+            flight.done.set()
+        return path
+
+    def _render(self, source: str, variant: str, path: str):
+        data = self.fetcher(source)
+        if len(data) > IMAGE_SOURCE_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Source image too large")
+        width, extension = variant.split(".")
+        try:
+            data = render(data, int(width), "image/webp" if extension == "webp" else "image/jpeg")
+        except Exception:
+            # Whatever the source is, it is never passed through undecoded
+            raise HTTPException(status_code=415, detail="Source is not a supported image")
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            old = self._files.pop(path, None)
+            self._files[path] = len(data)
+            self.bytes += len(data) - (old or 0)
+            self._evict()
+
+    def response(self, request: Request, source: str, width: int) -> Response:
+        webp = "image/webp" in request.headers.get("accept", "")
+        for _ in range(2):
+            path = self.derivative(source, width, webp)
+            try:
+                with open(path, "rb") as file:
+                    media_type = _sniff(file.read(4))
+                response = file_response(request, path, media_type, etag=f'"{os.path.basename(path)}"',
+                                         cache_control=IMAGE_CACHE_CONTROL)
+            except FileNotFoundError:
+                # Evicted in the meantime
+                continue
+            if WEBP:
+                response.headers["Vary"] = "Accept"
+            return response
+        raise HTTPException(status_code=503, detail="Image cache is too small")
+
+    def clear(self):
+        """Forget and delete every cached image; renders in flight carry on"""
+        with self._lock:
+            self._ensure_loaded()
+            for path in self._files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._files.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._ensure_loaded()
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._files),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "rendering": len(self._flights),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+image_cache = ImageCache()
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, status
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import sqlite3
@@ -14,13 +16,35 @@ import os
 import shutil
 import requests
 from datetime import datetime, timedelta
-from mutagen import File as MutagenFile
 import mimetypes
 
 # Import user routes
 from user import router as user_router
+from db import connect, get_db, pool, configure_thread_pool
+from migrations import migrate
+from playlist_songs import get_playlist_song_ids, set_playlist_songs
+from counters import recount
+from search_index import has_search_index, rebuild_search_index
+from suggest_index import suggestions
+from response_cache import response_cache
+from audio_cache import audio_cache
+from images import image_cache
+import uploads
+import media_store
+import media_files
+from metadata import extractor
+from batch_import import import_items
 
-app = FastAPI(title="Self-Music API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    configure_thread_pool()
+    extractor.start()
+    yield
+    extractor.stop()
+    pool.close()
+
+app = FastAPI(title="Self-Music API", version="1.0.0", lifespan=lifespan)
 security = HTTPBearer()
 
 SECRET_KEY = "your-secret-key-change-this-in-production"
@@ -163,12 +187,17 @@ class CheckExistsRequest(BaseModel):
     artistName: str
     albumName: Optional[str] = None
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None  # 可选，完成时校验
+
 class PlaylistReorder(BaseModel):
     songIds: List[str]
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('music.db')
+    conn = connect()
     conn.execute('PRAGMA foreign_keys = ON')
     
     # Artists table
@@ -354,6 +383,9 @@ def init_db():
         print(f"Album-Artist migration warning: {e}")
     
     conn.commit()
+    
+    # Apply versioned schema migrations (indexes, new tables)
+    migrate(conn)
     conn.close()
 
 # Auth functions
@@ -378,13 +410,11 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
 
 # Auth endpoints
 @app.post("/api/auth/login")
-async def login(user_data: UserLogin):
-    conn = sqlite3.connect('music.db')
+def login(user_data: UserLogin, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('SELECT id, username, password, role FROM users WHERE username = ?', (user_data.username,))
     user = cursor.fetchone()
-    conn.close()
     
     if not user or user[2] != hash_password(user_data.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -495,13 +525,11 @@ def manage_song_artists(cursor, song_id: str, artist_ids: List[str], primary_art
     
     # Add new associations
     now = get_current_time()
-    for i, artist_id in enumerate(artist_ids):
-        association_id = str(uuid.uuid4())
-        is_primary = (artist_id == primary_artist_id) or (i == 0 and not primary_artist_id)
-        cursor.execute('''
-            INSERT INTO song_artists (id, songId, artistId, isPrimary, createdAt)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (association_id, song_id, artist_id, is_primary, now))
+    cursor.executemany('''
+        INSERT INTO song_artists (id, songId, artistId, isPrimary, createdAt)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(str(uuid.uuid4()), song_id, artist_id, (artist_id == primary_artist_id) or (i == 0 and not primary_artist_id), now)
+          for i, artist_id in enumerate(artist_ids)])
 
 def manage_album_artists(cursor, album_id: str, artist_ids: List[str], primary_artist_id: str = None):
     """Manage artist associations for an album"""
@@ -513,22 +541,34 @@ def manage_album_artists(cursor, album_id: str, artist_ids: List[str], primary_a
     
     # Add new associations
     now = get_current_time()
-    for i, artist_id in enumerate(artist_ids):
-        association_id = str(uuid.uuid4())
-        is_primary = (artist_id == primary_artist_id) or (i == 0 and not primary_artist_id)
-        cursor.execute('''
-            INSERT INTO album_artists (id, albumId, artistId, isPrimary, createdAt)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (association_id, album_id, artist_id, is_primary, now))
+    cursor.executemany('''
+        INSERT INTO album_artists (id, albumId, artistId, isPrimary, createdAt)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(str(uuid.uuid4()), album_id, artist_id, (artist_id == primary_artist_id) or (i == 0 and not primary_artist_id), now)
+          for i, artist_id in enumerate(artist_ids)])
+
+def manage_song_moods(cursor, song_id: str, mood_ids: List[str]):
+    """Replace the mood memberships of a song, keeping the given order"""
+    cursor.execute('DELETE FROM song_moods WHERE songId = ?', (song_id,))
+    cursor.executemany('''
+        INSERT INTO song_moods (songId, moodId, position)
+        SELECT ?, id, ? FROM moods WHERE id = ?
+    ''', [(song_id, position, mood_id) for position, mood_id in enumerate(dict.fromkeys(mood_ids))])
+
+def get_song_mood_ids(cursor) -> Dict[str, List[str]]:
+    """Map every song id to its ordered mood ids"""
+    cursor.execute('SELECT songId, moodId FROM song_moods ORDER BY songId, position')
+    mood_ids = {}
+    for song_id, mood_id in cursor.fetchall():
+        mood_ids.setdefault(song_id, []).append(mood_id)
+    return mood_ids
 
 # Artist CRUD
 @app.get("/api/admin/artists")
-async def get_artists(username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def get_artists(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM artists ORDER BY createdAt DESC')
     rows = cursor.fetchall()
-    conn.close()
     
     artists = []
     for row in rows:
@@ -551,8 +591,7 @@ async def get_artists(username: str = Depends(verify_token)):
     return {"success": True, "data": artists}
 
 @app.post("/api/admin/artists")
-async def create_artist(artist: Artist, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def create_artist(artist: Artist, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     artist_id = str(uuid.uuid4())
@@ -564,62 +603,60 @@ async def create_artist(artist: Artist, username: str = Depends(verify_token)):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             artist_id, artist.name, artist.bio, artist.avatar, artist.coverUrl,
-            artist.followers, artist.songCount, artist.albumCount,
+            artist.followers, 0, 0,
             serialize_json_field(artist.genres), artist.verified, now, now
         ))
         conn.commit()
-        conn.close()
+        response_cache.invalidate("artists")
+        suggestions.upsert("artists", artist_id, artist.name)
         
         return {"success": True, "data": {"id": artist_id, **artist.dict()}}
     except sqlite3.IntegrityError:
-        conn.close()
         raise HTTPException(status_code=400, detail="Artist name already exists")
 
 @app.put("/api/admin/artists/{artist_id}")
-async def update_artist(artist_id: str, artist: Artist, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def update_artist(artist_id: str, artist: Artist, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     now = get_current_time()
     
     cursor.execute('''
-        UPDATE artists SET name=?, bio=?, avatar=?, coverUrl=?, followers=?, songCount=?, albumCount=?, genres=?, verified=?, updatedAt=?
+        UPDATE artists SET name=?, bio=?, avatar=?, coverUrl=?, followers=?, genres=?, verified=?, updatedAt=?
         WHERE id=?
     ''', (
         artist.name, artist.bio, artist.avatar, artist.coverUrl,
-        artist.followers, artist.songCount, artist.albumCount,
+        artist.followers,
         serialize_json_field(artist.genres), artist.verified, now, artist_id
     ))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Artist not found")
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("artists")
+    suggestions.upsert("artists", artist_id, artist.name)
     
     return {"success": True, "data": {"id": artist_id, **artist.dict()}}
 
 @app.delete("/api/admin/artists/{artist_id}")
-async def delete_artist(artist_id: str, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def delete_artist(artist_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('DELETE FROM artists WHERE id=?', (artist_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Artist not found")
     
     conn.commit()
-    conn.close()
+    # Song and album payloads embed their artists and are keyed on "artists" as well
+    response_cache.invalidate("artists")
+    suggestions.remove("artists", artist_id)
     
     return {"success": True, "message": "Artist deleted successfully"}
 
 # Album CRUD
 @app.get("/api/admin/albums")
-async def get_albums(username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def get_albums(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('''
         SELECT a.*, ar.name as artist_name FROM albums a 
@@ -651,18 +688,15 @@ async def get_albums(username: str = Depends(verify_token)):
         }
         albums.append(album)
     
-    conn.close()
     return {"success": True, "data": albums}
 
 @app.post("/api/admin/albums")
-async def create_album(album: Album, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def create_album(album: Album, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Verify primary artist exists
     cursor.execute('SELECT id FROM artists WHERE id=?', (album.artistId,))
     if not cursor.fetchone():
-        conn.close()
         raise HTTPException(status_code=400, detail="Primary artist not found")
     
     # Verify all artists exist if artistIds provided
@@ -670,7 +704,6 @@ async def create_album(album: Album, username: str = Depends(verify_token)):
         for artist_id in album.artistIds:
             cursor.execute('SELECT id FROM artists WHERE id=?', (artist_id,))
             if not cursor.fetchone():
-                conn.close()
                 raise HTTPException(status_code=400, detail=f"Artist {artist_id} not found")
     
     album_id = str(uuid.uuid4())
@@ -681,35 +714,26 @@ async def create_album(album: Album, username: str = Depends(verify_token)):
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         album_id, album.title, album.artistId, album.coverUrl, album.releaseDate,
-        album.songCount, album.duration, album.genre, album.description, now, now
+        0, album.duration, album.genre, album.description, now, now
     ))
     
-    # Handle multiple artists
+    # Handle multiple artists (artist album counts follow via triggers)
     artist_ids = album.artistIds if album.artistIds else [album.artistId]
     manage_album_artists(cursor, album_id, artist_ids, album.artistId)
     
-    # Update artist album counts
-    for artist_id in set(artist_ids):  # Use set to avoid duplicate updates
-        cursor.execute('UPDATE artists SET albumCount = albumCount + 1 WHERE id=?', (artist_id,))
-    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("albums")
+    suggestions.upsert("albums", album_id, album.title)
     
     return {"success": True, "data": {"id": album_id, **album.dict()}}
 
 @app.put("/api/admin/albums/{album_id}")
-async def update_album(album_id: str, album: Album, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def update_album(album_id: str, album: Album, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    # Get existing album artists for count adjustment
-    existing_artists = get_album_artists(cursor, album_id)
-    existing_artist_ids = [a['id'] for a in existing_artists]
-    
     # Verify primary artist exists
     cursor.execute('SELECT id FROM artists WHERE id=?', (album.artistId,))
     if not cursor.fetchone():
-        conn.close()
         raise HTTPException(status_code=400, detail="Primary artist not found")
     
     # Verify all artists exist if artistIds provided
@@ -717,61 +741,51 @@ async def update_album(album_id: str, album: Album, username: str = Depends(veri
         for artist_id in album.artistIds:
             cursor.execute('SELECT id FROM artists WHERE id=?', (artist_id,))
             if not cursor.fetchone():
-                conn.close()
                 raise HTTPException(status_code=400, detail=f"Artist {artist_id} not found")
     
     now = get_current_time()
     
     cursor.execute('''
-        UPDATE albums SET title=?, artistId=?, coverUrl=?, releaseDate=?, songCount=?, duration=?, genre=?, description=?, updatedAt=?
+        UPDATE albums SET title=?, artistId=?, coverUrl=?, releaseDate=?, duration=?, genre=?, description=?, updatedAt=?
         WHERE id=?
     ''', (
         album.title, album.artistId, album.coverUrl, album.releaseDate,
-        album.songCount, album.duration, album.genre, album.description, now, album_id
+        album.duration, album.genre, album.description, now, album_id
     ))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Album not found")
     
-    # Handle multiple artists
+    # Handle multiple artists (artist album counts follow via triggers)
     new_artist_ids = album.artistIds if album.artistIds else [album.artistId]
     manage_album_artists(cursor, album_id, new_artist_ids, album.artistId)
     
-    # Update artist album counts
-    # Decrease count for removed artists
-    for artist_id in set(existing_artist_ids) - set(new_artist_ids):
-        cursor.execute('UPDATE artists SET albumCount = albumCount - 1 WHERE id=? AND albumCount > 0', (artist_id,))
-    
-    # Increase count for new artists
-    for artist_id in set(new_artist_ids) - set(existing_artist_ids):
-        cursor.execute('UPDATE artists SET albumCount = albumCount + 1 WHERE id=?', (artist_id,))
-    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("albums")
+    suggestions.upsert("albums", album_id, album.title)
     
     return {"success": True, "data": {"id": album_id, **album.dict()}}
 
 @app.delete("/api/admin/albums/{album_id}")
-async def delete_album(album_id: str, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def delete_album(album_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('DELETE FROM albums WHERE id=?', (album_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Album not found")
     
     conn.commit()
-    conn.close()
+    # Song payloads embed their album, and artist payloads count albums;
+    # both are keyed on "albums" as well
+    response_cache.invalidate("albums")
+    suggestions.remove("albums", album_id)
     
     return {"success": True, "message": "Album deleted successfully"}
 
 # Song CRUD
 @app.get("/api/admin/songs")
-async def get_songs(username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def get_songs(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('''
         SELECT s.*, ar.name as artist_name, al.title as album_title 
@@ -781,6 +795,7 @@ async def get_songs(username: str = Depends(verify_token)):
         ORDER BY s.createdAt DESC
     ''')
     rows = cursor.fetchall()
+    song_mood_ids = get_song_mood_ids(cursor)
     
     songs = []
     for row in rows:
@@ -792,35 +807,36 @@ async def get_songs(username: str = Depends(verify_token)):
             "id": row[0],
             "title": row[1],
             "artistId": row[2],
-            "artistName": primary_artist['name'] if primary_artist else row[14],
+            "artistName": primary_artist['name'] if primary_artist else row["artist_name"],
             "artists": song_artists,  # All artists
             "albumId": row[3],
-            "albumTitle": row[15],
+            "albumTitle": row["album_title"],
             "duration": row[4],
             "audioUrl": row[5],
             "coverUrl": ensure_https_url(row[6]),
             "lyrics": row[7],
-            "moodIds": parse_json_field(row[8]),
+            "moodIds": song_mood_ids.get(row[0], []),
             "playCount": row[9],
             "liked": bool(row[10]),
             "genre": row[11],
             "createdAt": row[12],
-            "updatedAt": row[13]
+            "updatedAt": row[13],
+            "bitrate": row["bitrate"],
+            "sampleRate": row["sampleRate"],
+            "codec": row["codec"],
+            "metadataStatus": row["metadataStatus"]
         }
         songs.append(song)
     
-    conn.close()
     return {"success": True, "data": songs}
 
 @app.post("/api/admin/songs")
-async def create_song(song: Song, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def create_song(song: Song, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Verify primary artist exists
     cursor.execute('SELECT id FROM artists WHERE id=?', (song.artistId,))
     if not cursor.fetchone():
-        conn.close()
         raise HTTPException(status_code=400, detail="Primary artist not found")
     
     # Verify all artists exist if artistIds provided
@@ -828,7 +844,6 @@ async def create_song(song: Song, username: str = Depends(verify_token)):
         for artist_id in song.artistIds:
             cursor.execute('SELECT id FROM artists WHERE id=?', (artist_id,))
             if not cursor.fetchone():
-                conn.close()
                 raise HTTPException(status_code=400, detail=f"Artist {artist_id} not found")
     
     song_id = str(uuid.uuid4())
@@ -843,32 +858,26 @@ async def create_song(song: Song, username: str = Depends(verify_token)):
         song.playCount, song.liked, song.genre, now, now
     ))
     
-    # Handle multiple artists
+    # Handle multiple artists (artist song counts follow via triggers)
     artist_ids = song.artistIds if song.artistIds else [song.artistId]
     manage_song_artists(cursor, song_id, artist_ids, song.artistId)
-    
-    # Update artist song counts
-    for artist_id in set(artist_ids):  # Use set to avoid duplicate updates
-        cursor.execute('UPDATE artists SET songCount = songCount + 1 WHERE id=?', (artist_id,))
+    manage_song_moods(cursor, song_id, song.moodIds)
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("songs")
+    suggestions.upsert("songs", song_id, song.title)
+    # Duration, bitrate, codec etc. are read from the file in the background
+    extractor.submit(song_id, song.audioUrl)
     
-    return {"success": True, "data": {"id": song_id, **song.dict()}}
+    return {"success": True, "data": {"id": song_id, **song.dict(), "metadataStatus": "pending"}}
 
 @app.put("/api/admin/songs/{song_id}")
-async def update_song(song_id: str, song: Song, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def update_song(song_id: str, song: Song, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    # Get existing song artists for count adjustment
-    existing_artists = get_song_artists(cursor, song_id)
-    existing_artist_ids = [a['id'] for a in existing_artists]
-    
     # Verify primary artist exists
     cursor.execute('SELECT id FROM artists WHERE id=?', (song.artistId,))
     if not cursor.fetchone():
-        conn.close()
         raise HTTPException(status_code=400, detail="Primary artist not found")
     
     # Verify all artists exist if artistIds provided
@@ -876,74 +885,64 @@ async def update_song(song_id: str, song: Song, username: str = Depends(verify_t
         for artist_id in song.artistIds:
             cursor.execute('SELECT id FROM artists WHERE id=?', (artist_id,))
             if not cursor.fetchone():
-                conn.close()
                 raise HTTPException(status_code=400, detail=f"Artist {artist_id} not found")
     
+    cursor.execute('SELECT audioUrl FROM songs WHERE id=?', (song_id,))
+    current = cursor.fetchone()
+    audio_changed = current is not None and current[0] != song.audioUrl
     now = get_current_time()
     
     cursor.execute('''
-        UPDATE songs SET title=?, artistId=?, albumId=?, duration=?, audioUrl=?, coverUrl=?, lyrics=?, moodIds=?, playCount=?, liked=?, genre=?, updatedAt=?
+        UPDATE songs SET title=?, artistId=?, albumId=?, duration=?, audioUrl=?, coverUrl=?, lyrics=?, moodIds=?, playCount=?, liked=?, genre=?, updatedAt=?,
+            metadataStatus=CASE WHEN ? THEN 'pending' ELSE metadataStatus END
         WHERE id=?
     ''', (
         song.title, song.artistId, song.albumId, song.duration, song.audioUrl,
         song.coverUrl, song.lyrics, serialize_json_field(song.moodIds),
-        song.playCount, song.liked, song.genre, now, song_id
+        song.playCount, song.liked, song.genre, now, audio_changed, song_id
     ))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
-    # Handle multiple artists
+    # Handle multiple artists (artist song counts follow via triggers)
     new_artist_ids = song.artistIds if song.artistIds else [song.artistId]
     manage_song_artists(cursor, song_id, new_artist_ids, song.artistId)
-    
-    # Update artist song counts
-    # Decrease count for removed artists
-    for artist_id in set(existing_artist_ids) - set(new_artist_ids):
-        cursor.execute('UPDATE artists SET songCount = songCount - 1 WHERE id=? AND songCount > 0', (artist_id,))
-    
-    # Increase count for new artists
-    for artist_id in set(new_artist_ids) - set(existing_artist_ids):
-        cursor.execute('UPDATE artists SET songCount = songCount + 1 WHERE id=?', (artist_id,))
+    manage_song_moods(cursor, song_id, song.moodIds)
     
     conn.commit()
-    conn.close()
+    # A changed duration also moves the totals of playlists holding the song
+    response_cache.invalidate("songs", "playlists")
+    suggestions.upsert("songs", song_id, song.title)
+    if audio_changed:
+        extractor.submit(song_id, song.audioUrl)
     
     return {"success": True, "data": {"id": song_id, **song.dict()}}
 
 @app.delete("/api/admin/songs/{song_id}")
-async def delete_song(song_id: str, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def delete_song(song_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    # Get existing song artists for count adjustment
-    existing_artists = get_song_artists(cursor, song_id)
-    existing_artist_ids = [a['id'] for a in existing_artists]
-    
+    # The delete trigger removes the song's artist and mood links and
+    # updates the artist, album and mood song counts
     cursor.execute('DELETE FROM songs WHERE id=?', (song_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
-    # Update artist song counts (the song_artists associations will be deleted automatically due to CASCADE)
-    for artist_id in existing_artist_ids:
-        cursor.execute('UPDATE artists SET songCount = songCount - 1 WHERE id=? AND songCount > 0', (artist_id,))
-    
     conn.commit()
-    conn.close()
+    # Playlist payloads list their song ids
+    response_cache.invalidate("songs", "playlists")
+    suggestions.remove("songs", song_id)
     
     return {"success": True, "message": "Song deleted successfully"}
 
 # Mood CRUD
 @app.get("/api/admin/moods")
-async def get_moods(username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def get_moods(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM moods ORDER BY createdAt DESC')
     rows = cursor.fetchall()
-    conn.close()
     
     moods = []
     for row in rows:
@@ -963,8 +962,7 @@ async def get_moods(username: str = Depends(verify_token)):
     return {"success": True, "data": moods}
 
 @app.post("/api/admin/moods")
-async def create_mood(mood: Mood, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def create_mood(mood: Mood, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     mood_id = str(uuid.uuid4())
@@ -976,64 +974,61 @@ async def create_mood(mood: Mood, username: str = Depends(verify_token)):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             mood_id, mood.name, mood.description, mood.icon, mood.color,
-            mood.coverUrl, mood.songCount, now, now
+            mood.coverUrl, 0, now, now
         ))
         conn.commit()
-        conn.close()
+        response_cache.invalidate("moods")
         
         return {"success": True, "data": {"id": mood_id, **mood.dict()}}
     except sqlite3.IntegrityError:
-        conn.close()
         raise HTTPException(status_code=400, detail="Mood name already exists")
 
 @app.put("/api/admin/moods/{mood_id}")
-async def update_mood(mood_id: str, mood: Mood, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def update_mood(mood_id: str, mood: Mood, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     now = get_current_time()
     
     cursor.execute('''
-        UPDATE moods SET name=?, description=?, icon=?, color=?, coverUrl=?, songCount=?, updatedAt=?
+        UPDATE moods SET name=?, description=?, icon=?, color=?, coverUrl=?, updatedAt=?
         WHERE id=?
     ''', (
         mood.name, mood.description, mood.icon, mood.color,
-        mood.coverUrl, mood.songCount, now, mood_id
+        mood.coverUrl, now, mood_id
     ))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Mood not found")
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("moods")
     
     return {"success": True, "data": {"id": mood_id, **mood.dict()}}
 
 @app.delete("/api/admin/moods/{mood_id}")
-async def delete_mood(mood_id: str, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def delete_mood(mood_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('DELETE FROM moods WHERE id=?', (mood_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Mood not found")
     
+    cursor.execute('DELETE FROM song_moods WHERE moodId=?', (mood_id,))
+    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("moods")
     
     return {"success": True, "message": "Mood deleted successfully"}
 
 # Playlist CRUD
 @app.get("/api/admin/playlists")
-async def get_playlists(username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def get_playlists(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM playlists ORDER BY createdAt DESC')
     rows = cursor.fetchall()
-    conn.close()
+    
+    song_ids_by_playlist = get_playlist_song_ids(cursor)
     
     playlists = []
     for row in rows:
@@ -1042,7 +1037,7 @@ async def get_playlists(username: str = Depends(verify_token)):
             "name": row[1],
             "description": row[2],
             "coverUrl": ensure_https_url(row[3]),
-            "songIds": parse_json_field(row[4]),
+            "songIds": song_ids_by_playlist.get(row[0], []),
             "songCount": row[5],
             "playCount": row[6],
             "duration": row[7],
@@ -1056,88 +1051,85 @@ async def get_playlists(username: str = Depends(verify_token)):
     return {"success": True, "data": playlists}
 
 @app.post("/api/admin/playlists")
-async def create_playlist(playlist: Playlist, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def create_playlist(playlist: Playlist, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     playlist_id = str(uuid.uuid4())
     now = get_current_time()
     
     cursor.execute('''
-        INSERT INTO playlists (id, name, description, coverUrl, songIds, songCount, playCount, duration, creator, isPublic, createdAt, updatedAt)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO playlists (id, name, description, coverUrl, songCount, playCount, duration, creator, isPublic, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         playlist_id, playlist.name, playlist.description, playlist.coverUrl,
-        serialize_json_field(playlist.songIds), playlist.songCount, playlist.playCount,
+        playlist.songCount, playlist.playCount,
         playlist.duration, playlist.creator, playlist.isPublic, now, now
     ))
     
+    set_playlist_songs(cursor, playlist_id, playlist.songIds)
+    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True, "data": {"id": playlist_id, **playlist.dict()}}
 
 @app.put("/api/admin/playlists/{playlist_id}")
-async def update_playlist(playlist_id: str, playlist: Playlist, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def update_playlist(playlist_id: str, playlist: Playlist, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     now = get_current_time()
     
     cursor.execute('''
-        UPDATE playlists SET name=?, description=?, coverUrl=?, songIds=?, songCount=?, playCount=?, duration=?, creator=?, isPublic=?, updatedAt=?
+        UPDATE playlists SET name=?, description=?, coverUrl=?, songCount=?, playCount=?, duration=?, creator=?, isPublic=?, updatedAt=?
         WHERE id=?
     ''', (
         playlist.name, playlist.description, playlist.coverUrl,
-        serialize_json_field(playlist.songIds), playlist.songCount, playlist.playCount,
+        playlist.songCount, playlist.playCount,
         playlist.duration, playlist.creator, playlist.isPublic, now, playlist_id
     ))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Playlist not found")
     
+    set_playlist_songs(cursor, playlist_id, playlist.songIds)
+    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True, "data": {"id": playlist_id, **playlist.dict()}}
 
 @app.delete("/api/admin/playlists/{playlist_id}")
-async def delete_playlist(playlist_id: str, username: str = Depends(verify_token)):
-    conn = sqlite3.connect('music.db')
+def delete_playlist(playlist_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('DELETE FROM playlists WHERE id=?', (playlist_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Playlist not found")
     
+    cursor.execute('DELETE FROM playlist_songs WHERE playlistId=?', (playlist_id,))
+    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True, "message": "Playlist deleted successfully"}
 
 @app.put("/api/admin/playlists/{playlist_id}/reorder")
-async def reorder_playlist_songs(playlist_id: str, reorder_data: PlaylistReorder, username: str = Depends(verify_token)):
+def reorder_playlist_songs(playlist_id: str, reorder_data: PlaylistReorder, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     """重新排序歌单中的歌曲"""
-    conn = sqlite3.connect('music.db')
     cursor = conn.cursor()
     
     # Check if playlist exists
-    cursor.execute('SELECT songIds, songCount FROM playlists WHERE id = ?', (playlist_id,))
-    playlist_row = cursor.fetchone()
+    cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
     
-    if not playlist_row:
-        conn.close()
+    if not cursor.fetchone():
         raise HTTPException(status_code=404, detail="Playlist not found")
     
-    current_song_ids = parse_json_field(playlist_row[0])
+    current_song_ids = get_playlist_song_ids(cursor, [playlist_id])[playlist_id]
     new_song_ids = reorder_data.songIds
     
     # Validate that all songs in new order exist in current playlist
     if set(current_song_ids) != set(new_song_ids):
-        conn.close()
         raise HTTPException(status_code=400, detail="Song IDs do not match current playlist")
     
     # Validate that all song IDs exist in the database
@@ -1147,50 +1139,115 @@ async def reorder_playlist_songs(playlist_id: str, reorder_data: PlaylistReorder
         count = cursor.fetchone()[0]
         
         if count != len(new_song_ids):
-            conn.close()
             raise HTTPException(status_code=400, detail="Some songs not found in database")
     
     # Update the playlist with new song order
-    cursor.execute('''
-        UPDATE playlists SET songIds=?, updatedAt=?
-        WHERE id=?
-    ''', (
-        serialize_json_field(new_song_ids),
-        get_current_time(),
-        playlist_id
-    ))
+    set_playlist_songs(cursor, playlist_id, new_song_ids)
+    cursor.execute('UPDATE playlists SET updatedAt=? WHERE id=?', (get_current_time(), playlist_id))
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True, "message": "Playlist order updated successfully"}
 
+@app.post("/api/admin/recount")
+def recount_counters(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
+    """重新统计所有计数（修复计数偏差）"""
+    totals = recount(conn)
+    conn.commit()
+    # Counts are embedded in song and playlist payloads as well
+    response_cache.invalidate("artists", "albums", "moods", "songs", "playlists")
+    
+    return {"success": True, "data": totals}
+
+@app.post("/api/admin/search/rebuild")
+def rebuild_search(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
+    """重建全文搜索索引（例如在 VACUUM 之后）"""
+    if not has_search_index(conn.cursor()):
+        raise HTTPException(status_code=400, detail="Search index is not available")
+    
+    rebuild_search_index(conn)
+    conn.commit()
+    # Search results may differ from those answered before the rebuild
+    response_cache.invalidate("songs", "artists", "albums", "playlists")
+    
+    return {"success": True, "message": "Search index rebuilt successfully"}
+
+@app.get("/api/admin/cache/stats")
+def get_cache_stats(username: str = Depends(verify_token)):
+    """响应缓存、远程音频缓存、图片缓存与元数据提取统计"""
+    return {"success": True, "data": {**response_cache.stats(), "audio": audio_cache.stats(),
+                                      "images": image_cache.stats(), "metadata": extractor.stats()}}
+
+@app.post("/api/admin/cache/clear")
+def clear_cache(username: str = Depends(verify_token)):
+    """清空响应缓存与图片缓存"""
+    response_cache.clear()
+    image_cache.clear()
+    
+    return {"success": True, "message": "Cache cleared successfully"}
+
 # File upload endpoint
 @app.post("/api/admin/upload")
-async def upload_file(file: UploadFile = File(...), username: str = Depends(verify_token)):
+def upload_file(file: UploadFile = File(...), username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file selected")
+    if file.size is not None and file.size > uploads.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {uploads.UPLOAD_MAX_BYTES} byte upload limit")
     
-    # Create uploads directory if it doesn't exist
-    os.makedirs("uploads", exist_ok=True)
+    # Stored under its SHA-256, so re-uploading the same file reuses it
+    stored = media_store.store_stream(conn, file.file, media_store.clean_extension(file.filename))
     
-    # Generate unique filename
-    file_id = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1]
-    filename = f"{file_id}{file_extension}"
-    file_path = f"uploads/{filename}"
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    return {"success": True, "data": {"filename": filename, "url": f"/uploads/{filename}"}}
+    return {"success": True, "data": stored}
+
+# Resumable chunked upload endpoints
+@app.post("/api/admin/uploads")
+def create_upload(upload: UploadSessionCreate, username: str = Depends(verify_token)):
+    """创建分片上传会话，返回会话 ID 与建议分片大小"""
+    if upload.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    session = uploads.create_session(upload.filename, upload.size, upload.sha256)
+    return {"success": True, "data": session.to_dict()}
+
+@app.get("/api/admin/uploads/{upload_id}")
+def get_upload(upload_id: str, username: str = Depends(verify_token)):
+    """查询已接收的字节区间，用于断点续传"""
+    return {"success": True, "data": uploads.get_session(upload_id).to_dict()}
+
+@app.put("/api/admin/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0), username: str = Depends(verify_token)):
+    """写入一个分片（请求体为原始字节，offset 为其在文件中的位置）；分片可并行、乱序上传"""
+    # The session may have to be read back from disk
+    session = await run_in_threadpool(uploads.get_session, upload_id)
+    return {"success": True, "data": await uploads.receive_chunk(session, offset, request.stream())}
+
+@app.post("/api/admin/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
+    """校验完整性与 SHA-256 后存入内容寻址的媒体库"""
+    return {"success": True, "data": uploads.get_session(upload_id).complete(conn)}
+
+@app.delete("/api/admin/uploads/{upload_id}")
+def abort_upload(upload_id: str, username: str = Depends(verify_token)):
+    """放弃上传并删除已接收的分片"""
+    uploads.get_session(upload_id)
+    uploads.discard_session(upload_id)
+    return {"success": True, "message": "Upload aborted"}
+
+@app.api_route("/uploads/{path:path}", methods=["GET", "HEAD"])
+def serve_upload_file(path: str, request: Request):
+    """上传文件的静态访问：内容寻址文件长期缓存，支持 Range 与条件请求"""
+    # A plain def: the realpath, stat and small-file reads run on the threadpool
+    return media_files.serve_upload(request, path)
+
+@app.post("/api/admin/media/gc")
+def collect_media_garbage(username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
+    """删除没有任何歌曲、专辑、艺术家、歌单或心情引用的媒体文件（新上传的文件有宽限期）"""
+    return {"success": True, "data": media_store.collect_garbage(conn)}
 
 # Import endpoints
 @app.post("/api/admin/import/check-exists")
-async def check_song_exists(request: CheckExistsRequest, username: str = Depends(verify_token)):
+def check_song_exists(request: CheckExistsRequest, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
     """检查歌曲是否已存在于数据库中"""
-    conn = sqlite3.connect('music.db')
     cursor = conn.cursor()
     
     try:
@@ -1219,162 +1276,24 @@ async def check_song_exists(request: CheckExistsRequest, username: str = Depends
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"检查失败: {str(e)}")
-    finally:
-        conn.close()
 
 @app.post("/api/admin/import/batch")
-async def batch_import(request: ImportBatchRequest, username: str = Depends(verify_token)):
-    """批量导入音乐数据"""
-    conn = sqlite3.connect('music.db')
-    cursor = conn.cursor()
-    
-    imported_count = 0
-    skipped_count = 0
-    errors = []
-    results = []
-    
+def batch_import(request: ImportBatchRequest, username: str = Depends(verify_token), conn: sqlite3.Connection = Depends(get_db)):
+    """批量导入音乐数据（整批在一个事务中完成）"""
     try:
-        for item in request.items:
-            try:
-                song_info = item.songInfo
-                album_info = item.albumInfo
-                artists_info = item.artistsInfo
-                lyrics = item.lyrics
-                audio_url = item.audioUrl  # 使用传入的音频URL
-                
-                # 检查歌曲是否已存在
-                if item.skipIfExists:
-                    cursor.execute('''
-                        SELECT s.id FROM songs s 
-                        JOIN artists ar ON s.artistId = ar.id 
-                        WHERE s.title = ? AND ar.name = ?
-                    ''', (song_info.name, artists_info[0].name if artists_info else ''))
-                    
-                    existing = cursor.fetchone()
-                    if existing:
-                        skipped_count += 1
-                        results.append({
-                            "songId": song_info.songId,
-                            "status": "skipped",
-                            "reason": "歌曲已存在"
-                        })
-                        continue
-                
-                # 导入或获取艺术家
-                created_artists = []
-                primary_artist_id = None
-                
-                for i, artist_info in enumerate(artists_info):
-                    # 检查艺术家是否已存在
-                    cursor.execute('SELECT id FROM artists WHERE name = ?', (artist_info.name,))
-                    existing_artist = cursor.fetchone()
-                    
-                    if existing_artist:
-                        artist_id = existing_artist[0]
-                    else:
-                        # 创建新艺术家
-                        artist_id = str(uuid.uuid4())
-                        now = get_current_time()
-                        cursor.execute('''
-                            INSERT INTO artists (id, name, bio, avatar, coverUrl, followers, songCount, albumCount, genres, verified, createdAt, updatedAt)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            artist_id, artist_info.name, 
-                            artist_info.intro[:500] if artist_info.intro else None,  # 限制简介长度
-                            ensure_https_url(artist_info.avatarUrl), ensure_https_url(artist_info.avatarUrl), 
-                            int(artist_info.fanCount.replace(',', '')) if artist_info.fanCount and artist_info.fanCount.replace(',', '').isdigit() else 0,
-                            0, 0, "[]", False, now, now
-                        ))
-                    
-                    created_artists.append(artist_id)
-                    if i == 0:  # 第一个艺术家作为主艺术家
-                        primary_artist_id = artist_id
-                
-                # 导入或获取专辑
-                album_id = None
-                if album_info:
-                    # 检查专辑是否已存在（基于标题和主艺术家）
-                    cursor.execute('''
-                        SELECT id FROM albums WHERE title = ? AND artistId = ?
-                    ''', (album_info.title, primary_artist_id))
-                    existing_album = cursor.fetchone()
-                    
-                    if existing_album:
-                        album_id = existing_album[0]
-                    else:
-                        # 创建新专辑
-                        album_id = str(uuid.uuid4())
-                        now = get_current_time()
-                        cursor.execute('''
-                            INSERT INTO albums (id, title, artistId, coverUrl, releaseDate, songCount, duration, genre, description, createdAt, updatedAt)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            album_id, album_info.title, primary_artist_id, ensure_https_url(album_info.coverUrl),
-                            album_info.releaseDate, 0, 0, None, album_info.description, now, now
-                        ))
-                        
-                        # 创建专辑-艺术家关联
-                        manage_album_artists(cursor, album_id, created_artists, primary_artist_id)
-                        
-                        # 更新艺术家专辑计数
-                        for artist_id in created_artists:
-                            cursor.execute('UPDATE artists SET albumCount = albumCount + 1 WHERE id=?', (artist_id,))
-                
-                # 创建歌曲
-                song_id = str(uuid.uuid4())
-                now = get_current_time()
-                
-                cursor.execute('''
-                    INSERT INTO songs (id, title, artistId, albumId, duration, audioUrl, coverUrl, lyrics, moodIds, playCount, liked, genre, createdAt, updatedAt)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    song_id, song_info.name, primary_artist_id, album_id, song_info.duration,
-                    audio_url, ensure_https_url(song_info.img), lyrics, "[]", 0, False, None, now, now
-                ))
-                
-                # 创建歌曲-艺术家关联
-                manage_song_artists(cursor, song_id, created_artists, primary_artist_id)
-                
-                # 更新艺术家歌曲计数
-                for artist_id in created_artists:
-                    cursor.execute('UPDATE artists SET songCount = songCount + 1 WHERE id=?', (artist_id,))
-                
-                # 更新专辑歌曲计数
-                if album_id:
-                    cursor.execute('UPDATE albums SET songCount = songCount + 1 WHERE id=?', (album_id,))
-                
-                imported_count += 1
-                results.append({
-                    "songId": song_info.songId,
-                    "status": "imported",
-                    "localId": song_id
-                })
-                
-            except Exception as e:
-                errors.append(f"导入歌曲 {song_info.name} 失败: {str(e)}")
-                results.append({
-                    "songId": song_info.songId,
-                    "status": "error",
-                    "reason": str(e)
-                })
-        
+        summary, new_names, new_songs = import_items(conn, request.items)
         conn.commit()
-        
-        return {
-            "success": True,
-            "imported": imported_count,
-            "skipped": skipped_count,
-            "errors": errors,
-            "details": results
-        }
-        
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"批量导入失败: {str(e)}")
-    finally:
-        conn.close()
+    
+    response_cache.invalidate("artists", "albums", "songs")
+    for kind, item_id, name in new_names:
+        suggestions.upsert(kind, item_id, name)
+    extractor.submit_many(new_songs)
+    
+    return summary
 
 if __name__ == "__main__":
-    init_db()
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
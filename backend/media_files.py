@@ -0,0 +1,105 @@
+import mimetypes
+import os
+import re
+import stat as stat_module
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from byte_ranges import file_response, file_validators, not_modified
+from media_store import UPLOAD_DIR
+
+# Serving of uploaded files under /uploads. Content-addressed media
+# (uploads/media/<ab>/<cd>/<sha256><ext>) can never change under its name, so
+# it is cached by clients for a year with the hash as its ETag; older
+# uuid-named uploads are revalidated. Large files go out through
+# byte_ranges (ranges, sendfile where the server offers it); small ones,
+# cover thumbnails mostly, are answered from memory.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+SMALL_FILE_MAX_BYTES = 64 * 1024
+SMALL_FILE_CACHE_BYTES = int(os.environ.get("MUSIC_MEDIA_MEMORY_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+CONTENT_ADDRESSED = re.compile(r"media/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,8})?")
+
+class SmallFileCache:
+    """LRU of small file bodies, each checked against the file's current stat on use"""
+
+    def __init__(self, max_bytes: int = SMALL_FILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path -> (stat key, body)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, key: tuple):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, path: str, key: tuple, body: bytes):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._entries[path] = (key, body)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self.bytes, "maxBytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+small_files = SmallFileCache()
+
+def _resolve(path: str) -> str:
+    root = os.path.realpath(UPLOAD_DIR)
+    full_path = os.path.realpath(os.path.join(root, path))
+    # Nothing outside uploads/, and no upload sessions or temporary files
+    if not full_path.startswith(root + os.sep) or any(
+            part.startswith(".") for part in os.path.relpath(full_path, root).split(os.sep)):
+        raise HTTPException(status_code=404, detail="File not found")
+    return full_path
+
+def serve_upload(request: Request, path: str) -> Response:
+    full_path = _resolve(path)
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    content_addressed = CONTENT_ADDRESSED.fullmatch(path)
+    if content_addressed:
+        etag, cache_control = f'"{content_addressed[1]}"', IMMUTABLE_CACHE_CONTROL
+    else:
+        etag, cache_control = file_validators(stat)[0], REVALIDATE_CACHE_CONTROL
+
+    if stat.st_size > SMALL_FILE_MAX_BYTES or "range" in request.headers:
+        return file_response(request, full_path, media_type, stat=stat, etag=etag, cache_control=cache_control)
+
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": file_validators(stat)[1],
+               "Cache-Control": cache_control}
+    if not_modified(request, etag, stat):
+        return Response(status_code=304, headers=headers)
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    body = small_files.get(full_path, key)
+    if body is None:
+        with open(full_path, "rb") as file:
+            body = file.read()
+        small_files.put(full_path, key, body)
+    return Response(content=body, media_type=media_type, headers=headers)
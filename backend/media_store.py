@@ -0,0 +1,114 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import BinaryIO, Dict, Optional
+
+# Content-addressed storage for uploads: a file is stored once under its
+# SHA-256, at uploads/media/<ab>/<cd>/<sha256><ext>, so identical uploads
+# share one file and a URL always names the same bytes (safe to cache
+# forever). media_blobs lists the stored files; media_refs, maintained by
+# triggers, records which rows point at them, so blobs nothing points at can
+# be garbage-collected.
+UPLOAD_DIR = "uploads"
+MEDIA_DIR = os.path.join(UPLOAD_DIR, "media")
+MEDIA_URL_PREFIX = "/uploads/media/"
+# Unreferenced blobs younger than this are kept: an upload is stored before
+# the song or album that uses it is saved
+MEDIA_GC_GRACE = float(os.environ.get("MUSIC_MEDIA_GC_GRACE", str(24 * 3600)))
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Serializes placing files with deleting them, so a collection cannot remove
+# a blob that an upload has just deduplicated against
+_lock = threading.Lock()
+
+def clean_extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if re.fullmatch(r"\.[a-z0-9]{1,8}", extension) else ""
+
+def media_path(digest: str, extension: str) -> str:
+    return os.path.join(MEDIA_DIR, digest[:2], digest[2:4], digest + extension)
+
+def media_url(digest: str, extension: str) -> str:
+    return f"{MEDIA_URL_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+def media_local_path(url: str) -> Optional[str]:
+    """The file under uploads/ a URL points at (relative, or absolute to this or another host), if any"""
+    position = url.find("/" + UPLOAD_DIR + "/")
+    if position == -1 or (position > 0 and not url.startswith(("http://", "https://"))):
+        return None
+    relative = url[position + len(UPLOAD_DIR) + 2:].split("?", 1)[0].split("#", 1)[0]
+    root = os.path.realpath(UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, relative))
+    return path if path.startswith(root + os.sep) else None
+
+def store_file(conn: sqlite3.Connection, source_path: str, extension: str, digest: Optional[str] = None) -> Dict:
+    """Move a finished file into the store (or drop it if already stored) and commit its blob row.
+
+    `digest` is the file's SHA-256 when the caller already computed it.
+    """
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(source_path, "rb") as source:
+            for block in iter(lambda: source.read(COPY_BLOCK_SIZE), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+    size = os.path.getsize(source_path)
+
+    with _lock:
+        row = conn.execute('SELECT extension FROM media_blobs WHERE hash = ?', (digest,)).fetchone()
+        if row is not None:
+            # Same bytes as a stored blob: keep the name it was first stored under
+            extension = row[0]
+        path = media_path(digest, extension)
+        if os.path.exists(path):
+            os.remove(source_path)
+            deduplicated = True
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(source_path, path)
+            deduplicated = False
+        conn.execute('''
+            INSERT INTO media_blobs (hash, extension, size, storedAt, createdAt) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(hash) DO UPDATE SET storedAt = excluded.storedAt
+        ''', (digest, extension, size, time.time(), datetime.now().isoformat()))
+        conn.commit()
+
+    return {"filename": digest + extension, "url": media_url(digest, extension), "size": size,
+            "sha256": digest, "deduplicated": deduplicated}
+
+def store_stream(conn: sqlite3.Connection, source: BinaryIO, extension: str) -> Dict:
+    """Store the contents of a file object, hashing it while it is copied"""
+    temp_dir = os.path.join(MEDIA_DIR, ".tmp")
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+    sha256 = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as target:
+            for block in iter(lambda: source.read(COPY_BLOCK_SIZE), b""):
+                sha256.update(block)
+                target.write(block)
+        return store_file(conn, temp_path, extension, sha256.hexdigest())
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def collect_garbage(conn: sqlite3.Connection, grace: float = MEDIA_GC_GRACE) -> Dict:
+    """Delete blobs no row refers to that were last stored more than `grace` seconds ago"""
+    with _lock:
+        orphans = conn.execute('''
+            SELECT hash, extension, size FROM media_blobs b
+            WHERE storedAt < ? AND NOT EXISTS (SELECT 1 FROM media_refs r WHERE r.hash = b.hash)
+        ''', (time.time() - grace,)).fetchall()
+        conn.executemany('DELETE FROM media_blobs WHERE hash = ?', [(digest,) for digest, _, _ in orphans])
+        conn.commit()
+        for digest, extension, _ in orphans:
+            try:
+                os.remove(media_path(digest, extension))
+            except FileNotFoundError:
+                pass
+    return {"removed": len(orphans), "freedBytes": sum(size for _, _, size in orphans)}
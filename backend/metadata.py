@@ -0,0 +1,238 @@
+import io
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from db import connect
+from media_store import media_local_path, store_stream
+from response_cache import response_cache
+
+# Reads duration, bitrate, sample rate, codec, tags and embedded cover art
+# from audio files, in the background after a song is saved or imported.
+# Parsing is CPU-bound, so it runs on a process pool; a writer thread folds
+# the results into the songs table in batches. songs.metadataStatus tracks
+# each song: pending -> done | failed | skipped (remote or no audio file).
+METADATA_WORKERS = int(os.environ.get("MUSIC_METADATA_WORKERS", str(min(4, os.cpu_count() or 1))))
+BATCH_SIZE = 64
+BATCH_WINDOW = 0.5  # seconds a batch waits to fill up
+COVER_MAX_BYTES = 10 * 1024 * 1024
+# Tags kept in songs.audioTags, by their mutagen "easy" names
+TAG_NAMES = ("title", "artist", "albumartist", "album", "genre", "date", "tracknumber", "discnumber",
+             "composer")
+# The same tags as ID3 frames, for files mutagen has no "easy" view of (WAV, AIFF)
+ID3_FRAMES = {"title": "TIT2", "artist": "TPE1", "albumartist": "TPE2", "album": "TALB", "genre": "TCON",
+              "date": "TDRC", "tracknumber": "TRCK", "discnumber": "TPOS", "composer": "TCOM"}
+COVER_EXTENSIONS = {"image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png", "image/gif": ".gif",
+                    "image/webp": ".webp"}
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+def _cover(audio) -> Optional[Tuple[bytes, str]]:
+    """The front cover (or first picture) embedded in a file, as (data, mime type)"""
+    pictures = list(getattr(audio, "pictures", None) or [])  # FLAC, Ogg
+    tags = audio.tags
+    if tags is not None and hasattr(tags, "getall"):  # ID3
+        pictures += tags.getall("APIC")
+    if pictures:
+        front = next((p for p in pictures if getattr(p, "type", None) == 3), pictures[0])
+        return bytes(front.data), front.mime
+    covers = tags.get("covr") if tags is not None and hasattr(tags, "get") else None  # MP4
+    if covers:
+        cover = covers[0]
+        return bytes(cover), "image/png" if getattr(cover, "imageformat", None) == 14 else "image/jpeg"
+    return None
+
+def extract(path: str) -> Dict:
+    """Metadata of one audio file; runs in a worker process"""
+    from mutagen import File as MutagenFile
+
+    audio = MutagenFile(path)
+    if audio is None:
+        raise ValueError("Unrecognized audio format")
+    info = audio.info
+    codec = getattr(info, "codec", None) or (audio.mime[0].split("/")[-1] if audio.mime else type(audio).__name__)
+    tags = {}
+    easy = MutagenFile(path, easy=True)
+    if easy is not None and easy.tags is not None and not hasattr(easy.tags, "getall"):
+        for name in TAG_NAMES:
+            values = easy.tags.get(name)
+            if values:
+                tags[name] = str(values[0])
+    elif audio.tags is not None and hasattr(audio.tags, "getall"):
+        for name, frame_id in ID3_FRAMES.items():
+            frames = audio.tags.getall(frame_id)
+            if frames and frames[0].text:
+                tags[name] = str(frames[0].text[0])
+    cover = _cover(audio)
+    if cover is not None and len(cover[0]) > COVER_MAX_BYTES:
+        cover = None
+    return {
+        "duration": int(round(getattr(info, "length", 0) or 0)),
+        "bitrate": int(getattr(info, "bitrate", 0) or 0) or None,
+        "sampleRate": int(getattr(info, "sample_rate", 0) or 0) or None,
+        "codec": codec,
+        "tags": tags,
+        "cover": cover,
+    }
+
+def audio_file(audio_url: Optional[str]) -> Optional[str]:
+    """The local file behind an audioUrl, or None when it is remote or missing"""
+    if not audio_url:
+        return None
+    path = media_local_path(audio_url)
+    if path is None and not audio_url.startswith(("http://", "https://")):
+        path = audio_url  # a path on this server, as the stream endpoint reads it
+    return path if path and os.path.isfile(path) else None
+
+class MetadataExtractor:
+    """Queues songs for extraction and writes their results back in batches.
+
+    The pool and the writer start on first use; `start()` also requeues songs
+    left pending by a previous run.
+    """
+
+    def __init__(self, workers: int = METADATA_WORKERS, db_path: Optional[str] = None):
+        self.workers = workers
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._writer: Optional[threading.Thread] = None
+        self._results: "queue.Queue" = queue.Queue()
+        self._in_flight: Dict[str, str] = {}  # song id -> audioUrl being extracted
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _ensure_started(self):
+        if self._pool is None:
+            # Spawned, not forked: the server process has threads of its own
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            self._writer = threading.Thread(target=self._write_results, daemon=True)
+            self._writer.start()
+
+    def start(self):
+        conn = connect(self.db_path)
+        try:
+            pending = conn.execute('SELECT id, audioUrl FROM songs WHERE metadataStatus = ?',
+                                   (STATUS_PENDING,)).fetchall()
+        finally:
+            conn.close()
+        self.submit_many((row[0], row[1]) for row in pending)
+
+    def submit(self, song_id: str, audio_url: Optional[str]):
+        self.submit_many([(song_id, audio_url)])
+
+    def submit_many(self, songs: Iterable[Tuple[str, Optional[str]]]):
+        """Queue (song id, audioUrl) pairs; call after the rows are committed"""
+        with self._lock:
+            for song_id, audio_url in songs:
+                if song_id in self._in_flight and self._in_flight[song_id] == audio_url:
+                    continue
+                path = audio_file(audio_url)
+                if path is None:
+                    self._results.put((song_id, audio_url, None, None))
+                    self._ensure_started()
+                    continue
+                self._ensure_started()
+                self._in_flight[song_id] = audio_url
+                future = self._pool.submit(extract, path)
+                future.add_done_callback(
+                    lambda f, song_id=song_id, audio_url=audio_url: self._collect(f, song_id, audio_url))
+
+    def _collect(self, future, song_id: str, audio_url: str):
+        if future.cancelled():
+            # Shutting down; the song stays pending for the next start
+            return
+        error = future.exception()
+        self._results.put((song_id, audio_url, None if error else future.result(), error))
+
+    def _write_results(self):
+        conn = connect(self.db_path)
+        while True:
+            batch = [self._results.get()]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._results.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            try:
+                if batch:
+                    self._write_batch(conn, batch)
+            except Exception as e:
+                # The batch is lost, not the writer: its songs stay pending
+                # and are picked up again on the next start
+                conn.rollback()
+                print(f"Metadata write-back failed: {e}")
+            with self._lock:
+                for song_id, audio_url, _, _ in batch:
+                    # Skipped songs were never in flight
+                    if song_id in self._in_flight and self._in_flight[song_id] == audio_url:
+                        self._in_flight.pop(song_id)
+            if stopping:
+                conn.close()
+                return
+
+    def _write_batch(self, conn: sqlite3.Connection, batch):
+        updates, statuses = [], []
+        for song_id, audio_url, result, error in batch:
+            if result is None:
+                status = STATUS_SKIPPED if error is None else STATUS_FAILED
+                statuses.append((status, song_id, audio_url))
+                if error is None:
+                    self.skipped += 1
+                else:
+                    self.failed += 1
+                continue
+            cover_url = None
+            row = conn.execute('SELECT coverUrl FROM songs WHERE id = ?', (song_id,)).fetchone()
+            if result["cover"] is not None and row is not None and not row[0]:
+                data, mime = result["cover"]
+                # Stored (and committed) ahead of the batch, as an upload would be
+                cover_url = store_stream(conn, io.BytesIO(data), COVER_EXTENSIONS.get(mime, ".jpg"))["url"]
+            updates.append((result["duration"], result["duration"], result["bitrate"], result["sampleRate"],
+                            result["codec"], json.dumps(result["tags"], ensure_ascii=False),
+                            result["tags"].get("genre"), cover_url, STATUS_DONE, song_id, audio_url))
+            self.completed += 1
+
+        # One transaction; rows whose audioUrl changed meanwhile are left to
+        # the extraction their new file queued
+        conn.executemany('''
+            UPDATE songs SET duration = CASE WHEN ? > 0 THEN ? ELSE duration END,
+                bitrate = ?, sampleRate = ?, codec = ?, audioTags = ?,
+                genre = COALESCE(NULLIF(genre, ''), ?), coverUrl = COALESCE(NULLIF(coverUrl, ''), ?),
+                metadataStatus = ?
+            WHERE id = ? AND audioUrl IS ?
+        ''', updates)
+        conn.executemany('UPDATE songs SET metadataStatus = ? WHERE id = ? AND audioUrl IS ?', statuses)
+        conn.commit()
+        if updates:
+            # Durations feed album/playlist payloads and playlist totals
+            response_cache.invalidate("songs", "albums", "playlists")
+
+    def stop(self):
+        with self._lock:
+            pool, writer = self._pool, self._writer
+            self._pool = self._writer = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._results.put(None)
+            writer.join(timeout=5)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"workers": self.workers, "inFlight": len(self._in_flight), "completed": self.completed,
+                    "failed": self.failed, "skipped": self.skipped}
+
+extractor = MetadataExtractor()
@@ -0,0 +1,431 @@
+import json
+import sqlite3
+import time
+
+
+# Schema migrations, applied in order on top of the tables created by
+# init_db(). The number of applied migrations is stored in
+# PRAGMA user_version, so only append to this list - never reorder or edit
+# a migration that has shipped.
+#
+# A migration runs against the schema as it was when it shipped, so it
+# carries its own DDL and SQL (in its body or in the frozen definitions
+# next to it) instead of calling live helpers such as counters.recount()
+# or search_index.rebuild_search_index(), which move on with the code.
+# Changing a trigger or table means writing a new migration.
+MIGRATIONS = []
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations, each in its own transaction; returns the new version"""
+    for version, func in enumerate(MIGRATIONS, start=1):
+        # IMMEDIATE takes the write lock up front, so two workers starting at
+        # the same time cannot both apply the same migration
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            func(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
+
+@migration
+def add_query_indexes(conn: sqlite3.Connection):
+    """Indexes for the ORDER BY / WHERE clauses used by the public API"""
+    statements = [
+        # /api/songs sort options, /api/new/songs, /api/hot/songs, /api/trending/songs
+        'CREATE INDEX IF NOT EXISTS idx_songs_created_at ON songs (createdAt, id)',
+        'CREATE INDEX IF NOT EXISTS idx_songs_play_count ON songs (playCount, id)',
+        'CREATE INDEX IF NOT EXISTS idx_songs_title ON songs (title, id)',
+        # /api/albums/{id}/songs
+        'CREATE INDEX IF NOT EXISTS idx_songs_album ON songs (albumId, createdAt)',
+        # /api/songs/{id}/similar, /api/recommendations?artistId=
+        'CREATE INDEX IF NOT EXISTS idx_songs_artist ON songs (artistId, playCount)',
+        # /api/recommendations?genreId=
+        'CREATE INDEX IF NOT EXISTS idx_songs_genre ON songs (genre, playCount)',
+        # /api/artists/{id}/songs, /api/artists/{id}/albums
+        'CREATE INDEX IF NOT EXISTS idx_song_artists_artist ON song_artists (artistId, songId)',
+        'CREATE INDEX IF NOT EXISTS idx_album_artists_artist ON album_artists (artistId, albumId)',
+        # /api/albums, batch import album lookup
+        'CREATE INDEX IF NOT EXISTS idx_albums_created_at ON albums (createdAt, id)',
+        'CREATE INDEX IF NOT EXISTS idx_albums_title_artist ON albums (title, artistId)',
+        # /api/artists
+        'CREATE INDEX IF NOT EXISTS idx_artists_song_count ON artists (songCount, id)',
+        # /api/playlists
+        'CREATE INDEX IF NOT EXISTS idx_playlists_public_created_at ON playlists (isPublic, createdAt, id)',
+        # /api/moods
+        'CREATE INDEX IF NOT EXISTS idx_moods_created_at ON moods (createdAt)',
+    ]
+    for statement in statements:
+        conn.execute(statement)
+
+@migration
+def create_song_moods(conn: sqlite3.Connection):
+    """Move mood membership out of the songs.moodIds JSON column into an indexed join table"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS song_moods (
+            songId TEXT NOT NULL,
+            moodId TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (songId, moodId),
+            FOREIGN KEY (songId) REFERENCES songs (id) ON DELETE CASCADE,
+            FOREIGN KEY (moodId) REFERENCES moods (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_song_moods_mood ON song_moods (moodId, songId)')
+    
+    # Copy the existing JSON memberships, keeping their order and dropping
+    # ids of moods that no longer exist
+    mood_ids = {row[0] for row in conn.execute('SELECT id FROM moods')}
+    links = []
+    for song_id, mood_ids_json in conn.execute('SELECT id, moodIds FROM songs').fetchall():
+        try:
+            song_mood_ids = json.loads(mood_ids_json) if mood_ids_json else []
+        except ValueError:
+            continue
+        if not isinstance(song_mood_ids, list):
+            continue
+        for position, mood_id in enumerate(dict.fromkeys(m for m in song_mood_ids if isinstance(m, str) and m in mood_ids)):
+            links.append((song_id, mood_id, position))
+    conn.executemany('INSERT OR IGNORE INTO song_moods (songId, moodId, position) VALUES (?, ?, ?)', links)
+    
+    # moods.songCount is derived from song_moods from now on
+    conn.execute('UPDATE moods SET songCount = (SELECT COUNT(*) FROM song_moods sm WHERE sm.moodId = moods.id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS song_moods_after_insert AFTER INSERT ON song_moods BEGIN
+            UPDATE moods SET songCount = songCount + 1 WHERE id = NEW.moodId;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS song_moods_after_delete AFTER DELETE ON song_moods BEGIN
+            UPDATE moods SET songCount = songCount - 1 WHERE id = OLD.moodId;
+        END
+    ''')
+
+@migration
+def create_playlist_songs(conn: sqlite3.Connection):
+    """Move playlist tracks out of the playlists.songIds JSON column into an ordered table"""
+    # A song may appear in a playlist more than once, so rows are keyed by
+    # position rather than by song
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS playlist_songs (
+            playlistId TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            songId TEXT NOT NULL,
+            PRIMARY KEY (playlistId, position),
+            FOREIGN KEY (playlistId) REFERENCES playlists (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_playlist_songs_song ON playlist_songs (songId, playlistId, position)')
+    
+    links = []
+    for playlist_id, song_ids_json in conn.execute('SELECT id, songIds FROM playlists').fetchall():
+        try:
+            song_ids = json.loads(song_ids_json) if song_ids_json else []
+        except ValueError:
+            continue
+        if not isinstance(song_ids, list):
+            continue
+        song_ids = [s for s in song_ids if isinstance(s, str)]
+        # Positions are spaced 1024 apart (playlist_songs.POSITION_STEP when this shipped)
+        links.extend((playlist_id, (i + 1) * 1024, song_id) for i, song_id in enumerate(song_ids))
+    conn.executemany('INSERT OR IGNORE INTO playlist_songs (playlistId, position, songId) VALUES (?, ?, ?)', links)
+
+def _trigger(name: str, event: str, body: str, when: str = None) -> str:
+    when = f' WHEN {when}' if when else ''
+    return f'CREATE TRIGGER IF NOT EXISTS {name} {event}{when} BEGIN {body} END'
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+# Frozen: the counter triggers as created by add_counters, (name, event, when, body)
+COUNTER_TRIGGERS = (
+    # Song totals, albums.songCount and the song's own links
+    ('songs_after_insert', 'AFTER INSERT ON songs', None, """
+        UPDATE table_counts SET count = count + 1 WHERE name = 'songs';
+        UPDATE albums SET songCount = songCount + 1 WHERE id = NEW.albumId;"""),
+    ('songs_after_delete', 'AFTER DELETE ON songs', None, """
+        UPDATE table_counts SET count = count - 1 WHERE name = 'songs';
+        UPDATE albums SET songCount = songCount - 1 WHERE id = OLD.albumId;
+        DELETE FROM song_artists WHERE songId = OLD.id;
+        DELETE FROM song_moods WHERE songId = OLD.id;"""),
+    ('songs_after_update_album', 'AFTER UPDATE OF albumId ON songs', 'OLD.albumId IS NOT NEW.albumId', """
+        UPDATE albums SET songCount = songCount - 1 WHERE id = OLD.albumId;
+        UPDATE albums SET songCount = songCount + 1 WHERE id = NEW.albumId;"""),
+    # Artist and album totals
+    ('artists_after_insert', 'AFTER INSERT ON artists', None, """
+        UPDATE table_counts SET count = count + 1 WHERE name = 'artists';"""),
+    ('artists_after_delete', 'AFTER DELETE ON artists', None, """
+        UPDATE table_counts SET count = count - 1 WHERE name = 'artists';"""),
+    ('albums_after_insert', 'AFTER INSERT ON albums', None, """
+        UPDATE table_counts SET count = count + 1 WHERE name = 'albums';"""),
+    ('albums_after_delete', 'AFTER DELETE ON albums', None, """
+        UPDATE table_counts SET count = count - 1 WHERE name = 'albums';
+        DELETE FROM album_artists WHERE albumId = OLD.id;"""),
+    # Public playlist total
+    ('playlists_after_insert', 'AFTER INSERT ON playlists', 'NEW.isPublic = 1', """
+        UPDATE table_counts SET count = count + 1 WHERE name = 'public_playlists';"""),
+    ('playlists_after_delete', 'AFTER DELETE ON playlists', 'OLD.isPublic = 1', """
+        UPDATE table_counts SET count = count - 1 WHERE name = 'public_playlists';"""),
+    ('playlists_after_update_public', 'AFTER UPDATE OF isPublic ON playlists', '(OLD.isPublic = 1) IS NOT (NEW.isPublic = 1)', """
+        UPDATE table_counts SET count = count + (NEW.isPublic = 1) - (OLD.isPublic = 1) WHERE name = 'public_playlists';"""),
+    # artists.songCount / artists.albumCount
+    ('song_artists_after_insert', 'AFTER INSERT ON song_artists', None, """
+        UPDATE artists SET songCount = songCount + 1 WHERE id = NEW.artistId;"""),
+    ('song_artists_after_delete', 'AFTER DELETE ON song_artists', None, """
+        UPDATE artists SET songCount = songCount - 1 WHERE id = OLD.artistId;"""),
+    ('album_artists_after_insert', 'AFTER INSERT ON album_artists', None, """
+        UPDATE artists SET albumCount = albumCount + 1 WHERE id = NEW.artistId;"""),
+    ('album_artists_after_delete', 'AFTER DELETE ON album_artists', None, """
+        UPDATE artists SET albumCount = albumCount - 1 WHERE id = OLD.artistId;"""),
+)
+
+@migration
+def add_counters(conn: sqlite3.Connection):
+    """Keep table totals and per-entity counts up to date with triggers"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_counts (
+            name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for name, event, when, body in COUNTER_TRIGGERS:
+        conn.execute(_trigger(name, event, body, when))
+
+    # Initial counts, from the base tables
+    conn.execute('''
+        INSERT OR REPLACE INTO table_counts (name, count) VALUES
+            ('songs', (SELECT COUNT(*) FROM songs)),
+            ('artists', (SELECT COUNT(*) FROM artists)),
+            ('albums', (SELECT COUNT(*) FROM albums)),
+            ('public_playlists', (SELECT COUNT(*) FROM playlists WHERE isPublic = 1))
+    ''')
+    conn.execute('''
+        UPDATE artists SET
+            songCount = (
+                SELECT COUNT(*) FROM song_artists sa JOIN songs s ON s.id = sa.songId
+                WHERE sa.artistId = artists.id
+            ),
+            albumCount = (
+                SELECT COUNT(*) FROM album_artists aa JOIN albums a ON a.id = aa.albumId
+                WHERE aa.artistId = artists.id
+            )
+    ''')
+    conn.execute('UPDATE albums SET songCount = (SELECT COUNT(*) FROM songs s WHERE s.albumId = albums.id)')
+    conn.execute('''
+        UPDATE moods SET songCount = (
+            SELECT COUNT(*) FROM song_moods sm JOIN songs s ON s.id = sm.songId
+            WHERE sm.moodId = moods.id
+        )
+    ''')
+
+# Frozen: the search tables and triggers as created by create_search_index
+SEARCH_TABLES = {
+    "songs_fts": "id UNINDEXED, title, artists, genre",
+    "artists_fts": "id UNINDEXED, name, bio",
+    "albums_fts": "id UNINDEXED, title, artists, genre",
+    "playlists_fts": "id UNINDEXED, name, description",
+}
+_SONGS_FTS_INSERT = '''
+    INSERT INTO songs_fts (rowid, id, title, artists, genre)
+    SELECT s.rowid, s.id, s.title, (SELECT group_concat(name, ' ') FROM artists
+    WHERE id = s.artistId OR id IN (SELECT artistId FROM song_artists WHERE songId = s.id)), s.genre FROM songs s WHERE {}'''
+_ALBUMS_FTS_INSERT = '''
+    INSERT INTO albums_fts (rowid, id, title, artists, genre)
+    SELECT a.rowid, a.id, a.title, (SELECT group_concat(name, ' ') FROM artists
+    WHERE id = a.artistId OR id IN (SELECT artistId FROM album_artists WHERE albumId = a.id)), a.genre FROM albums a WHERE {}'''
+
+def _index_songs(condition: str) -> str:
+    return f'''
+        DELETE FROM songs_fts WHERE rowid IN (SELECT s.rowid FROM songs s WHERE {condition});
+        {_SONGS_FTS_INSERT.format(condition)};
+    '''
+
+def _index_albums(condition: str) -> str:
+    return f'''
+        DELETE FROM albums_fts WHERE rowid IN (SELECT a.rowid FROM albums a WHERE {condition});
+        {_ALBUMS_FTS_INSERT.format(condition)};
+    '''
+
+_SONGS_BY_ARTIST = 's.artistId = NEW.id OR s.id IN (SELECT songId FROM song_artists WHERE artistId = NEW.id)'
+_ALBUMS_BY_ARTIST = 'a.artistId = NEW.id OR a.id IN (SELECT albumId FROM album_artists WHERE artistId = NEW.id)'
+
+SEARCH_TRIGGERS = (
+    # Songs, including the names of every linked artist
+    ('songs_fts_after_insert', 'AFTER INSERT ON songs', None, _index_songs('s.id = NEW.id')),
+    ('songs_fts_after_update', 'AFTER UPDATE OF title, artistId, genre ON songs', None, _index_songs('s.id = NEW.id')),
+    ('songs_fts_after_delete', 'AFTER DELETE ON songs', None, 'DELETE FROM songs_fts WHERE rowid = OLD.rowid;'),
+    ('song_artists_fts_after_insert', 'AFTER INSERT ON song_artists', None, _index_songs('s.id = NEW.songId')),
+    ('song_artists_fts_after_delete', 'AFTER DELETE ON song_artists', None, _index_songs('s.id = OLD.songId')),
+    # Albums, likewise
+    ('albums_fts_after_insert', 'AFTER INSERT ON albums', None, _index_albums('a.id = NEW.id')),
+    ('albums_fts_after_update', 'AFTER UPDATE OF title, artistId, genre ON albums', None, _index_albums('a.id = NEW.id')),
+    ('albums_fts_after_delete', 'AFTER DELETE ON albums', None, 'DELETE FROM albums_fts WHERE rowid = OLD.rowid;'),
+    ('album_artists_fts_after_insert', 'AFTER INSERT ON album_artists', None, _index_albums('a.id = NEW.albumId')),
+    ('album_artists_fts_after_delete', 'AFTER DELETE ON album_artists', None, _index_albums('a.id = OLD.albumId')),
+    # Artists; a rename also re-indexes their songs and albums
+    ('artists_fts_after_insert', 'AFTER INSERT ON artists', None,
+     'INSERT INTO artists_fts (rowid, id, name, bio) VALUES (NEW.rowid, NEW.id, NEW.name, NEW.bio);'),
+    ('artists_fts_after_update', 'AFTER UPDATE OF name, bio ON artists', None,
+     'DELETE FROM artists_fts WHERE rowid = OLD.rowid;'
+     'INSERT INTO artists_fts (rowid, id, name, bio) VALUES (NEW.rowid, NEW.id, NEW.name, NEW.bio);'),
+    ('artists_fts_after_rename', 'AFTER UPDATE OF name ON artists', None,
+     _index_songs(_SONGS_BY_ARTIST) + _index_albums(_ALBUMS_BY_ARTIST)),
+    ('artists_fts_after_delete', 'AFTER DELETE ON artists', None, 'DELETE FROM artists_fts WHERE rowid = OLD.rowid;'),
+    # Playlists
+    ('playlists_fts_after_insert', 'AFTER INSERT ON playlists', None,
+     'INSERT INTO playlists_fts (rowid, id, name, description) VALUES (NEW.rowid, NEW.id, NEW.name, NEW.description);'),
+    ('playlists_fts_after_update', 'AFTER UPDATE OF name, description ON playlists', None,
+     'DELETE FROM playlists_fts WHERE rowid = OLD.rowid;'
+     'INSERT INTO playlists_fts (rowid, id, name, description) VALUES (NEW.rowid, NEW.id, NEW.name, NEW.description);'),
+    ('playlists_fts_after_delete', 'AFTER DELETE ON playlists', None, 'DELETE FROM playlists_fts WHERE rowid = OLD.rowid;'),
+)
+
+@migration
+def create_search_index(conn: sqlite3.Connection):
+    """FTS5 trigram index for /api/search, kept in sync by triggers"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x, tokenize='trigram')")
+        conn.execute('DROP TABLE temp.fts5_probe')
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5 or older than 3.34; search keeps using LIKE
+        print(f"Search index migration skipped: {e}")
+        return
+    for table, columns in SEARCH_TABLES.items():
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5({columns}, tokenize='trigram')")
+    for name, event, when, body in SEARCH_TRIGGERS:
+        conn.execute(_trigger(name, event, body, when))
+
+    conn.execute(_SONGS_FTS_INSERT.format('1'))
+    conn.execute(_ALBUMS_FTS_INSERT.format('1'))
+    conn.execute('INSERT INTO artists_fts (rowid, id, name, bio) SELECT rowid, id, name, bio FROM artists')
+    conn.execute('INSERT INTO playlists_fts (rowid, id, name, description) SELECT rowid, id, name, description FROM playlists')
+
+@migration
+def create_media_store(conn: sqlite3.Connection):
+    """Blob and reference tables of the content-addressed upload store"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_blobs (
+            hash TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            storedAt REAL NOT NULL,
+            createdAt TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS media_refs (
+            ownerTable TEXT NOT NULL,
+            ownerId TEXT NOT NULL,
+            field TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (ownerTable, ownerId, field)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_media_refs_hash ON media_refs (hash)')
+
+    media_columns = (
+        ("songs", "audioUrl"),
+        ("songs", "coverUrl"),
+        ("albums", "coverUrl"),
+        ("artists", "avatar"),
+        ("artists", "coverUrl"),
+        ("playlists", "coverUrl"),
+        ("moods", "coverUrl"),
+    )
+    # The 64 hex digits after "/uploads/media/ab/cd/", wherever the prefix occurs
+    hash_expression = "substr({0}, instr({0}, '/uploads/media/') + 21, 64)"
+    for table, column in media_columns:
+        name = f"{table}_{column.lower()}_media"
+        insert_ref = f'''INSERT OR REPLACE INTO media_refs (ownerTable, ownerId, field, hash)
+                SELECT '{table}', NEW.id, '{column}', {hash_expression.format(f"NEW.{column}")}
+                WHERE NEW.{column} LIKE '%/uploads/media/%';'''
+        delete_ref = f'''DELETE FROM media_refs WHERE ownerTable = '{table}' AND ownerId = OLD.id AND field = '{column}';'''
+        conn.execute(_trigger(f'{name}_after_insert', f'AFTER INSERT ON {table}', insert_ref))
+        conn.execute(_trigger(f'{name}_after_update', f'AFTER UPDATE OF {column} ON {table}', delete_ref + insert_ref,
+                              f'OLD.{column} IS NOT NEW.{column}'))
+        conn.execute(_trigger(f'{name}_after_delete', f'AFTER DELETE ON {table}', delete_ref))
+        conn.execute(f'''
+            INSERT OR REPLACE INTO media_refs (ownerTable, ownerId, field, hash)
+            SELECT ?, id, ?, {hash_expression.format(column)} FROM {table}
+            WHERE {column} LIKE '%/uploads/media/%'
+        ''', (table, column))
+
+@migration
+def add_audio_metadata(conn: sqlite3.Connection):
+    """Audio properties read from the files by metadata.py, and playlist totals that follow song durations"""
+    for column in ("bitrate INTEGER", "sampleRate INTEGER", "codec TEXT", "audioTags TEXT",
+                   "metadataStatus TEXT NOT NULL DEFAULT 'pending'"):
+        conn.execute(f'ALTER TABLE songs ADD COLUMN {column}')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_songs_metadata_pending ON songs (metadataStatus) WHERE metadataStatus = 'pending'")
+    # playlists.duration is kept as a running total; move it along when a
+    # song's duration is corrected
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS songs_after_update_duration AFTER UPDATE OF duration ON songs
+        WHEN OLD.duration IS NOT NEW.duration BEGIN
+            UPDATE playlists SET duration = MAX(0, duration + (NEW.duration - OLD.duration) * (
+                SELECT COUNT(*) FROM playlist_songs ps WHERE ps.playlistId = playlists.id AND ps.songId = NEW.id))
+            WHERE id IN (SELECT playlistId FROM playlist_songs WHERE songId = NEW.id);
+        END
+    ''')
+
+# Insert triggers whose work batch_import.import_items() does in bulk
+# instead, while its transaction holds a row in bulk_load
+BULK_LOAD_TRIGGERS = (
+    "songs_after_insert",
+    "artists_after_insert",
+    "albums_after_insert",
+    "song_artists_after_insert",
+    "album_artists_after_insert",
+    "songs_fts_after_insert",
+    "artists_fts_after_insert",
+    "albums_fts_after_insert",
+    "song_artists_fts_after_insert",
+    "album_artists_fts_after_insert",
+)
+
+@migration
+def add_bulk_load_guard(conn: sqlite3.Connection):
+    """Let batch imports maintain counters and search rows in bulk instead of per inserted row"""
+    conn.execute('CREATE TABLE IF NOT EXISTS bulk_load (active INTEGER NOT NULL)')
+    triggers = COUNTER_TRIGGERS + (SEARCH_TRIGGERS if _has_table(conn, 'songs_fts') else ())
+    for name, event, when, body in triggers:
+        if name not in BULK_LOAD_TRIGGERS:
+            continue
+        guard = 'NOT EXISTS (SELECT 1 FROM bulk_load)'
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute(_trigger(name, event, body, f'({when}) AND {guard}' if when else guard))
+
+@migration
+def skip_unchanged_artist_renames(conn: sqlite3.Connection):
+    """Re-index an artist's songs and albums only when the name really changes, not on every save"""
+    if not _has_table(conn, 'songs_fts'):
+        return
+    name, event, _, body = next(trigger for trigger in SEARCH_TRIGGERS if trigger[0] == 'artists_fts_after_rename')
+    conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute(_trigger(name, event, body, 'OLD.name IS NOT NEW.name'))
+
+@migration
+def create_cache_generations(conn: sqlite3.Connection):
+    """Write generations of the response cache, shared by every worker and kept across restarts"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL,
+            modifiedAt REAL NOT NULL
+        )
+    ''')
+    # Data written before this migration counts as modified now
+    conn.executemany('INSERT OR IGNORE INTO cache_generations (name, generation, modifiedAt) VALUES (?, 0, ?)',
+                     [(name, time.time()) for name in ("songs", "artists", "albums", "moods", "playlists", "plays")])
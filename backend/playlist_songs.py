@@ -0,0 +1,87 @@
+from typing import Dict, List, Optional
+
+# Tracks are stored with gaps between their positions, so adding, removing or
+# moving a track writes a single row. Only when a move finds no free position
+# between its new neighbours is the playlist renumbered.
+POSITION_STEP = 1024
+
+def get_playlist_song_ids(cursor, playlist_ids: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    """Map playlist ids to their song ids in playlist order; all playlists when no ids are given"""
+    if playlist_ids is not None and not playlist_ids:
+        return {}
+    if playlist_ids is None:
+        cursor.execute('SELECT playlistId, songId FROM playlist_songs ORDER BY playlistId, position')
+    else:
+        placeholders = ','.join('?' * len(playlist_ids))
+        cursor.execute(f'''
+            SELECT playlistId, songId FROM playlist_songs
+            WHERE playlistId IN ({placeholders})
+            ORDER BY playlistId, position
+        ''', playlist_ids)
+    song_ids = {playlist_id: [] for playlist_id in playlist_ids or []}
+    for playlist_id, song_id in cursor.fetchall():
+        song_ids.setdefault(playlist_id, []).append(song_id)
+    return song_ids
+
+def set_playlist_songs(cursor, playlist_id: str, song_ids: List[str]):
+    """Replace the whole track list of a playlist"""
+    cursor.execute('DELETE FROM playlist_songs WHERE playlistId = ?', (playlist_id,))
+    cursor.executemany(
+        'INSERT INTO playlist_songs (playlistId, position, songId) VALUES (?, ?, ?)',
+        [(playlist_id, (i + 1) * POSITION_STEP, song_id) for i, song_id in enumerate(song_ids)]
+    )
+
+def append_playlist_song(cursor, playlist_id: str, song_id: str):
+    # A single statement, so two concurrent appends cannot pick the same position
+    cursor.execute('''
+        INSERT INTO playlist_songs (playlistId, position, songId)
+        SELECT ?, COALESCE(MAX(position), 0) + ?, ? FROM playlist_songs WHERE playlistId = ?
+    ''', (playlist_id, POSITION_STEP, song_id, playlist_id))
+
+def remove_playlist_song(cursor, playlist_id: str, song_id: str) -> bool:
+    """Remove the first occurrence of a song; returns False if it is not in the playlist"""
+    cursor.execute('''
+        DELETE FROM playlist_songs WHERE playlistId = ? AND position = (
+            SELECT MIN(position) FROM playlist_songs WHERE playlistId = ? AND songId = ?
+        )
+    ''', (playlist_id, playlist_id, song_id))
+    return cursor.rowcount > 0
+
+def move_playlist_song(cursor, playlist_id: str, song_id: str, index: int) -> bool:
+    """Move the first occurrence of a song to the given 0-based index; returns False if it is not in the playlist"""
+    cursor.execute('SELECT MIN(position) FROM playlist_songs WHERE playlistId = ? AND songId = ?', (playlist_id, song_id))
+    position = cursor.fetchone()[0]
+    if position is None:
+        return False
+
+    # Neighbours at the target index once the track itself is taken out
+    others = 'FROM playlist_songs WHERE playlistId = ? AND position != ?'
+    cursor.execute(f'SELECT position {others} ORDER BY position LIMIT 2 OFFSET ?', (playlist_id, position, max(index - 1, 0)))
+    positions = [row[0] for row in cursor.fetchall()]
+    if index <= 0:
+        before, after = None, (positions[0] if positions else None)
+    elif positions:
+        before, after = positions[0], (positions[1] if len(positions) > 1 else None)
+    else:
+        # Past the end
+        cursor.execute(f'SELECT MAX(position) {others}', (playlist_id, position))
+        before, after = cursor.fetchone()[0], None
+
+    if before is None and after is None:
+        return True
+    if before is None:
+        new_position = after - POSITION_STEP
+    elif after is None:
+        new_position = before + POSITION_STEP
+    elif after - before > 1:
+        new_position = (before + after) // 2
+    else:
+        _renumber_playlist(cursor, playlist_id)
+        return move_playlist_song(cursor, playlist_id, song_id, index)
+
+    cursor.execute('UPDATE playlist_songs SET position = ? WHERE playlistId = ? AND position = ?', (new_position, playlist_id, position))
+    return True
+
+def _renumber_playlist(cursor, playlist_id: str):
+    cursor.execute('SELECT songId FROM playlist_songs WHERE playlistId = ? ORDER BY position', (playlist_id,))
+    set_playlist_songs(cursor, playlist_id, [row[0] for row in cursor.fetchall()])
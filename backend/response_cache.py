@@ -0,0 +1,276 @@
+import functools
+import inspect
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
+
+from fastapi import Request
+from fastapi.responses import Response
+
+import serializers
+from compression import compress, negotiate
+from db import connect
+
+# Rendered JSON bodies of hot read endpoints, keyed by path and query string.
+# Every entry records the write generation of the tables it was built from;
+# a write bumps the generation of its table, so entries built before it no
+# longer match and are dropped on their next lookup. Plays only bump the
+# volatile "plays" generation, so cached play counts refresh by the TTL alone.
+CACHE_MAX_BYTES = int(os.environ.get("MUSIC_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get("MUSIC_CACHE_TTL", "60"))
+
+# The same generations double as HTTP validators. They are stored in the
+# cache_generations table, so every worker process sees the same ones and
+# they survive restarts: an ETag stays valid exactly until a write.
+
+class Validators(NamedTuple):
+    """ETag and Last-Modified of a response body"""
+    etag: str
+    modified: float  # time of the last write to the tables the body was built from
+    last_modified: str
+
+    def tag(self, encoding: Optional[str]) -> str:
+        """ETag of the representation sent to clients that negotiated `encoding`"""
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+    def headers(self, encoding: Optional[str] = None) -> Dict[str, str]:
+        return {
+            "ETag": self.tag(encoding),
+            "Last-Modified": self.last_modified,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+    def match(self, request: Request, encoding: Optional[str] = None) -> bool:
+        """Whether a conditional GET may be answered with 304 Not Modified"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match uses the weak comparison and takes precedence over
+            # If-Modified-Since. "*" is not honoured: whether the resource
+            # exists is only known after running the route.
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return self.tag(encoding) in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return self.modified < since
+        return False
+
+class ResponseCache:
+    """Bounded LRU of response bodies with a TTL and per-table invalidation.
+
+    Generations are read from the database at `path` through a connection of
+    the cache's own, and re-read whenever PRAGMA data_version shows that
+    another connection has committed since. invalidate() writes them through
+    a second connection, so its commits are noticed the same way as another
+    worker's: a write in one process invalidates the entries and validators
+    of all.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (body, generations, expires at, validators, {encoding: body})
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version = None
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._generations: Dict[str, int] = {}
+        self._modified: Dict[str, float] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _sync(self):
+        """Reload the generations if another connection has committed since the last look (lock held)"""
+        if self._conn is None:
+            self._conn = connect(self.path)
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self._data_version:
+            return
+        rows = self._conn.execute('SELECT name, generation, modifiedAt FROM cache_generations').fetchall()
+        self._generations = {name: generation for name, generation, _ in rows}
+        self._modified = {name: modified for name, _, modified in rows}
+        self._data_version = version
+
+    def _current(self, tables: Tuple[str, ...]) -> Tuple[int, ...]:
+        self._sync()
+        return tuple(self._generations.get(table, 0) for table in tables)
+
+    @staticmethod
+    def _size(key: str, entry) -> int:
+        return len(key) + len(entry[0]) + sum(len(encoded) for encoded in entry[4].values())
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= self._size(key, entry)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self.bytes -= self._size(old_key, old_entry)
+            self.evictions += 1
+
+    def snapshot(self, tables: Tuple[str, ...]) -> Tuple[Tuple[int, ...], Validators]:
+        """Current generations of the tables and the validators of a body built from them now"""
+        with self._lock:
+            generations = self._current(tables)
+            modified = max([self._modified.get(table, 0.0) for table in tables], default=0.0)
+        # Last-Modified has whole-second precision. Rounding up is only safe
+        # once that second is over; until then round down, which makes
+        # If-Modified-Since miss rather than hide a write in the same second.
+        stamp = math.floor(modified) + 1
+        if stamp > time.time():
+            stamp -= 1
+        # The write time tells apart databases that happen to be at the same generations
+        etag = '"%x-%s"' % (int(modified * 1000), "-".join(str(generation) for generation in generations))
+        return generations, Validators(etag, modified, formatdate(stamp, usegmt=True))
+
+    def invalidate(self, *tables: str):
+        """Call after committing a write to any of the given tables"""
+        # Not under self._lock: lookups go on while the write waits for the database
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = connect(self.path)
+            now = time.time()
+            try:
+                self._writer.executemany('''
+                    INSERT INTO cache_generations (name, generation, modifiedAt) VALUES (?, 1, ?)
+                    ON CONFLICT(name) DO UPDATE SET generation = generation + 1, modifiedAt = excluded.modifiedAt
+                ''', [(table, now) for table in tables])
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def get(self, key: str, tables: Tuple[str, ...]) -> Optional[Tuple[bytes, Validators, Dict[str, bytes]]]:
+        """The body, its validators and the compressed copies made so far"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, generations, expires, validators, encoded = entry
+                if expires > time.monotonic() and generations == self._current(tables):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body, validators, encoded
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, body: bytes, tables: Tuple[str, ...], generations: Tuple[int, ...], validators: Validators):
+        """Store a body built from data read at `generations`, unless a write has happened since"""
+        size = len(key) + len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generations != self._current(tables):
+                return
+            self._discard(key)
+            self._entries[key] = (body, generations, time.monotonic() + self.ttl, validators, {})
+            self.bytes += size
+            self._evict()
+
+    def put_encoded(self, key: str, body: bytes, encoding: str, encoded: bytes):
+        """Keep a compressed copy next to the cached body it was made from"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not body or encoding in entry[4]:
+                return
+            entry[4][encoding] = encoded
+            self.bytes += len(encoded)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+response_cache = ResponseCache()
+
+def _serve(tables: Tuple[str, ...], volatile: Tuple[str, ...], store: bool):
+    validated = tables + volatile
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(request: Request, **kwargs):
+            key = request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+            encoding = negotiate(request.headers.get("accept-encoding"))
+            entry = response_cache.get(key, tables) if store else None
+            if entry is not None:
+                body, validators, encoded = entry
+            else:
+                # Snapshot before running the route: a write that commits
+                # meanwhile then makes this body stale instead of cached
+                body, encoded = None, {}
+                generations, validators = response_cache.snapshot(validated)
+
+            # Validators always describe the body that would be sent, so a
+            # revalidation is answered without running the route at all
+            headers = validators.headers(encoding)
+            if validators.match(request, encoding):
+                return Response(status_code=304, headers=headers)
+            if body is None:
+                body = serializers.dumps(func(**kwargs))
+                if store:
+                    response_cache.put(key, body, tables, generations[:len(tables)], validators)
+
+            # Hot bodies are compressed once and then served from the cache entry
+            content = encoded.get(encoding)
+            if content is None:
+                content = compress(body, encoding)
+                if content is not None and store:
+                    response_cache.put_encoded(key, body, encoding, content)
+            if content is None:
+                content = body
+            else:
+                headers["Content-Encoding"] = encoding
+            return Response(content=content, media_type="application/json", headers=headers)
+
+        # FastAPI reads the parameters to inject from the signature
+        request_param = inspect.Parameter("request", inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=Request)
+        wrapper.__signature__ = signature.replace(parameters=[request_param, *signature.parameters.values()])
+        return wrapper
+    return decorator
+
+def cached(*tables: str, volatile: Tuple[str, ...] = ()):
+    """Serve a GET route from response_cache until one of `tables` is written or the TTL passes.
+
+    Writes to `volatile` tables change the ETag but leave cached bodies valid
+    until the TTL. The route's return value is rendered with
+    serializers.dumps() either way, so cached and uncached responses are
+    byte-identical. Errors are not cached.
+    """
+    return _serve(tables, volatile, store=True)
+
+def conditional(*tables: str):
+    """Answer conditional GETs with 304 until one of `tables` is written, without caching bodies"""
+    return _serve(tables, (), store=False)
@@ -0,0 +1,46 @@
+import sqlite3
+
+# Full-text index behind /api/search. The trigram tokenizer matches any
+# substring of three or more characters (so CJK titles work without word
+# segmentation) and folds case for all of Unicode. Shorter queries cannot
+# use it and fall back to LIKE scans.
+MIN_FTS_QUERY_LENGTH = 3
+
+# Rows are keyed by the rowid of the source row. The id is stored as well and
+# checked on every join, because VACUUM may renumber the rowids of tables
+# without an INTEGER PRIMARY KEY; rebuild_search_index() repairs that.
+SEARCH_TABLES = {
+    "songs_fts": "id UNINDEXED, title, artists, genre",
+    "artists_fts": "id UNINDEXED, name, bio",
+    "albums_fts": "id UNINDEXED, title, artists, genre",
+    "playlists_fts": "id UNINDEXED, name, description",
+}
+
+SONG_ARTIST_NAMES = '''(SELECT group_concat(name, ' ') FROM artists
+    WHERE id = s.artistId OR id IN (SELECT artistId FROM song_artists WHERE songId = s.id))'''
+ALBUM_ARTIST_NAMES = '''(SELECT group_concat(name, ' ') FROM artists
+    WHERE id = a.artistId OR id IN (SELECT artistId FROM album_artists WHERE albumId = a.id))'''
+
+SONGS_FTS_INSERT = f'''
+    INSERT INTO songs_fts (rowid, id, title, artists, genre)
+    SELECT s.rowid, s.id, s.title, {SONG_ARTIST_NAMES}, s.genre FROM songs s WHERE {{}}'''
+ALBUMS_FTS_INSERT = f'''
+    INSERT INTO albums_fts (rowid, id, title, artists, genre)
+    SELECT a.rowid, a.id, a.title, {ALBUM_ARTIST_NAMES}, a.genre FROM albums a WHERE {{}}'''
+
+def rebuild_search_index(conn: sqlite3.Connection):
+    """Repopulate every FTS table from the source tables; the caller commits"""
+    for table in SEARCH_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    conn.execute(SONGS_FTS_INSERT.format('1'))
+    conn.execute(ALBUMS_FTS_INSERT.format('1'))
+    conn.execute('INSERT INTO artists_fts (rowid, id, name, bio) SELECT rowid, id, name, bio FROM artists')
+    conn.execute('INSERT INTO playlists_fts (rowid, id, name, description) SELECT rowid, id, name, description FROM playlists')
+
+def has_search_index(cursor) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'songs_fts'")
+    return cursor.fetchone() is not None
+
+def fts_phrase(q: str) -> str:
+    """Quote a user query as a single FTS5 phrase, i.e. a plain substring match"""
+    return '"' + q.replace('"', '""') + '"'
@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # in requirements.txt; without it the standard library encoder is used
+    orjson = None
+
+# Response bodies for the user API. Rows are read by column name, and every
+# entity is encoded to JSON once: its bytes are kept next to the dict and in
+# a process-wide cache, and dumps() copies them into the response instead of
+# walking the dict again. Only the parts that embed other entities are
+# assembled per request.
+
+def ensure_https_url(url: str) -> str:
+    """Convert HTTP URLs to HTTPS to prevent mixed content issues"""
+    if url and url.startswith('http://'):
+        return url.replace('http://', 'https://', 1)
+    return url
+
+def parse_json_field(field_value: str) -> List[str]:
+    if not field_value:
+        return []
+    try:
+        return json.loads(field_value)
+    except:
+        return []
+
+if orjson is not None:
+    _encode = orjson.dumps
+else:
+    _json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def _encode(value) -> bytes:
+        return _json_encoder.encode(value).encode("utf-8")
+
+class Encoded(dict):
+    """An entity dict that carries its own JSON encoding in `json`.
+
+    dumps() trusts `json` over the dict contents, so never modify an Encoded
+    dict in place; copy it with dict() first.
+    """
+
+    __slots__ = ("json",)
+
+_keys: Dict[str, bytes] = {}
+
+def _key(name: str) -> bytes:
+    encoded = _keys.get(name)
+    if encoded is None:
+        encoded = _keys[name] = _encode(name) + b":"
+    return encoded
+
+def _compose(value, parts: List[bytes]):
+    if isinstance(value, Encoded):
+        parts.append(value.json)
+    elif isinstance(value, dict):
+        separator = b"{"
+        for name, item in value.items():
+            parts.append(separator)
+            parts.append(_key(name))
+            _compose(item, parts)
+            separator = b","
+        parts.append(b"}" if value else b"{}")
+    elif isinstance(value, (list, tuple)):
+        separator = b"["
+        for item in value:
+            parts.append(separator)
+            _compose(item, parts)
+            separator = b","
+        parts.append(b"]" if value else b"[]")
+    else:
+        parts.append(_encode(value))
+
+def dumps(value) -> bytes:
+    """Compact UTF-8 JSON of a response value, copying in Encoded entities as they are"""
+    parts = []
+    _compose(value, parts)
+    return b"".join(parts)
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get("MUSIC_FRAGMENT_CACHE_SIZE", "10000"))
+
+class FragmentCache:
+    """LRU of encoded pieces of entities, valid for as long as their source values are unchanged.
+
+    Entries are checked against the values they were built from rather than
+    against updatedAt alone, because counters, play counts and the metadata
+    writer change columns without touching updatedAt. Long text columns
+    (the *_VERSION tuples leave them out) only change along with updatedAt,
+    so they are not kept or compared.
+    """
+
+    def __init__(self, size: int = FRAGMENT_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (kind, id) -> (version, pieces), least recently used first
+
+    def get(self, kind: str, entity_id: str, version: tuple):
+        with self._lock:
+            entry = self._entries.get((kind, entity_id))
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end((kind, entity_id))
+            return entry[1]
+
+    def put(self, kind: str, entity_id: str, version: tuple, pieces):
+        with self._lock:
+            self._entries[(kind, entity_id)] = (version, pieces)
+            self._entries.move_to_end((kind, entity_id))
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+fragments = FragmentCache()
+
+def _encoded(kind: str, version: tuple, value: Dict, nested=()) -> Encoded:
+    """Wrap an entity dict as Encoded, re-encoding only the values of `nested` keys.
+
+    The rest of the object is cached as the runs of JSON between the nested
+    values, so an entity whose own fields are unchanged costs a few joins.
+    """
+    runs = fragments.get(kind, value["id"], version)
+    if runs is None:
+        runs, run = [], [b"{"]
+        for i, (name, item) in enumerate(value.items()):
+            run.append(b"," + _key(name) if i else _key(name))
+            if name in nested:
+                runs.append(b"".join(run))
+                run = []
+            else:
+                run.append(_encode(item))
+        run.append(b"}")
+        runs.append(b"".join(run))
+        fragments.put(kind, value["id"], version, runs)
+
+    parts = [runs[0]]
+    for run, name in zip(runs[1:], (name for name in value if name in nested)):
+        _compose(value[name], parts)
+        parts.append(run)
+    result = Encoded(value)
+    result.json = b"".join(parts)
+    return result
+
+# Columns an entity's cached fragment is checked against; see FragmentCache
+ARTIST_VERSION = ("name", "avatar", "coverUrl", "followers", "songCount", "albumCount", "genres", "verified",
+                  "createdAt", "updatedAt")
+
+def artist(row) -> Encoded:
+    """Artist from an `artists` row"""
+    version = tuple(row[column] for column in ARTIST_VERSION)
+    return _encoded("artist", version, {
+        "id": row["id"],
+        "name": row["name"],
+        "bio": row["bio"],
+        "avatar": ensure_https_url(row["avatar"]),
+        "coverUrl": ensure_https_url(row["coverUrl"]),
+        "followers": row["followers"],
+        "songCount": row["songCount"],
+        "albumCount": row["albumCount"],
+        "genres": parse_json_field(row["genres"]),
+        "verified": bool(row["verified"]),
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"]
+    })
+
+def with_primary(artist: Encoded, is_primary) -> Encoded:
+    """An artist as linked to a song or album"""
+    linked = Encoded(artist, isPrimary=bool(is_primary))
+    linked.json = artist.json[:-1] + (b',"isPrimary":true}' if is_primary else b',"isPrimary":false}')
+    return linked
+
+MOOD_VERSION = ("name", "icon", "color", "coverUrl", "songCount", "createdAt", "updatedAt")
+
+def mood(row) -> Encoded:
+    """Mood from a `moods` row"""
+    version = tuple(row[column] for column in MOOD_VERSION)
+    return _encoded("mood", version, {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "icon": row["icon"],
+        "color": row["color"],
+        "coverUrl": ensure_https_url(row["coverUrl"]),
+        "songCount": row["songCount"],
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"]
+    })
+
+ALBUM_VERSION = ("title", "artistId", "coverUrl", "releaseDate", "songCount", "duration", "genre",
+                 "createdAt", "updatedAt")
+
+def album(row, artists: List[Encoded]) -> Encoded:
+    """Album from an `albums` row and its linked artists"""
+    primary_artist = next((a for a in artists if a.get('isPrimary')), artists[0] if artists else None)
+    version = tuple(row[column] for column in ALBUM_VERSION)
+    return _encoded("album", version, {
+        "id": row["id"],
+        "title": row["title"],
+        "artistId": row["artistId"],
+        "artist": primary_artist,  # Primary artist for backward compatibility
+        "artists": artists,        # All artists
+        "coverUrl": ensure_https_url(row["coverUrl"]),
+        "releaseDate": row["releaseDate"],
+        "songCount": row["songCount"],
+        "duration": row["duration"],
+        "genre": row["genre"],
+        "description": row["description"],
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"]
+    }, nested=("artist", "artists"))
+
+SONG_VERSION = ("title", "artistId", "albumId", "duration", "audioUrl", "coverUrl", "playCount", "liked",
+                "genre", "createdAt", "updatedAt")
+
+def song(row, artists: List[Encoded], album: Optional[Encoded], mood_ids: List[str], moods: Optional[List[Encoded]],
+         keys: Optional[set] = None) -> Encoded:
+    """Song from a `songs` row and its relations, limited to `keys` when given"""
+    primary_artist = next((a for a in artists if a.get('isPrimary')), artists[0] if artists else None)
+    value = {
+        "id": row["id"],
+        "title": row["title"],
+        "artistId": row["artistId"],
+        "artist": primary_artist,  # Primary artist for backward compatibility
+        "artists": artists,        # All artists
+        "albumId": row["albumId"],
+        "album": album,
+        "duration": row["duration"],
+        "audioUrl": row["audioUrl"],
+        "coverUrl": ensure_https_url(row["coverUrl"]),
+        "lyrics": row["lyrics"],
+        "moodIds": mood_ids,
+        "moods": moods,
+        "playCount": row["playCount"],
+        "liked": bool(row["liked"]),
+        "genre": row["genre"],
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"]
+    }
+    if keys is not None:
+        value = {name: item for name, item in value.items() if name in keys}
+    version = (tuple(row[column] for column in SONG_VERSION), tuple(value))
+    return _encoded("song", version, value, nested=("artist", "artists", "album", "moodIds", "moods"))
+
+def playlist(row, song_ids: List[str], songs: Optional[List] = None) -> Dict:
+    """Playlist from a `playlists` row; `songs` is only included when given"""
+    value = {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "coverUrl": ensure_https_url(row["coverUrl"]),
+        "songIds": song_ids,
+    }
+    if songs is not None:
+        value["songs"] = songs
+    value.update({
+        "songCount": row["songCount"],
+        "playCount": row["playCount"],
+        "duration": row["duration"],
+        "creator": row["creator"],
+        "isPublic": bool(row["isPublic"]),
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"]
+    })
+    return value
@@ -0,0 +1,91 @@
+import bisect
+import threading
+from typing import Dict, List, Optional
+
+# In-memory prefix index behind /api/search/suggest. Every name is stored
+# under the casefolded suffix starting at each word, in sorted arrays, so a
+# lookup is one bisect plus a short forward scan - no SQL at all.
+SUGGEST_KINDS = {
+    "songs": "SELECT id, title FROM songs",
+    "artists": "SELECT id, name FROM artists",
+    "albums": "SELECT id, title FROM albums",
+}
+
+def _keys(name: str) -> List[str]:
+    folded = name.casefold()
+    starts = [i for i, ch in enumerate(folded) if not ch.isspace() and (i == 0 or folded[i - 1].isspace())]
+    return list(dict.fromkeys(folded[i:] for i in starts))
+
+class _SortedNames:
+    def __init__(self, entries=None, names=None):
+        self.entries = entries or []  # sorted (casefolded key, id) pairs
+        self.names = names or {}      # id -> display name
+
+    def add(self, item_id: str, name: str):
+        self.names[item_id] = name
+        for key in _keys(name):
+            bisect.insort(self.entries, (key, item_id))
+
+    def remove(self, item_id: str):
+        name = self.names.pop(item_id, None)
+        if name is None:
+            return
+        for key in _keys(name):
+            i = bisect.bisect_left(self.entries, (key, item_id))
+            if i < len(self.entries) and self.entries[i] == (key, item_id):
+                del self.entries[i]
+
+    def search(self, prefix: str, limit: int) -> List[Dict]:
+        results = {}
+        i = bisect.bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(results) < limit and self.entries[i][0].startswith(prefix):
+            item_id = self.entries[i][1]
+            results.setdefault(item_id, {"id": item_id, "name": self.names[item_id]})
+            i += 1
+        return list(results.values())
+
+class SuggestIndex:
+    """Loaded from the database on first use, then kept current by the admin write endpoints.
+
+    Writes made by other processes are not seen until restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: Optional[Dict[str, _SortedNames]] = None
+
+    def ensure_loaded(self, cursor):
+        if self._kinds is not None:
+            return
+        # Loading under the lock makes concurrent upserts wait and apply on
+        # top of the loaded data instead of being lost
+        with self._lock:
+            if self._kinds is not None:
+                return
+            kinds = {}
+            for kind, query in SUGGEST_KINDS.items():
+                cursor.execute(query)
+                rows = [(item_id, name) for item_id, name in cursor.fetchall() if name]
+                entries = sorted((key, item_id) for item_id, name in rows for key in _keys(name))
+                kinds[kind] = _SortedNames(entries, dict(rows))
+            self._kinds = kinds
+
+    def upsert(self, kind: str, item_id: str, name: str):
+        with self._lock:
+            if self._kinds is None:
+                return  # picked up by the initial load
+            self._kinds[kind].remove(item_id)
+            if name:
+                self._kinds[kind].add(item_id, name)
+
+    def remove(self, kind: str, item_id: str):
+        with self._lock:
+            if self._kinds is not None:
+                self._kinds[kind].remove(item_id)
+
+    def search(self, q: str, limit: int) -> Dict[str, List[Dict]]:
+        prefix = q.strip().casefold()
+        with self._lock:
+            return {kind: names.search(prefix, limit) for kind, names in self._kinds.items()}
+
+suggestions = SuggestIndex()
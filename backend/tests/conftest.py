@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def workdir(tmp_path_factory):
+    """A scratch directory for music.db, uploads and the caches, which live in the working directory"""
+    path = tmp_path_factory.mktemp("music")
+    cwd = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def client(workdir):
+    import main
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    response = client.post("/api/auth/login", json={"username": "admin", "password": "admin123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture(scope="session")
+def library(client, admin_headers):
+    """A few moods, artists, albums, songs and a playlist, by id"""
+    def create(path, payload):
+        response = client.post(path, json=payload, headers=admin_headers)
+        assert response.status_code == 200, response.text
+
+    def ids(path, key):
+        return {row[key]: row["id"] for row in client.get(path, headers=admin_headers).json()["data"]}
+
+    for i in range(3):
+        create("/api/admin/moods", {"name": f"mood {i}", "icon": "x", "color": "#fff", "description": "d"})
+    moods = list(ids("/api/admin/moods", "name").values())
+    for i in range(4):
+        create("/api/admin/artists", {"name": f"Artist {i}", "bio": f"bio {i}", "genres": ["pop"]})
+    artists = [ids("/api/admin/artists", "name")[f"Artist {i}"] for i in range(4)]
+    for i in range(2):
+        create("/api/admin/albums", {"title": f"Album {i}", "artistId": artists[i], "releaseDate": "2020"})
+    albums = [ids("/api/admin/albums", "title")[f"Album {i}"] for i in range(2)]
+    for i in range(12):
+        create("/api/admin/songs", {"title": f"Song {i}", "artistId": artists[i % 4],
+                                    "albumId": albums[i % 2] if i % 3 else None, "duration": 100 + i,
+                                    "moodIds": moods[:i % 3], "playCount": i * 7 % 11,
+                                    "genre": "rock" if i % 2 else "pop"})
+    songs = [ids("/api/admin/songs", "title")[f"Song {i}"] for i in range(12)]
+    create("/api/admin/playlists", {"name": "Playlist", "description": "d", "songIds": songs[:4]})
+    playlists = list(ids("/api/admin/playlists", "name").values())
+    return {"moods": moods, "artists": artists, "albums": albums, "songs": songs, "playlists": playlists}
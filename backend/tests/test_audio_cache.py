@@ -0,0 +1,105 @@
+import functools
+import http.server
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import db
+import user
+from audio_cache import STALE_PART_SECONDS, AudioCache
+
+TRACK_SIZE = 200_000
+TRACKS = {"a.mp3": os.urandom(TRACK_SIZE), "b.mp3": os.urandom(TRACK_SIZE)}
+
+@pytest.fixture(scope="module")
+def upstream(tmp_path_factory):
+    """A local stand-in for the host of remote audioUrls"""
+    root = tmp_path_factory.mktemp("upstream")
+    for name, data in TRACKS.items():
+        (root / name).write_bytes(data)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.RequestHandlerClass.log_message = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    requests = []
+
+    def opener(request, timeout=None):
+        requests.append(request.full_url)
+        return urllib.request.urlopen(request, timeout=timeout)
+
+    cache = AudioCache(str(tmp_path / "audio"), max_bytes=int(TRACK_SIZE * 1.5), opener=opener)
+    cache.upstream_requests = requests
+    monkeypatch.setattr(user, "audio_cache", cache)
+    return cache
+
+@pytest.fixture(scope="module")
+def stream_urls(library, upstream):
+    conn = sqlite3.connect(db.DB_PATH)
+    urls = {}
+    for name, song_id in zip(TRACKS, library["songs"][:2]):
+        conn.execute("UPDATE songs SET audioUrl = ? WHERE id = ?", (f"{upstream}/{name}", song_id))
+        urls[name] = f"/api/songs/{song_id}/stream"
+    conn.commit()
+    conn.close()
+    return urls
+
+def settle(cache):
+    deadline = time.monotonic() + 5
+    while cache.stats()["downloading"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_miss_hit_and_eviction(client, cache, stream_urls):
+    response = client.get(stream_urls["a.mp3"])
+    assert response.status_code == 200
+    assert response.content == TRACKS["a.mp3"]
+    settle(cache)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["files"] == 1
+
+    # Served from disk, ranges included, without going upstream again
+    response = client.get(stream_urls["a.mp3"], headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{TRACK_SIZE}"
+    assert response.content == TRACKS["a.mp3"][100:200]
+    assert cache.stats()["hits"] == 1
+    assert len(cache.upstream_requests) == 1
+
+    # The budget holds one track, so the least recently played one goes
+    assert client.get(stream_urls["b.mp3"]).content == TRACKS["b.mp3"]
+    settle(cache)
+    stats = cache.stats()
+    assert stats["files"] == 1
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == TRACK_SIZE
+    assert client.get(stream_urls["a.mp3"]).content == TRACKS["a.mp3"]
+    assert len(cache.upstream_requests) == 3
+
+def test_upstream_missing(client, cache, stream_urls, upstream, library):
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("UPDATE songs SET audioUrl = ? WHERE id = ?", (f"{upstream}/missing.mp3", library["songs"][2]))
+    conn.commit()
+    conn.close()
+    assert client.get(f"/api/songs/{library['songs'][2]}/stream").status_code == 502
+
+def test_only_stale_part_files_are_removed(tmp_path):
+    directory = tmp_path / "audio"
+    directory.mkdir()
+    live, stale = directory / "live.mp3.1234.part", directory / "stale.mp3.5678.part"
+    live.write_bytes(b"x")
+    stale.write_bytes(b"x")
+    old = time.time() - STALE_PART_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    stats = AudioCache(str(directory)).stats()
+    assert stats["files"] == 0
+    assert live.exists()
+    assert not stale.exists()
@@ -0,0 +1,117 @@
+import sqlite3
+
+import pytest
+
+import batch_import
+from counters import recount
+
+def item(title, artists, album="Imported Album", skip=True):
+    return {
+        "songInfo": {"songId": 1, "name": title, "arName": artists, "albumName": album, "albumId": 1,
+                     "interval": "03:00", "img": "https://example.com/cover.jpg", "duration": 180},
+        "albumInfo": {"id": 1, "title": album, "artist": artists[0], "coverUrl": "https://example.com/album.jpg",
+                      "releaseDate": "2020-01-01"},
+        "artistsInfo": [{"id": str(i), "name": name, "fanCount": "1,000"} for i, name in enumerate(artists)],
+        "lyrics": "[00:00.00] la",
+        "audioUrl": "https://example.com/song.mp3",
+        "skipIfExists": skip,
+    }
+
+@pytest.fixture(autouse=True)
+def remove_imports(client, admin_headers, library, workdir):
+    """Delete what a test imported, so the other tests see only the library"""
+    tables = ("songs", "albums", "artists")
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        before = {table: {row[0] for row in conn.execute(f'SELECT id FROM {table}')} for table in tables}
+        yield
+        for table in tables:
+            for (row_id,) in conn.execute(f'SELECT id FROM {table}').fetchall():
+                if row_id not in before[table]:
+                    assert client.delete(f"/api/admin/{table}/{row_id}", headers=admin_headers).status_code == 200
+    finally:
+        conn.close()
+
+def import_batch(client, admin_headers, items):
+    return client.post("/api/admin/import/batch", json={"items": items}, headers=admin_headers)
+
+def counters(conn: sqlite3.Connection):
+    return (
+        conn.execute('SELECT name, count FROM table_counts ORDER BY name').fetchall(),
+        conn.execute('SELECT id, songCount, albumCount FROM artists ORDER BY id').fetchall(),
+        conn.execute('SELECT id, songCount FROM albums ORDER BY id').fetchall(),
+    )
+
+def test_counters_match_a_recount(client, admin_headers, library, workdir):
+    response = import_batch(client, admin_headers, [
+        item("Counted One", ["Counter Artist", "Counter Guest"], album="Counted Album"),
+        item("Counted Two", ["Counter Artist"], album="Counted Album"),
+        item("Counted Three", ["Artist 0", "Counter Guest"], album="Album 0"),
+    ])
+    assert response.json()["imported"] == 3
+
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        maintained = counters(conn)
+        recount(conn)
+        assert counters(conn) == maintained
+        conn.rollback()
+    finally:
+        conn.close()
+
+def test_imported_rows_are_searchable(client, admin_headers, library):
+    import_batch(client, admin_headers, [item("Findable Tune", ["Findable Singer"], album="Findable Record")])
+    results = client.get("/api/search", params={"q": "findable"}).json()
+    assert [song["title"] for song in results["songs"]] == ["Findable Tune"]
+    assert [artist["name"] for artist in results["artists"]] == ["Findable Singer"]
+    assert [album["title"] for album in results["albums"]] == ["Findable Record"]
+    # Songs are indexed under the names of all their artists
+    import_batch(client, admin_headers, [item("Duet Tune", ["Findable Singer", "Second Voice"])])
+    assert [song["title"] for song in client.get("/api/search", params={"q": "second voice"}).json()["songs"]] == ["Duet Tune"]
+
+def test_existing_title_and_artist_is_skipped(client, admin_headers, library):
+    assert import_batch(client, admin_headers, [item("Song 0", ["Artist 0"])]).json()["skipped"] == 1
+    assert import_batch(client, admin_headers, [item("Song 0", ["Artist 1"])]).json()["imported"] == 1
+    # Without skipIfExists the duplicate goes in
+    assert import_batch(client, admin_headers, [item("Song 0", ["Artist 0"], skip=False)]).json()["imported"] == 1
+
+def test_repeated_names_in_a_batch_are_created_once(client, admin_headers, library, workdir):
+    summary = import_batch(client, admin_headers, [
+        item("Repeat One", ["Repeat Artist"], album="Repeat Album"),
+        item("Repeat Two", ["Repeat Artist", "Repeat Artist"], album="Repeat Album"),
+        item("Repeat One", ["Repeat Artist"], album="Repeat Album"),
+    ]).json()
+    assert (summary["imported"], summary["skipped"]) == (2, 1)
+
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        artists = conn.execute("SELECT id, songCount, albumCount FROM artists WHERE name = 'Repeat Artist'").fetchall()
+        assert [(songs, albums) for _, songs, albums in artists] == [(2, 1)]
+        albums = conn.execute("SELECT songCount FROM albums WHERE title = 'Repeat Album'").fetchall()
+        assert albums == [(2,)]
+        assert conn.execute('SELECT COUNT(*) FROM song_artists WHERE artistId = ?', (artists[0][0],)).fetchone() == (2,)
+    finally:
+        conn.close()
+
+def test_triggers_are_rearmed_after_a_failed_batch(client, admin_headers, library, workdir, monkeypatch):
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        songs_before = conn.execute("SELECT count FROM table_counts WHERE name = 'songs'").fetchone()[0]
+
+        def fail(url):
+            raise ValueError("bad url")
+        monkeypatch.setattr(batch_import, "ensure_https_url", fail)
+        assert import_batch(client, admin_headers, [item("Failed Import", ["Failed Artist"])]).status_code == 500
+        monkeypatch.undo()
+
+        assert conn.execute('SELECT COUNT(*) FROM bulk_load').fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM artists WHERE name = 'Failed Artist'").fetchone() == (0,)
+        # Rows written outside an import go through the triggers again
+        response = client.post("/api/admin/songs", json={"title": "After Failure", "artistId": library["artists"][0],
+                                                         "albumId": library["albums"][0], "duration": 100},
+                               headers=admin_headers)
+        assert response.status_code == 200
+        assert conn.execute("SELECT count FROM table_counts WHERE name = 'songs'").fetchone()[0] == songs_before + 1
+        assert [song["title"] for song in client.get("/api/search", params={"q": "after failure"}).json()["songs"]] == ["After Failure"]
+    finally:
+        conn.close()
@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+import db
+from byte_ranges import parse_range
+
+SIZE = 10_000
+DATA = bytes(range(256)) * (SIZE // 256) + bytes(range(SIZE % 256))
+
+@pytest.fixture(scope="module")
+def stream_url(workdir, library):
+    path = workdir / "range.mp3"
+    path.write_bytes(DATA)
+    song_id = library["songs"][-1]
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("UPDATE songs SET audioUrl = ? WHERE id = ?", (str(path), song_id))
+    conn.commit()
+    conn.close()
+    return f"/api/songs/{song_id}/stream"
+
+@pytest.mark.parametrize("header, first, last", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=9000-", 9000, SIZE - 1),                # open-ended
+    (f"bytes={SIZE - 1}-", SIZE - 1, SIZE - 1),
+    ("bytes=-100", SIZE - 100, SIZE - 1),            # suffix
+    (f"bytes=-{SIZE * 2}", 0, SIZE - 1),             # suffix longer than the file
+    (f"bytes=5-{SIZE * 3}", 5, SIZE - 1),            # last byte past the end
+])
+def test_single_range(client, stream_url, header, first, last):
+    response = client.get(stream_url, headers={"Range": header})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {first}-{last}/{SIZE}"
+    assert response.headers["content-length"] == str(last - first + 1)
+    assert response.content == DATA[first:last + 1]
+
+@pytest.mark.parametrize("header", [f"bytes={SIZE}-", f"bytes={SIZE + 5}-{SIZE + 10}", "bytes=-0"])
+def test_unsatisfiable_range(client, stream_url, header):
+    response = client.get(stream_url, headers={"Range": header})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{SIZE}"
+
+@pytest.mark.parametrize("header", ["items=0-1", "bytes=5-2", "bytes=abc"])
+def test_ignored_range(client, stream_url, header):
+    response = client.get(stream_url, headers={"Range": header})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+def test_multiple_ranges(client, stream_url):
+    response = client.get(stream_url, headers={"Range": "bytes=0-9,-10"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert int(response.headers["content-length"]) == len(response.content)
+    assert f"Content-Range: bytes 0-9/{SIZE}".encode() in response.content
+    assert f"Content-Range: bytes {SIZE - 10}-{SIZE - 1}/{SIZE}".encode() in response.content
+
+def test_if_range(client, stream_url):
+    etag = client.get(stream_url).headers["etag"]
+    assert client.get(stream_url, headers={"Range": "bytes=0-9", "If-Range": etag}).status_code == 206
+    stale = client.get(stream_url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == DATA
+
+def test_parse_range_merges_overlaps():
+    assert parse_range("bytes=0-9,5-19,30-", 100) == [(0, 19), (30, 99)]
+    with pytest.raises(HTTPException):
+        parse_range("bytes=200-", 100)
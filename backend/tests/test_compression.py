@@ -0,0 +1,44 @@
+import gzip
+import importlib
+import sys
+
+import pytest
+
+import compression
+from response_cache import response_cache
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    """compression as imported where the brotli package is missing"""
+    monkeypatch.setitem(sys.modules, "brotli", None)
+    importlib.reload(compression)
+    response_cache.clear()
+    yield
+    monkeypatch.undo()
+    importlib.reload(compression)
+    response_cache.clear()
+
+def test_brotli_is_preferred_when_installed(client, library):
+    pytest.importorskip("brotli")
+    identity = client.get("/api/songs", headers={"Accept-Encoding": "identity"})
+    response = client.get("/api/songs", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["etag"] == identity.headers["etag"][:-1] + '-br"'
+    # httpx decodes br itself when brotli is installed
+    assert response.content == identity.content
+
+def test_gzip_only_without_brotli(client, library, without_brotli):
+    assert compression.brotli is None and compression.ENCODINGS == ("gzip",)
+    identity = client.get("/api/songs", headers={"Accept-Encoding": "identity"})
+    response = client.get("/api/songs", headers={"Accept-Encoding": "br, gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == identity.content
+    response = client.get("/api/songs", headers={"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+    assert response.content == identity.content
+
+def test_gzip_output_is_deterministic():
+    body = b'{"data": "%s"}' % (b"x" * 4096)
+    assert compression.compress(body, "gzip") == compression.compress(body, "gzip")
+    assert gzip.decompress(compression.compress(body, "gzip")) == body
+    assert compression.compress(b"{}", "gzip") is None
@@ -0,0 +1,138 @@
+import functools
+import http.server
+import io
+import os
+import threading
+import time
+import urllib.request
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+import images
+import user
+from images import ImageCache
+
+SOURCES = {"red.png": (200, 30, 30), "green.png": (30, 200, 30), "blue.png": (30, 30, 200)}
+
+@pytest.fixture(scope="module")
+def upstream(tmp_path_factory):
+    """A local stand-in for the host of remote cover URLs"""
+    root = tmp_path_factory.mktemp("image_host")
+    for name, color in SOURCES.items():
+        Image.new("RGB", (400, 400), color).save(root / name)
+    (root / "notes.png").write_bytes(b"not an image")
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.RequestHandlerClass.log_message = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """An ImageCache fetching straight from the stand-in host (fetch_source refuses loopback)"""
+    fetched = []
+
+    def fetcher(url):
+        fetched.append(url)
+        time.sleep(0.1)  # long enough for concurrent requests to pile up
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.read()
+
+    cache = ImageCache(str(tmp_path / "images"), fetcher=fetcher)
+    cache.fetched = fetched
+    monkeypatch.setattr(user, "image_cache", cache)
+    return cache
+
+def playlist_image(client, cover_url: str):
+    playlist = client.post("/api/playlists", json={"name": "cover", "coverUrl": cover_url}).json()["data"]
+    return client.get(f"/api/images/playlists:{playlist['id']}?w=64")
+
+@pytest.mark.parametrize("cover_url", [
+    "/etc/passwd",
+    "music.db",
+    "file:///etc/passwd",
+    "/uploads/../music.db",
+    "http://127.0.0.1/cover.jpg",
+    "http://localhost/cover.jpg",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/cover.jpg",
+    "http://10.0.0.1/cover.jpg",
+])
+def test_sources_outside_uploads_and_public_hosts_are_refused(client, cover_url):
+    response = playlist_image(client, cover_url)
+    assert response.status_code == 502
+    assert not response.headers["content-type"].startswith("image/")
+
+def test_upload_is_resized(client, workdir):
+    os.makedirs(workdir / "uploads", exist_ok=True)
+    Image.new("RGB", (600, 300), (10, 20, 30)).save(workdir / "uploads" / "cover.png")
+    response = playlist_image(client, "/uploads/cover.png")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(response.content)).size == (64, 32)
+
+def test_upload_that_is_not_an_image_is_not_sent(client, workdir):
+    os.makedirs(workdir / "uploads", exist_ok=True)
+    (workdir / "uploads" / "notes.png").write_bytes(b"root:x:0:0:root:/root:/bin/sh\n")
+    response = playlist_image(client, "/uploads/notes.png")
+    assert response.status_code == 415
+    assert b"root:x" not in response.content
+
+def test_remote_source_is_fetched_once_and_cached(client, cache, upstream):
+    playlist = client.post("/api/playlists", json={"name": "remote", "coverUrl": f"{upstream}/red.png"}).json()["data"]
+    for _ in range(3):
+        response = client.get(f"/api/images/playlists:{playlist['id']}?w=100")
+        assert response.status_code == 200
+        assert Image.open(io.BytesIO(response.content)).size == (128, 128)
+    assert cache.fetched == [f"{upstream}/red.png"]
+    assert (cache.stats()["misses"], cache.stats()["hits"]) == (1, 2)
+
+def concurrently(count, func):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = func()
+        except HTTPException as e:
+            results[i] = e.status_code
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_concurrent_requests_render_once(cache, upstream, monkeypatch):
+    renders = []
+    real_render = images.render
+    monkeypatch.setattr(images, "render", lambda *args: renders.append(args[1]) or real_render(*args))
+    paths = concurrently(8, lambda: cache.derivative(f"{upstream}/green.png", 256, webp=False))
+    assert len(set(paths)) == 1 and os.path.isfile(paths[0])
+    assert cache.fetched == [f"{upstream}/green.png"]
+    assert renders == [256]
+
+def test_waiters_get_the_leaders_status(cache, upstream):
+    statuses = concurrently(4, lambda: cache.derivative(f"{upstream}/notes.png", 256, webp=False))
+    assert statuses == [415] * 4
+    assert cache.fetched == [f"{upstream}/notes.png"]
+
+def test_least_recently_used_rendering_is_evicted(cache, upstream):
+    red, green, blue = (f"{upstream}/{name}" for name in SOURCES)
+    cache.derivative(red, 512, webp=False)
+    cache.max_bytes = int(cache.stats()["bytes"] * 2.5)  # room for two renderings
+    cache.derivative(green, 512, webp=False)
+    cache.derivative(red, 512, webp=False)  # red is now the most recently used
+    cache.derivative(blue, 512, webp=False)
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+    fetched = len(cache.fetched)
+    cache.derivative(red, 512, webp=False)
+    assert len(cache.fetched) == fetched
+    cache.derivative(green, 512, webp=False)
+    assert cache.fetched[fetched:] == [green]
@@ -0,0 +1,45 @@
+import sqlite3
+
+from migrations import MIGRATIONS, get_schema_version, migrate
+
+def rename_trigger(conn: sqlite3.Connection) -> str:
+    return conn.execute("SELECT sql FROM sqlite_master WHERE name = 'artists_fts_after_rename'").fetchone()[0]
+
+def test_upgrade_recreates_the_rename_trigger(client, workdir):
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        assert get_schema_version(conn) == len(MIGRATIONS)
+        assert "WHEN OLD.name IS NOT NEW.name" in rename_trigger(conn)
+
+        # A database at version 8 still has the trigger without WHEN
+        sql = rename_trigger(conn)
+        conn.execute("DROP TRIGGER artists_fts_after_rename")
+        conn.execute(sql.replace(" WHEN OLD.name IS NOT NEW.name", ""))
+        conn.execute("PRAGMA user_version = 8")
+        conn.commit()
+
+        assert migrate(conn) == len(MIGRATIONS)
+        assert rename_trigger(conn) == sql
+    finally:
+        conn.close()
+
+def test_saving_an_artist_unchanged_skips_reindexing(client, library, workdir):
+    conn = sqlite3.connect(str(workdir / "music.db"))
+    try:
+        artist_id = library["artists"][0]
+
+        def changes_of_unchanged_save() -> int:
+            before = conn.total_changes
+            conn.execute("UPDATE artists SET name = name WHERE id = ?", (artist_id,))
+            return conn.total_changes - before
+
+        guarded = changes_of_unchanged_save()
+        sql = rename_trigger(conn)
+        conn.execute("DROP TRIGGER artists_fts_after_rename")
+        conn.execute(sql.replace(" WHEN OLD.name IS NOT NEW.name", ""))
+        # Without WHEN the artist's songs and albums are deleted and re-inserted
+        assert changes_of_unchanged_save() > guarded
+        conn.rollback()
+        assert rename_trigger(conn) == sql
+    finally:
+        conn.close()
@@ -0,0 +1,31 @@
+import base64
+import json
+
+import pytest
+
+def encode(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+def test_cursor_walks_every_song(client, library):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 5, "sort_by": "title_asc", **({"cursor": cursor} if cursor else {})}
+        body = client.get("/api/songs", params=params).json()
+        seen += [song["id"] for song in body["data"]]
+        cursor = body["nextCursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(library["songs"])
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    encode({"a": 1}),
+    encode(["created_desc", {"a": 1}, "x"]),
+    encode(["created_desc", "2024-01-01", 3]),
+    encode(["created_desc", ["x"], "x"]),
+    encode(["created_desc", True, "x"]),
+    encode(["title_asc", "x", "x"]),
+])
+def test_invalid_cursor_is_rejected(client, cursor):
+    response = client.get("/api/songs", params={"cursor": cursor})
+    assert response.status_code == 400
@@ -0,0 +1,83 @@
+import re
+import sqlite3
+
+import pytest
+
+import db
+from response_cache import response_cache
+
+# Every statement a public endpoint runs is captured (with its parameters
+# bound) and planned again; none may read the songs table front to back.
+# Index-ordered scans (ORDER BY ... LIMIT) are fine, full table scans are not.
+ENDPOINTS = [
+    "/api/artists",
+    "/api/artists/{artist}",
+    "/api/artists/{artist}/songs",
+    "/api/artists/{artist}/albums",
+    "/api/albums",
+    "/api/albums/{album}",
+    "/api/albums/{album}/songs",
+    "/api/songs",
+    "/api/songs?sort_by=created_asc",
+    "/api/songs?sort_by=title_desc",
+    "/api/songs?sort_by=play_count_desc",
+    "/api/songs/{song}",
+    "/api/songs/{song}/similar",
+    "/api/playlists",
+    "/api/playlists/{playlist}",
+    "/api/moods",
+    "/api/moods/{mood}",
+    "/api/moods/{mood}/songs",
+    "/api/search?q=song",
+    "/api/recommendations?type=hot",
+    "/api/recommendations?type=new&artistId={artist}",
+    "/api/recommendations?type=hot&moodId={mood}",
+    "/api/recommendations?type=hot&genreId=rock",
+    "/api/trending/songs",
+    "/api/hot/songs",
+    "/api/new/songs",
+]
+SONGS_ALIAS = re.compile(r"\bsongs\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+
+@pytest.fixture
+def captured(client):
+    statements = []
+
+    def traced_db():
+        conn = db.pool.acquire()
+        conn.set_trace_callback(statements.append)
+        try:
+            yield conn
+        finally:
+            conn.set_trace_callback(None)
+            db.pool.release(conn)
+
+    # Cached responses would skip the queries under test
+    response_cache.clear()
+    client.app.dependency_overrides[db.get_db] = traced_db
+    yield statements
+    client.app.dependency_overrides.pop(db.get_db)
+
+def songs_scans(conn: sqlite3.Connection, sql: str):
+    names = {"songs"} | {alias.lower() for alias in SONGS_ALIAS.findall(sql)}
+    for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+        detail = row[3]
+        match = re.match(r"SCAN (\w+)", detail)
+        if match and match[1].lower() in names and "INDEX" not in detail:
+            yield detail
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_endpoint_queries_do_not_scan_songs(client, library, captured, endpoint):
+    url = endpoint.format(artist=library["artists"][0], album=library["albums"][0], song=library["songs"][0],
+                          playlist=library["playlists"][0], mood=library["moods"][1])
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+
+    selects = [sql for sql in captured if sql.lstrip().upper().startswith(("SELECT", "WITH"))]
+    assert selects
+    conn = sqlite3.connect(db.DB_PATH)
+    try:
+        for sql in selects:
+            assert not list(songs_scans(conn, sql)), " ".join(sql.split())
+    finally:
+        conn.close()
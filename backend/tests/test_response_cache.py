@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from response_cache import ResponseCache, response_cache
+
+@pytest.fixture
+def database(client, workdir):
+    return str(workdir / "music.db")
+
+def test_validators_hold_until_a_write(database):
+    cache = ResponseCache(database, ttl=0.1)
+    _, first = cache.snapshot(("songs",))
+    time.sleep(0.15)
+    _, later = cache.snapshot(("songs",))
+    assert later == first
+
+def test_invalidate_changes_the_etag(database):
+    cache = ResponseCache(database, ttl=3600)
+    _, before = cache.snapshot(("songs", "albums"))
+    cache.invalidate("albums")
+    _, after = cache.snapshot(("songs", "albums"))
+    assert before.etag != after.etag
+    assert after.modified > before.modified
+
+def test_workers_and_restarts_share_generations(database):
+    # Two caches on one database stand for two worker processes, or for one
+    # process before and after a restart
+    worker, other = ResponseCache(database, ttl=3600), ResponseCache(database, ttl=3600)
+    generations, validators = worker.snapshot(("songs",))
+    assert other.snapshot(("songs",))[1] == validators
+
+    worker.put("/api/songs?", b"[]", ("songs",), generations, validators)
+    assert worker.get("/api/songs?", ("songs",)) is not None
+    other.invalidate("songs")
+    # The other worker's write reaches this one's entries and validators
+    assert worker.get("/api/songs?", ("songs",)) is None
+    assert worker.snapshot(("songs",))[1] == other.snapshot(("songs",))[1] != validators
+    assert ResponseCache(database).snapshot(("songs",))[1] == other.snapshot(("songs",))[1]
+
+@pytest.mark.parametrize("action, url", [
+    ("/api/admin/recount", "/api/songs"),
+    ("/api/admin/recount", "/api/playlists"),
+    ("/api/admin/search/rebuild", "/api/search?q=song"),
+])
+def test_admin_rebuilds_invalidate_dependent_responses(client, admin_headers, library, monkeypatch, action, url):
+    monkeypatch.setattr(response_cache, "ttl", 3600)
+    etag = client.get(url).headers["etag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.post(action, headers=admin_headers).status_code == 200
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+@pytest.mark.parametrize("kind, urls", [
+    ("songs", ["/api/songs", "/api/playlists", "/api/moods"]),
+    ("artists", ["/api/songs", "/api/albums", "/api/artists"]),
+    ("albums", ["/api/songs", "/api/albums", "/api/artists"]),
+])
+def test_deletes_invalidate_payloads_that_embed_the_row(client, admin_headers, library, monkeypatch, kind, urls):
+    monkeypatch.setattr(response_cache, "ttl", 3600)
+    def create(path, key, payload):
+        assert client.post(path, json=payload, headers=admin_headers).status_code == 200
+        rows = client.get(path, headers=admin_headers).json()["data"]
+        return next(row["id"] for row in rows if row[key] == payload[key])
+
+    artist_id = create("/api/admin/artists", "name", {"name": "Deleted Artist", "bio": "b", "genres": []})
+    album_id = create("/api/admin/albums", "title", {"title": "Deleted Album", "artistId": artist_id, "releaseDate": "2020"})
+    song_id = create("/api/admin/songs", "title", {"title": "Deleted Song", "artistId": artist_id, "albumId": album_id,
+                                                  "duration": 100})
+    created = {"songs": song_id, "albums": album_id, "artists": artist_id}
+    try:
+        etags = {url: client.get(url).headers["etag"] for url in urls}
+        assert client.delete(f"/api/admin/{kind}/{created[kind]}", headers=admin_headers).status_code == 200
+        for url, etag in etags.items():
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 200, url
+    finally:
+        for table, row_id in created.items():
+            client.delete(f"/api/admin/{table}/{row_id}", headers=admin_headers)
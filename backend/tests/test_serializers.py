@@ -0,0 +1,35 @@
+import json
+
+import serializers
+from serializers import FragmentCache
+
+def song_row(**changes):
+    row = {"id": "s1", "title": "Song", "artistId": "a1", "albumId": None, "duration": 100, "audioUrl": "/a.mp3",
+           "coverUrl": None, "lyrics": "la " * 1000, "playCount": 1, "liked": 0, "genre": "pop",
+           "createdAt": "2024-01-01T00:00:00", "updatedAt": "2024-01-01T00:00:00"}
+    row.update(changes)
+    return row
+
+def encode(row):
+    return json.loads(serializers.dumps(serializers.song(row, [], None, [], None)))
+
+def test_least_recently_used_fragment_is_evicted():
+    cache = FragmentCache(size=2)
+    cache.put("song", "a", (1,), [b"a"])
+    cache.put("song", "b", (1,), [b"b"])
+    assert cache.get("song", "a", (1,)) == [b"a"]
+    cache.put("song", "c", (1,), [b"c"])
+    assert cache.get("song", "b", (1,)) is None
+    assert cache.get("song", "a", (1,)) == [b"a"]
+    assert cache.get("song", "a", (2,)) is None
+
+def test_fragments_follow_counters_and_saves(monkeypatch):
+    monkeypatch.setattr(serializers, "fragments", FragmentCache())
+    assert encode(song_row())["playCount"] == 1
+    # Plays and the metadata writer leave updatedAt alone
+    assert encode(song_row(playCount=2))["playCount"] == 2
+    assert encode(song_row(playCount=2, duration=200))["duration"] == 200
+    # Lyrics are not compared, but only change in a save that sets updatedAt
+    saved = song_row(playCount=2, duration=200, lyrics="new", updatedAt="2024-02-01T00:00:00")
+    assert encode(saved)["lyrics"] == "new"
+    assert all("la la" not in str(version) for version, _ in serializers.fragments._entries.values())
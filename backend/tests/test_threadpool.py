@@ -0,0 +1,50 @@
+import threading
+import time
+
+from fastapi import Request
+
+import db
+from response_cache import response_cache
+
+def test_slow_query_does_not_delay_other_requests(client, library):
+    """A query stuck in SQLite holds one worker thread, not the event loop"""
+    entered, release = threading.Event(), threading.Event()
+
+    def stall():
+        if not entered.is_set():
+            entered.set()
+            release.wait(10)
+        return 0
+
+    def slow_db(request: Request):
+        conn = db.pool.acquire()
+        if request.url.path == "/api/search":
+            # Called from inside sqlite3 while the search handler's query runs
+            conn.set_progress_handler(stall, 1)
+        try:
+            yield conn
+        finally:
+            conn.set_progress_handler(None, 0)
+            db.pool.release(conn)
+
+    response_cache.clear()
+    client.app.dependency_overrides[db.get_db] = slow_db
+    searches = []
+    search = threading.Thread(target=lambda: searches.append(client.get("/api/search?q=song")))
+    try:
+        search.start()
+        assert entered.wait(5)
+
+        started = time.monotonic()
+        moods = client.get("/api/moods")
+        elapsed = time.monotonic() - started
+
+        assert moods.status_code == 200
+        assert len(moods.json()) == len(library["moods"])
+        assert search.is_alive()
+        assert elapsed < 1.0
+    finally:
+        release.set()
+        search.join(10)
+        client.app.dependency_overrides.pop(db.get_db)
+    assert searches[0].status_code == 200
@@ -0,0 +1,17 @@
+import hashlib
+import os
+
+def test_rewritten_chunk_is_hashed_again(client, admin_headers):
+    data = os.urandom(300_000)
+    session = client.post("/api/admin/uploads", json={"filename": "take.flac", "size": len(data)},
+                          headers=admin_headers).json()["data"]
+    url = f"/api/admin/uploads/{session['id']}"
+    assert client.put(f"{url}?offset=0", content=data, headers=admin_headers).status_code == 200
+    # A retry of the first bytes, carrying different ones, after they were hashed
+    patch = b"\0" * 1000
+    assert client.put(f"{url}?offset=100", content=patch, headers=admin_headers).status_code == 200
+
+    stored = client.post(f"{url}/complete", headers=admin_headers).json()["data"]
+    expected = data[:100] + patch + data[1100:]
+    assert stored["sha256"] == hashlib.sha256(expected).hexdigest()
+    assert client.get(stored["url"]).content == expected
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import sqlite3
+from typing import AsyncIterator, Dict, List, Optional
+
+import anyio.to_thread
+from fastapi import HTTPException
+
+from media_store import UPLOAD_DIR, clean_extension, store_file
+
+# Resumable chunked uploads for /api/admin/uploads. Chunks are written at
+# their offsets into one data file, in any order and in parallel, and the byte
+# ranges received so far are kept next to it, so an interrupted upload resumes
+# where it stopped, across restarts too.
+SESSION_DIR = os.path.join(UPLOAD_DIR, ".sessions")
+UPLOAD_MAX_BYTES = int(os.environ.get("MUSIC_UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested to clients
+UPLOAD_CHUNK_MAX_BYTES = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = float(os.environ.get("MUSIC_UPLOAD_SESSION_TTL", str(24 * 3600)))
+HASH_BLOCK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+class UploadSession:
+    """One upload in progress: its data file, the ranges received and a running SHA-256.
+
+    The hash advances over the contiguous prefix as soon as a chunk extends
+    it, reading back bytes that were just written, so completing an upload
+    only hashes whatever arrived last. A chunk that rewrites bytes already
+    hashed, a retry possibly carrying different bytes, restarts the hash.
+    """
+
+    def __init__(self, session_id: str, filename: str, size: int, sha256: Optional[str] = None,
+                 received: Optional[List[List[int]]] = None):
+        self.id = session_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256  # expected digest, checked on completion when given
+        self.received = received or []  # sorted, merged [start, end) ranges
+        self.data_path = os.path.join(SESSION_DIR, f"{session_id}.data")
+        self.meta_path = os.path.join(SESSION_DIR, f"{session_id}.json")
+        self._lock = threading.Lock()
+        self._hash_lock = threading.Lock()
+        self._hash = hashlib.sha256()
+        self._hashed = 0
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            received = [list(r) for r in self.received]
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunkSize": UPLOAD_CHUNK_SIZE,
+            "received": received,
+            "receivedBytes": sum(end - start for start, end in received),
+        }
+
+    def _save(self):
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, "w") as meta:
+            json.dump({"filename": self.filename, "size": self.size, "sha256": self.sha256,
+                       "received": self.received}, meta)
+        os.replace(temp_path, self.meta_path)
+
+    def write_at(self, offset: int, data: bytes):
+        fd = os.open(self.data_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+        finally:
+            os.close(fd)
+
+    def record(self, start: int, end: int):
+        """Mark [start, end) as written, then hash whatever that made contiguous"""
+        if end <= start:
+            return
+        with self._lock:
+            ranges = sorted(self.received + [[start, end]])
+            merged = [ranges[0]]
+            for range_start, range_end in ranges[1:]:
+                if range_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_end)
+                else:
+                    merged.append([range_start, range_end])
+            self.received = merged
+            self._save()
+        self._advance_hash(rewritten_from=start)
+
+    def _prefix(self) -> int:
+        with self._lock:
+            return self.received[0][1] if self.received and self.received[0][0] == 0 else 0
+
+    def _advance_hash(self, rewritten_from: Optional[int] = None):
+        with self._hash_lock:
+            if rewritten_from is not None and rewritten_from < self._hashed:
+                # Recorded only after its bytes are written, so any overwrite
+                # of hashed bytes is caught here; a stale digest would name
+                # the file after content it does not have
+                self._hash = hashlib.sha256()
+                self._hashed = 0
+            end = self._prefix()
+            if end <= self._hashed:
+                return
+            with open(self.data_path, "rb") as data:
+                data.seek(self._hashed)
+                while self._hashed < end:
+                    block = data.read(min(HASH_BLOCK_SIZE, end - self._hashed))
+                    if not block:
+                        break
+                    self._hash.update(block)
+                    self._hashed += len(block)
+
+    def complete(self, conn: sqlite3.Connection) -> Dict:
+        """Check the upload is whole and matches its digest, then move it into the media store"""
+        if self.size and self._prefix() < self.size:
+            raise HTTPException(status_code=409, detail="Upload is incomplete")
+        if self.size == 0:
+            open(self.data_path, "ab").close()
+        self._advance_hash()
+        digest = self._hash.hexdigest()
+        if self.sha256 and digest != self.sha256.lower():
+            discard_session(self.id)
+            raise HTTPException(status_code=400, detail="Checksum mismatch, upload discarded")
+
+        try:
+            stored = store_file(conn, self.data_path, clean_extension(self.filename), digest)
+        except FileNotFoundError:
+            # Completed by a concurrent request
+            raise HTTPException(status_code=404, detail="Upload session not found")
+        discard_session(self.id)
+        return stored
+
+async def receive_chunk(session: UploadSession, offset: int, body: AsyncIterator[bytes]) -> Dict:
+    """Write a request body at `offset`, buffered and off the event loop.
+
+    Whatever arrived is recorded even if the client goes away mid-chunk, so
+    the retry only needs to send the rest.
+    """
+    position = offset
+    buffer = bytearray()
+    try:
+        async for piece in body:
+            if position + len(buffer) + len(piece) > session.size:
+                raise HTTPException(status_code=400, detail="Chunk extends past the declared file size")
+            if position + len(buffer) + len(piece) - offset > UPLOAD_CHUNK_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Chunks are limited to {UPLOAD_CHUNK_MAX_BYTES} bytes")
+            buffer += piece
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await anyio.to_thread.run_sync(session.write_at, position, bytes(buffer))
+                position += len(buffer)
+                buffer.clear()
+        if buffer:
+            await anyio.to_thread.run_sync(session.write_at, position, bytes(buffer))
+            position += len(buffer)
+    finally:
+        await anyio.to_thread.run_sync(session.record, offset, position)
+    return session.to_dict()
+
+_sessions: Dict[str, UploadSession] = {}
+_sessions_lock = threading.Lock()
+
+def _sweep_sessions():
+    """Remove sessions nobody has written to within the TTL"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for name in os.listdir(SESSION_DIR):
+        path = os.path.join(SESSION_DIR, name)
+        if name.endswith(".json") and os.path.getmtime(path) < cutoff:
+            discard_session(name[:-len(".json")])
+
+def create_session(filename: str, size: int, sha256: Optional[str] = None) -> UploadSession:
+    if not filename:
+        raise HTTPException(status_code=400, detail="No file selected")
+    if size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit")
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    _sweep_sessions()
+    session = UploadSession(uuid.uuid4().hex, filename, size, sha256)
+    session._save()
+    with _sessions_lock:
+        _sessions[session.id] = session
+    return session
+
+def get_session(session_id: str) -> UploadSession:
+    """The session, reloaded from disk after a restart; 404 if unknown or expired"""
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is not None:
+            return session
+        if re.fullmatch(r"[0-9a-f]{32}", session_id):
+            try:
+                with open(os.path.join(SESSION_DIR, f"{session_id}.json")) as meta:
+                    saved = json.load(meta)
+            except (OSError, ValueError):
+                saved = None
+            if saved is not None:
+                session = _sessions[session_id] = UploadSession(session_id, saved["filename"], saved["size"],
+                                                                saved.get("sha256"), saved["received"])
+                return session
+    raise HTTPException(status_code=404, detail="Upload session not found")
+
+def discard_session(session_id: str):
+    with _sessions_lock:
+        _sessions.pop(session_id, None)
+    for suffix in (".data", ".json"):
+        try:
+            os.remove(os.path.join(SESSION_DIR, session_id + suffix))
+        except OSError:
+            pass
@@ -1,201 +1,342 @@
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any, Union
 import sqlite3
 import json
+import base64
 import os
 import mimetypes
 import uuid
 from datetime import datetime
 
+import serializers
+from db import get_db
+from counters import get_count
+from search_index import MIN_FTS_QUERY_LENGTH, has_search_index, fts_phrase
+from suggest_index import suggestions
+from response_cache import cached, conditional, response_cache
+from byte_ranges import file_response
+from audio_cache import audio_cache, is_remote
+from images import IMAGE_SOURCES, image_cache
+from playlist_songs import get_playlist_song_ids, append_playlist_song, remove_playlist_song, move_playlist_song
+
 router = APIRouter()
 
 # Helper functions
-def parse_json_field(field_value: str) -> List[str]:
-    if not field_value:
-        return []
-    try:
-        return json.loads(field_value)
-    except:
-        return []
-
-def ensure_https_url(url: str) -> str:
-    """Convert HTTP URLs to HTTPS to prevent mixed content issues"""
-    if url and url.startswith('http://'):
-        return url.replace('http://', 'https://', 1)
-    return url
-
 def get_artist_by_id(cursor, artist_id: str) -> Optional[Dict]:
     cursor.execute('SELECT * FROM artists WHERE id=?', (artist_id,))
     row = cursor.fetchone()
     if not row:
         return None
-    return {
-        "id": row[0],
-        "name": row[1],
-        "bio": row[2],
-        "avatar": ensure_https_url(row[3]),
-        "coverUrl": ensure_https_url(row[4]),
-        "followers": row[5],
-        "songCount": row[6],
-        "albumCount": row[7],
-        "genres": parse_json_field(row[8]),
-        "verified": bool(row[9]),
-        "createdAt": row[10],
-        "updatedAt": row[11]
-    }
+    return serializers.artist(row)
 
 def get_album_by_id(cursor, album_id: str) -> Optional[Dict]:
-    cursor.execute('''
-        SELECT a.*, ar.name as artist_name FROM albums a 
-        JOIN artists ar ON a.artistId = ar.id 
-        WHERE a.id=?
-    ''', (album_id,))
-    row = cursor.fetchone()
-    if not row:
+    hydrator = Hydrator(cursor)
+    hydrator.load_albums([album_id])
+    return hydrator.albums.get(album_id)
+
+# SQLite builds before 3.32 only allow 999 bound parameters per statement
+MAX_IN_PARAMS = 500
+
+# Plain song keys selectable with ?fields=
+SONG_FIELDS = ["id", "title", "artistId", "albumId", "duration", "audioUrl", "coverUrl", "lyrics",
+               "moodIds", "playCount", "liked", "genre", "createdAt", "updatedAt"]
+# Columns of the songs table those keys are read from; moodIds comes from
+# song_moods, so the legacy songs.moodIds column is never selected
+SONG_COLUMNS = [field for field in SONG_FIELDS if field != "moodIds"]
+# Relations selectable with ?include=, and the song keys each one fills
+SONG_INCLUDES = {"artists": ["artist", "artists"], "album": ["album"], "moods": ["moods"]}
+
+class SongProjection:
+    """The parts of a song payload a request asked for.
+
+    Omitted columns are selected as NULL and omitted relations are never
+    loaded, so a slim list page costs less to query as well as to send.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None, include: Optional[List[str]] = None):
+        self.fields = set(SONG_FIELDS if fields is None else fields) | {"id"}
+        self.include = set(SONG_INCLUDES if include is None else include)
+        self.keys = self.fields | {key for name in self.include for key in SONG_INCLUDES[name]}
+        self.complete = self.fields == set(SONG_FIELDS) and self.include == set(SONG_INCLUDES)
+
+    def wants(self, key: str) -> bool:
+        return key in self.keys
+
+    def columns(self, *required: str) -> str:
+        """Select list replacing `s.*`; id, albumId and any required (e.g. sort key) columns are always read"""
+        if self.complete:
+            return "s.*"
+        needed = self.fields | {"id", "albumId"} | set(required)
+        return ", ".join(f"s.{c}" if c in needed else f"NULL AS {c}" for c in SONG_COLUMNS)
+
+ALL_SONG_PARTS = SongProjection()
+
+def _split_names(value: Optional[str], allowed, param: str) -> Optional[List[str]]:
+    if value is None:
         return None
-    
-    # Get all artists for this album
-    album_artists = get_album_artists(cursor, album_id)
-    primary_artist = next((a for a in album_artists if a.get('isPrimary')), album_artists[0] if album_artists else None)
-    
-    return {
-        "id": row[0],
-        "title": row[1],
-        "artistId": row[2],
-        "artist": primary_artist,  # Primary artist for backward compatibility
-        "artists": album_artists,  # All artists
-        "coverUrl": ensure_https_url(row[3]),
-        "releaseDate": row[4],
-        "songCount": row[5],
-        "duration": row[6],
-        "genre": row[7],
-        "description": row[8],
-        "createdAt": row[9],
-        "updatedAt": row[10]
-    }
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown {param}: {', '.join(unknown)}")
+    return names
 
-def get_album_artists(cursor, album_id: str) -> List[Dict]:
-    """Get all artists for an album with primary artist info"""
-    cursor.execute('''
-        SELECT a.*, aa.isPrimary FROM artists a
-        JOIN album_artists aa ON a.id = aa.artistId
-        WHERE aa.albumId = ?
-        ORDER BY aa.isPrimary DESC, a.name ASC
-    ''', (album_id,))
-    rows = cursor.fetchall()
-    
-    artists = []
-    for row in rows:
-        artist = {
-            "id": row[0],
-            "name": row[1],
-            "bio": row[2],
-            "avatar": ensure_https_url(row[3]),
-            "coverUrl": ensure_https_url(row[4]),
-            "followers": row[5],
-            "songCount": row[6],
-            "albumCount": row[7],
-            "genres": parse_json_field(row[8]),
-            "verified": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11],
-            "isPrimary": bool(row[12])
-        }
-        artists.append(artist)
-    
-    return artists
+def song_projection(
+    fields: Optional[str] = Query(None, description="Comma-separated song fields to return; id is always included"),
+    include: Optional[str] = Query(None, description="Comma-separated relations to embed: artists, album, moods")
+) -> SongProjection:
+    """Dependency for song-returning endpoints; by default every field and relation is returned"""
+    return SongProjection(_split_names(fields, SONG_FIELDS, "field"), _split_names(include, SONG_INCLUDES, "include"))
 
-def get_song_artists(cursor, song_id: str) -> List[Dict]:
-    """Get all artists for a song with primary artist info"""
-    cursor.execute('''
-        SELECT a.*, sa.isPrimary FROM artists a
-        JOIN song_artists sa ON a.id = sa.artistId
-        WHERE sa.songId = ?
-        ORDER BY sa.isPrimary DESC, a.name ASC
-    ''', (song_id,))
-    rows = cursor.fetchall()
-    
-    artists = []
-    for row in rows:
-        artist = {
-            "id": row[0],
-            "name": row[1],
-            "bio": row[2],
-            "avatar": ensure_https_url(row[3]),
-            "coverUrl": ensure_https_url(row[4]),
-            "followers": row[5],
-            "songCount": row[6],
-            "albumCount": row[7],
-            "genres": parse_json_field(row[8]),
-            "verified": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11],
-            "isPrimary": bool(row[12])
-        }
-        artists.append(artist)
-    
-    return artists
+class Hydrator:
+    """Loads the relations of a page of rows with one query per relation.
 
-def get_moods_for_song(cursor, mood_ids: List[str]) -> List[Dict]:
-    if not mood_ids:
-        return []
-    
-    placeholders = ','.join('?' * len(mood_ids))
-    cursor.execute(f'SELECT * FROM moods WHERE id IN ({placeholders})', mood_ids)
-    rows = cursor.fetchall()
-    
-    moods = []
-    for row in rows:
-        mood = {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "icon": row[3],
-            "color": row[4],
-            "coverUrl": ensure_https_url(row[5]),
-            "songCount": row[6],
-            "createdAt": row[7],
-            "updatedAt": row[8]
-        }
-        moods.append(mood)
-    
-    return moods
+    Loaded entities are kept in per-instance identity maps, so use one
+    Hydrator per request and every album, mood and artist is read once.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.artists = {}        # artist id -> artist dict (without isPrimary)
+        self.albums = {}         # album id -> album dict, None if missing
+        self.moods = {}          # mood id -> mood dict, None if missing
+        self.song_artists = {}   # song id -> [artist dict with isPrimary]
+        self.song_mood_ids = {}  # song id -> [mood id], in song_moods order
+        self.album_artists = {}  # album id -> [artist dict with isPrimary]
+
+    def _select_in(self, sql: str, ids: List[str]):
+        rows = []
+        for i in range(0, len(ids), MAX_IN_PARAMS):
+            chunk = ids[i:i + MAX_IN_PARAMS]
+            self.cursor.execute(sql.format(','.join('?' * len(chunk))), chunk)
+            rows.extend(self.cursor.fetchall())
+        return rows
+
+    def _artist(self, row) -> Dict:
+        artist = self.artists.get(row["id"])
+        if artist is None:
+            artist = self.artists[row["id"]] = serializers.artist(row)
+        return serializers.with_primary(artist, row["isPrimary"])
+
+    def _load_artist_links(self, table: str, key: str, cache: Dict, ids: List[str]):
+        missing = [i for i in dict.fromkeys(ids) if i not in cache]
+        for owner_id in missing:
+            cache[owner_id] = []
+        if not missing:
+            return
+        rows = self._select_in(f'''
+            SELECT l.{key}, a.*, l.isPrimary FROM artists a
+            JOIN {table} l ON a.id = l.artistId
+            WHERE l.{key} IN ({{}})
+            ORDER BY l.{key}, l.isPrimary DESC, a.name ASC
+        ''', missing)
+        for row in rows:
+            cache[row[key]].append(self._artist(row))
+
+    def load_song_mood_ids(self, song_ids: List[str]):
+        missing = [i for i in dict.fromkeys(song_ids) if i not in self.song_mood_ids]
+        for song_id in missing:
+            self.song_mood_ids[song_id] = []
+        if not missing:
+            return
+        rows = self._select_in('''
+            SELECT songId, moodId FROM song_moods
+            WHERE songId IN ({})
+            ORDER BY songId, position
+        ''', missing)
+        for song_id, mood_id in rows:
+            self.song_mood_ids[song_id].append(mood_id)
+
+    def load_song_artists(self, song_ids: List[str]):
+        self._load_artist_links('song_artists', 'songId', self.song_artists, song_ids)
+
+    def load_album_artists(self, album_ids: List[str]):
+        self._load_artist_links('album_artists', 'albumId', self.album_artists, album_ids)
+
+    def load_albums(self, album_ids: List[str]):
+        missing = [i for i in dict.fromkeys(album_ids) if i not in self.albums]
+        if not missing:
+            return
+        rows = self._select_in('''
+            SELECT a.*, ar.name as artist_name FROM albums a
+            JOIN artists ar ON a.artistId = ar.id
+            WHERE a.id IN ({})
+        ''', missing)
+        for album_id in missing:
+            self.albums[album_id] = None
+        for album in self.build_albums(rows):
+            self.albums[album["id"]] = album
+
+    def load_moods(self, mood_ids: List[str]):
+        missing = [i for i in dict.fromkeys(mood_ids) if i not in self.moods]
+        if not missing:
+            return
+        for mood_id in missing:
+            self.moods[mood_id] = None
+        for row in self._select_in('SELECT * FROM moods WHERE id IN ({})', missing):
+            self.moods[row["id"]] = serializers.mood(row)
+
+    def build_albums(self, rows) -> List[Dict]:
+        """Build album dicts from `albums a.* + artist_name` rows"""
+        self.load_album_artists([row["id"] for row in rows])
+        return [serializers.album(row, self.album_artists[row["id"]]) for row in rows]
+
+    def build_songs(self, rows, projection: SongProjection = ALL_SONG_PARTS) -> List[Dict]:
+        """Build song dicts from `songs s.* + artist_name + album_title` rows, loading only the projected relations"""
+        song_ids = [row["id"] for row in rows]
+        with_artists = projection.wants("artists")
+        with_album = projection.wants("album")
+        with_moods = projection.wants("moods")
+        if with_moods or projection.wants("moodIds"):
+            self.load_song_mood_ids(song_ids)
+            mood_ids_by_song = [self.song_mood_ids[song_id] for song_id in song_ids]
+        else:
+            mood_ids_by_song = [[] for _ in song_ids]
+        if with_artists:
+            self.load_song_artists(song_ids)
+        if with_album:
+            self.load_albums([row["albumId"] for row in rows if row["albumId"]])
+        if with_moods:
+            self.load_moods([mood_id for mood_ids in mood_ids_by_song for mood_id in mood_ids])
+        
+        songs = []
+        for row, mood_ids in zip(rows, mood_ids_by_song):
+            # Same order as `SELECT * FROM moods WHERE id IN (...)`, i.e. by id
+            moods = [self.moods[m] for m in sorted(set(mood_ids)) if self.moods.get(m)] if with_moods else None
+            songs.append(serializers.song(
+                row,
+                self.song_artists[row["id"]] if with_artists else [],
+                self.albums.get(row["albumId"]) if row["albumId"] and with_album else None,
+                mood_ids,
+                moods,
+                keys=None if projection.complete else projection.keys
+            ))
+        return songs
+
+    def sideload(self, songs: List[Dict]) -> Dict:
+        """Replace the nested relations of built songs with ids and return every related entity once.
+
+        Songs get `artistIds` (primary first) instead of `artist`/`artists`
+        and keep only `albumId`/`moodIds`; albums likewise reference their
+        artists by id. Relations a projection left out stay left out.
+        """
+        artists, albums, moods = {}, {}, {}
+        
+        def artist_ids(owner: Dict) -> List[str]:
+            owner.pop("artist", None)
+            ids = []
+            for artist in owner.pop("artists"):
+                artists.setdefault(artist["id"], self.artists[artist["id"]])
+                ids.append(artist["id"])
+            return ids
+        
+        normalized = []
+        for song in songs:
+            song = dict(song)
+            if "artists" in song:
+                song["artistIds"] = artist_ids(song)
+            album = song.pop("album", None)
+            if album and album["id"] not in albums:
+                album = dict(album)
+                album["artistIds"] = artist_ids(album)
+                albums[album["id"]] = album
+            for mood in song.pop("moods", None) or []:
+                moods.setdefault(mood["id"], mood)
+            normalized.append(song)
+        return {"songs": normalized, "artists": artists, "albums": albums, "moods": moods}
+
+class Keyset:
+    """Keyset pagination over `ORDER BY <column>, <id>` in one direction.
+
+    The opaque cursor holds the sort key and id of the last row of a page, so
+    the next page starts from a range condition instead of skipping OFFSET
+    rows; where a (column, id) index exists that is an index range scan.
+    Page/limit requests use the same ORDER BY, so a client can switch to the
+    cursor returned with any page.
+    """
+
+    def __init__(self, name: str, column: str, id_column: str, descending: bool):
+        self.name = name
+        self.column = column
+        self.id_column = id_column
+        self.descending = descending
+        self.key = column.rpartition(".")[2]  # name of the sort key in a result row
+
+    def order_by(self) -> str:
+        direction = "DESC" if self.descending else "ASC"
+        return f"ORDER BY {self.column} {direction}, {self.id_column} {direction}"
+
+    def after(self, page_cursor: str):
+        """SQL condition and parameters selecting the rows after a cursor"""
+        try:
+            padded = page_cursor + '=' * (-len(page_cursor) % 4)
+            name, key, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Anything else would reach sqlite3 as an unsupported parameter type
+        if not isinstance(key, (str, int, float, type(None))) or isinstance(key, bool) or not isinstance(row_id, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if name != self.name:
+            raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+        operator = "<" if self.descending else ">"
+        return f"({self.column}, {self.id_column}) {operator} (?, ?)", [key, row_id]
+
+    def next_cursor(self, rows, limit: int) -> Optional[str]:
+        if len(rows) < limit:
+            return None
+        last = rows[-1]
+        value = json.dumps([self.name, last[self.key], last["id"]], ensure_ascii=False)
+        return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+def page_query(keyset: Keyset, page: int, limit: int, page_cursor: Optional[str], conditions: List[str] = None, params: List = None):
+    """WHERE/ORDER BY/LIMIT clause and parameters for either pagination mode"""
+    conditions = list(conditions or [])
+    params = list(params or [])
+    if page_cursor:
+        condition, cursor_params = keyset.after(page_cursor)
+        conditions.append(condition)
+        params.extend(cursor_params)
+        offset = 0
+    else:
+        offset = (page - 1) * limit
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{where_clause} {keyset.order_by()} LIMIT ? OFFSET ?", params + [limit, offset]
+
+SONG_SORTS = {
+    "created_desc": Keyset("created_desc", "s.createdAt", "s.id", True),
+    "created_asc": Keyset("created_asc", "s.createdAt", "s.id", False),
+    "title_asc": Keyset("title_asc", "s.title", "s.id", False),
+    "title_desc": Keyset("title_desc", "s.title", "s.id", True),
+    "play_count_desc": Keyset("play_count_desc", "s.playCount", "s.id", True),
+    "play_count_asc": Keyset("play_count_asc", "s.playCount", "s.id", False),
+}
+ARTIST_SORT = Keyset("song_count_desc", "songCount", "id", True)
+ALBUM_SORT = Keyset("created_desc", "a.createdAt", "a.id", True)
+PLAYLIST_SORT = Keyset("created_desc", "createdAt", "id", True)
+# Filtered through song_moods, so pages are sorted in a temporary B-tree;
+# the cursor still saves materializing the skipped OFFSET rows
+MOOD_SONG_SORT = SONG_SORTS["play_count_desc"]
 
 # Artists API
 @router.get("/api/artists")
-async def get_artists(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100)):
-    conn = sqlite3.connect('music.db')
+@cached("artists", "albums", "songs")
+def get_artists(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    conn: sqlite3.Connection = Depends(get_db)
+):
     cursor = conn.cursor()
     
     # Get total count
-    cursor.execute('SELECT COUNT(*) FROM artists')
-    total = cursor.fetchone()[0]
+    total = get_count(cursor, "artists")
     
     # Get paginated results
-    offset = (page - 1) * limit
-    cursor.execute('SELECT * FROM artists ORDER BY songCount DESC LIMIT ? OFFSET ?', (limit, offset))
+    clause, params = page_query(ARTIST_SORT, page, limit, page_cursor)
+    cursor.execute(f'SELECT * FROM artists {clause}', params)
     rows = cursor.fetchall()
-    conn.close()
-    
-    artists = []
-    for row in rows:
-        artist = {
-            "id": row[0],
-            "name": row[1],
-            "bio": row[2],
-            "avatar": row[3],
-            "coverUrl": ensure_https_url(row[4]),
-            "followers": row[5],
-            "songCount": row[6],
-            "albumCount": row[7],
-            "genres": parse_json_field(row[8]),
-            "verified": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11]
-        }
-        artists.append(artist)
+    
+    artists = [serializers.artist(row) for row in rows]
     
     total_pages = (total + limit - 1) // limit
     
@@ -205,16 +346,16 @@ async def get_artists(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, l
         "total": total,
         "page": page,
         "limit": limit,
-        "totalPages": total_pages
+        "totalPages": total_pages,
+        "nextCursor": ARTIST_SORT.next_cursor(rows, limit)
     }
 
 @router.get("/api/artists/{artist_id}")
-async def get_artist(artist_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("artists", "albums", "songs")
+def get_artist(artist_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     artist = get_artist_by_id(cursor, artist_id)
-    conn.close()
     
     if not artist:
         raise HTTPException(status_code=404, detail="Artist not found")
@@ -222,19 +363,18 @@ async def get_artist(artist_id: str):
     return artist
 
 @router.get("/api/artists/{artist_id}/songs")
-async def get_artist_songs(artist_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_artist_songs(artist_id: str, format: str = Query("nested", regex="^(nested|normalized)$"), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Verify artist exists
     artist = get_artist_by_id(cursor, artist_id)
     if not artist:
-        conn.close()
         raise HTTPException(status_code=404, detail="Artist not found")
     
     # Get songs where this artist is involved (through song_artists table)
-    cursor.execute('''
-        SELECT DISTINCT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT DISTINCT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN song_artists sa ON s.id = sa.songId
         JOIN artists ar ON s.artistId = ar.id 
@@ -244,51 +384,21 @@ async def get_artist_songs(artist_id: str):
     ''', (artist_id,))
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    hydrator = Hydrator(cursor)
+    songs = hydrator.build_songs(rows, projection)
     
-    conn.close()
+    if format == "normalized":
+        return hydrator.sideload(songs)
     return songs
 
 @router.get("/api/artists/{artist_id}/albums")
-async def get_artist_albums(artist_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("albums", "artists", "songs")
+def get_artist_albums(artist_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Verify artist exists
     artist = get_artist_by_id(cursor, artist_id)
     if not artist:
-        conn.close()
         raise HTTPException(status_code=404, detail="Artist not found")
     
     # Get albums where this artist is involved (through album_artists table)
@@ -301,75 +411,34 @@ async def get_artist_albums(artist_id: str):
     ''', (artist_id,))
     rows = cursor.fetchall()
     
-    albums = []
-    for row in rows:
-        # Get all artists for this album
-        album_artists = get_album_artists(cursor, row[0])
-        primary_artist = next((a for a in album_artists if a.get('isPrimary')), album_artists[0] if album_artists else None)
-        
-        album = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": album_artists,  # All artists
-            "coverUrl": ensure_https_url(row[3]),
-            "releaseDate": row[4],
-            "songCount": row[5],
-            "duration": row[6],
-            "genre": row[7],
-            "description": row[8],
-            "createdAt": row[9],
-            "updatedAt": row[10]
-        }
-        albums.append(album)
+    albums = Hydrator(cursor).build_albums(rows)
     
-    conn.close()
     return albums
 
 # Albums API
 @router.get("/api/albums")
-async def get_albums(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100)):
-    conn = sqlite3.connect('music.db')
+@conditional("albums", "artists", "songs")
+def get_albums(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    conn: sqlite3.Connection = Depends(get_db)
+):
     cursor = conn.cursor()
     
     # Get total count
-    cursor.execute('SELECT COUNT(*) FROM albums')
-    total = cursor.fetchone()[0]
+    total = get_count(cursor, "albums")
     
     # Get paginated results
-    offset = (page - 1) * limit
-    cursor.execute('''
+    clause, params = page_query(ALBUM_SORT, page, limit, page_cursor)
+    cursor.execute(f'''
         SELECT a.*, ar.name as artist_name FROM albums a 
         JOIN artists ar ON a.artistId = ar.id 
-        ORDER BY a.createdAt DESC LIMIT ? OFFSET ?
-    ''', (limit, offset))
+        {clause}
+    ''', params)
     rows = cursor.fetchall()
     
-    albums = []
-    for row in rows:
-        # Get all artists for this album
-        album_artists = get_album_artists(cursor, row[0])
-        primary_artist = next((a for a in album_artists if a.get('isPrimary')), album_artists[0] if album_artists else None)
-        
-        album = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": album_artists,  # All artists
-            "coverUrl": ensure_https_url(row[3]),
-            "releaseDate": row[4],
-            "songCount": row[5],
-            "duration": row[6],
-            "genre": row[7],
-            "description": row[8],
-            "createdAt": row[9],
-            "updatedAt": row[10]
-        }
-        albums.append(album)
-    
-    conn.close()
+    albums = Hydrator(cursor).build_albums(rows)
     
     total_pages = (total + limit - 1) // limit
     
@@ -379,16 +448,16 @@ async def get_albums(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le
         "total": total,
         "page": page,
         "limit": limit,
-        "totalPages": total_pages
+        "totalPages": total_pages,
+        "nextCursor": ALBUM_SORT.next_cursor(rows, limit)
     }
 
 @router.get("/api/albums/{album_id}")
-async def get_album(album_id: str):
-    conn = sqlite3.connect('music.db')
+@cached("albums", "artists", "songs")
+def get_album(album_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     album = get_album_by_id(cursor, album_id)
-    conn.close()
     
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
@@ -396,18 +465,18 @@ async def get_album(album_id: str):
     return album
 
 @router.get("/api/albums/{album_id}/songs")
-async def get_album_songs(album_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_album_songs(album_id: str, format: str = Query("nested", regex="^(nested|normalized)$"), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Verify album exists
-    album = get_album_by_id(cursor, album_id)
-    if not album:
-        conn.close()
+    hydrator = Hydrator(cursor)
+    hydrator.load_albums([album_id])
+    if not hydrator.albums.get(album_id):
         raise HTTPException(status_code=404, detail="Album not found")
     
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -416,115 +485,43 @@ async def get_album_songs(album_id: str):
     ''', (album_id,))
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = hydrator.build_songs(rows, projection)
     
-    conn.close()
+    if format == "normalized":
+        return hydrator.sideload(songs)
     return songs
 
 # Songs API  
 @router.get("/api/songs")
-async def get_songs(
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_songs(
     page: int = Query(1, ge=1), 
     limit: int = Query(20, ge=1, le=100),
-    sort_by: str = Query("created_desc", regex="^(created_desc|created_asc|title_asc|title_desc|play_count_desc|play_count_asc)$")
+    sort_by: str = Query("created_desc", regex="^(created_desc|created_asc|title_asc|title_desc|play_count_desc|play_count_asc)$"),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    projection: SongProjection = Depends(song_projection),
+    conn: sqlite3.Connection = Depends(get_db)
 ):
-    conn = sqlite3.connect('music.db')
     cursor = conn.cursor()
     
     # Get total count
-    cursor.execute('SELECT COUNT(*) FROM songs')
-    total = cursor.fetchone()[0]
+    total = get_count(cursor, "songs")
     
     # Determine sort order
-    if sort_by == "created_desc":
-        order_clause = "ORDER BY s.createdAt DESC"
-    elif sort_by == "created_asc":
-        order_clause = "ORDER BY s.createdAt ASC"
-    elif sort_by == "title_asc":
-        order_clause = "ORDER BY s.title ASC"
-    elif sort_by == "title_desc":
-        order_clause = "ORDER BY s.title DESC"
-    elif sort_by == "play_count_desc":
-        order_clause = "ORDER BY s.playCount DESC"
-    elif sort_by == "play_count_asc":
-        order_clause = "ORDER BY s.playCount ASC"
-    else:
-        order_clause = "ORDER BY s.createdAt DESC"
+    keyset = SONG_SORTS.get(sort_by, SONG_SORTS["created_desc"])
     
     # Get paginated results
-    offset = (page - 1) * limit
+    clause, params = page_query(keyset, page, limit, page_cursor)
     cursor.execute(f'''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+        SELECT {projection.columns(keyset.key)}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
-        {order_clause} LIMIT ? OFFSET ?
-    ''', (limit, offset))
+        {clause}
+    ''', params)
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
-    
-    conn.close()
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
     total_pages = (total + limit - 1) // limit
     
@@ -535,16 +532,17 @@ async def get_songs(
         "page": page,
         "limit": limit,
         "totalPages": total_pages,
-        "sortBy": sort_by
+        "sortBy": sort_by,
+        "nextCursor": keyset.next_cursor(rows, limit)
     }
 
 @router.get("/api/songs/{song_id}")
-async def get_song(song_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_song(song_id: str, projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -553,45 +551,28 @@ async def get_song(song_id: str):
     row = cursor.fetchone()
     
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
-    mood_ids = parse_json_field(row[8])
-    moods = get_moods_for_song(cursor, mood_ids)
-    
-    # Get all artists for this song
-    song_artists = get_song_artists(cursor, row[0])
-    primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-    
-    album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-    
-    song = {
-        "id": row[0],
-        "title": row[1],
-        "artistId": row[2],
-        "artist": primary_artist,  # Primary artist for backward compatibility
-        "artists": song_artists,   # All artists
-        "albumId": row[3],
-        "album": album_data,
-        "duration": row[4],
-        "audioUrl": row[5],
-        "coverUrl": ensure_https_url(row[6]),
-        "lyrics": row[7],
-        "moodIds": mood_ids,
-        "moods": moods,
-        "playCount": row[9],
-        "liked": bool(row[10]),
-        "genre": row[11],
-        "createdAt": row[12],
-        "updatedAt": row[13]
-    }
+    song = Hydrator(cursor).build_songs([row], projection)[0]
     
-    conn.close()
     return song
 
+@router.get("/api/songs/{song_id}/lyrics")
+@conditional("songs")
+def get_song_lyrics(song_id: str, conn: sqlite3.Connection = Depends(get_db)):
+    """Lyrics on their own, for clients that list songs with ?fields= and skip them"""
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT id, lyrics FROM songs WHERE id = ?', (song_id,))
+    row = cursor.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Song not found")
+    
+    return {"id": row[0], "lyrics": row[1]}
+
 @router.post("/api/songs/{song_id}/play")
-async def record_song_play(song_id: str):
-    conn = sqlite3.connect('music.db')
+def record_song_play(song_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Check if song exists
@@ -599,7 +580,6 @@ async def record_song_play(song_id: str):
     song_row = cursor.fetchone()
     
     if not song_row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
     # Update play count
@@ -610,7 +590,7 @@ async def record_song_play(song_id: str):
     new_play_count = cursor.fetchone()[0]
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("plays")
     
     return {
         "success": True,
@@ -621,59 +601,67 @@ async def record_song_play(song_id: str):
     }
 
 @router.get("/api/songs/{song_id}/stream")
-async def stream_song(song_id: str):
-    conn = sqlite3.connect('music.db')
+def stream_song(song_id: str, request: Request, conn: sqlite3.Connection = Depends(get_db)):
+    """Stream the audio file; Range requests get 206 with just the requested bytes.
+
+    Remote audio URLs are proxied through the on-disk audio cache.
+    """
     cursor = conn.cursor()
     
     cursor.execute('SELECT audioUrl FROM songs WHERE id = ?', (song_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if not row or not row[0]:
         raise HTTPException(status_code=404, detail="Audio file not found")
     
     audio_path = row[0]
+    media_type = mimetypes.guess_type(audio_path)[0] or "audio/mpeg"
+    if is_remote(audio_path):
+        return audio_cache.response(request, audio_path, media_type)
+    
     if not os.path.exists(audio_path):
         raise HTTPException(status_code=404, detail="Audio file not found on disk")
     
-    def file_generator():
-        with open(audio_path, "rb") as audio_file:
-            while True:
-                chunk = audio_file.read(8192)
-                if not chunk:
-                    break
-                yield chunk
-    
-    media_type = mimetypes.guess_type(audio_path)[0] or "audio/mpeg"
-    
-    return StreamingResponse(
-        file_generator(),
-        media_type=media_type,
-        headers={"Accept-Ranges": "bytes"}
-    )
+    return file_response(request, audio_path, media_type)
+
+@router.get("/api/images/{key}")
+def get_image(key: str, request: Request, w: int = Query(256, ge=1, le=4096), conn: sqlite3.Connection = Depends(get_db)):
+    """Cover art or avatar scaled to width `w`, as WebP when accepted, else JPEG.
+
+    `key` is `<kind>:<id>`, e.g. `albums:<album id>`; kinds are songs,
+    albums, artists, playlists and moods.
+    """
+    kind, _, item_id = key.partition(":")
+    column = IMAGE_SOURCES.get(kind)
+    if column is None or not item_id:
+        raise HTTPException(status_code=404, detail="Image not found")
+    row = conn.execute(f'SELECT {column} FROM {kind} WHERE id = ?', (item_id,)).fetchone()
+    if not row or not row[0]:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return image_cache.response(request, row[0], w)
 
 @router.get("/api/songs/{song_id}/similar")
-async def get_similar_songs(song_id: str, limit: int = Query(10, ge=1, le=50)):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_similar_songs(song_id: str, limit: int = Query(10, ge=1, le=50), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Get the target song's data
-    cursor.execute('SELECT artistId, moodIds, genre FROM songs WHERE id = ?', (song_id,))
+    cursor.execute('SELECT artistId, genre FROM songs WHERE id = ?', (song_id,))
     song_row = cursor.fetchone()
     
     if not song_row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
-    artist_id, mood_ids_str, genre = song_row
-    mood_ids = parse_json_field(mood_ids_str)
+    artist_id, genre = song_row
+    cursor.execute('SELECT moodId FROM song_moods WHERE songId = ? ORDER BY position', (song_id,))
+    mood_ids = [r[0] for r in cursor.fetchall()]
     
     # Find similar songs
     similar_songs = []
     
     # First, get songs by same artist
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -684,15 +672,15 @@ async def get_similar_songs(song_id: str, limit: int = Query(10, ge=1, le=50)):
     
     # Then, get songs with similar moods
     if mood_ids:
-        placeholders = ','.join('?' * len(mood_ids))
         cursor.execute(f'''
-            SELECT s.*, ar.name as artist_name, al.title as album_title 
+            SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
             FROM songs s 
             JOIN artists ar ON s.artistId = ar.id 
             LEFT JOIN albums al ON s.albumId = al.id 
-            WHERE s.id != ? AND s.moodIds LIKE ?
+            JOIN song_moods sm ON sm.songId = s.id
+            WHERE sm.moodId = ? AND s.id != ?
             ORDER BY s.playCount DESC
-        ''', (song_id, f'%{mood_ids[0]}%'))
+        ''', (mood_ids[0], song_id))
         mood_songs = cursor.fetchall()
     else:
         mood_songs = []
@@ -710,78 +698,32 @@ async def get_similar_songs(song_id: str, limit: int = Query(10, ge=1, le=50)):
                 break
     
     # Build response
-    songs = []
-    for row in unique_songs:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(unique_songs, projection)
     
-    conn.close()
     return songs
 
 # Playlists API
 @router.get("/api/playlists")
-async def get_playlists(page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100)):
-    conn = sqlite3.connect('music.db')
+@conditional("playlists")
+def get_playlists(
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    conn: sqlite3.Connection = Depends(get_db)
+):
     cursor = conn.cursor()
     
     # Get total count of public playlists
-    cursor.execute('SELECT COUNT(*) FROM playlists WHERE isPublic = 1')
-    total = cursor.fetchone()[0]
+    total = get_count(cursor, "public_playlists")
     
     # Get paginated results - only basic playlist info, no songs
-    offset = (page - 1) * limit
-    cursor.execute('SELECT * FROM playlists WHERE isPublic = 1 ORDER BY createdAt DESC LIMIT ? OFFSET ?', (limit, offset))
+    clause, params = page_query(PLAYLIST_SORT, page, limit, page_cursor, ['isPublic = 1'])
+    cursor.execute(f'SELECT * FROM playlists {clause}', params)
     rows = cursor.fetchall()
     
-    playlists = []
-    for row in rows:
-        song_ids = parse_json_field(row[4])
-        
-        playlist = {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "coverUrl": ensure_https_url(row[3]),
-            "songIds": song_ids,
-            "songCount": row[5],
-            "playCount": row[6],
-            "duration": row[7],
-            "creator": row[8],
-            "isPublic": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11]
-        }
-        playlists.append(playlist)
+    song_ids_by_playlist = get_playlist_song_ids(cursor, [row["id"] for row in rows])
     
-    conn.close()
+    playlists = [serializers.playlist(row, song_ids_by_playlist[row["id"]]) for row in rows]
     
     total_pages = (total + limit - 1) // limit
     
@@ -791,92 +733,46 @@ async def get_playlists(page: int = Query(1, ge=1), limit: int = Query(20, ge=1,
         "total": total,
         "page": page,
         "limit": limit,
-        "totalPages": total_pages
+        "totalPages": total_pages,
+        "nextCursor": PLAYLIST_SORT.next_cursor(rows, limit)
     }
 
 @router.get("/api/playlists/{playlist_id}")
-async def get_playlist(playlist_id: str):
+@cached("playlists", "songs", "artists", "albums", "moods", volatile=("plays",))
+def get_playlist(playlist_id: str, format: str = Query("nested", regex="^(nested|normalized)$"), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     """Get detailed playlist information including all songs"""
-    conn = sqlite3.connect('music.db')
     cursor = conn.cursor()
     
     cursor.execute('SELECT * FROM playlists WHERE id = ?', (playlist_id,))
     row = cursor.fetchone()
     
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Playlist not found")
     
-    song_ids = parse_json_field(row[4])
+    song_ids = get_playlist_song_ids(cursor, [playlist_id])[playlist_id]
     
-    # Get songs for this playlist
-    songs = []
-    if song_ids:
-        # Create ORDER BY clause based on song_ids order
-        case_statements = [f"WHEN s.id = '{song_id}' THEN {i}" for i, song_id in enumerate(song_ids)]
-        order_by_case = f"CASE {' '.join(case_statements)} ELSE {len(song_ids)} END"
-        
-        placeholders = ','.join('?' * len(song_ids))
-        cursor.execute(f'''
-            SELECT s.*, ar.name as artist_name, al.title as album_title 
-            FROM songs s 
-            JOIN artists ar ON s.artistId = ar.id 
-            LEFT JOIN albums al ON s.albumId = al.id 
-            WHERE s.id IN ({placeholders})
-            ORDER BY {order_by_case}
-        ''', song_ids)
-        song_rows = cursor.fetchall()
-        
-        for song_row in song_rows:
-            mood_ids = parse_json_field(song_row[8])
-            moods = get_moods_for_song(cursor, mood_ids)
-            
-            # Get all artists for this song
-            song_artists = get_song_artists(cursor, song_row[0])
-            primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-            
-            album_data = get_album_by_id(cursor, song_row[3]) if song_row[3] else None
-            
-            song = {
-                "id": song_row[0],
-                "title": song_row[1],
-                "artistId": song_row[2],
-                "artist": primary_artist,  # Primary artist for backward compatibility
-                "artists": song_artists,   # All artists
-                "albumId": song_row[3],
-                "album": album_data,
-                "duration": song_row[4],
-                "audioUrl": song_row[5],
-                "coverUrl": ensure_https_url(song_row[6]),
-                "lyrics": song_row[7],
-                "moodIds": mood_ids,
-                "moods": moods,
-                "playCount": song_row[9],
-                "liked": bool(song_row[10]),
-                "genre": song_row[11],
-                "createdAt": song_row[12],
-                "updatedAt": song_row[13]
-            }
-            songs.append(song)
-    
-    playlist = {
-        "id": row[0],
-        "name": row[1],
-        "description": row[2],
-        "coverUrl": ensure_https_url(row[3]),
-        "songIds": song_ids,
-        "songs": songs,
-        "songCount": row[5],
-        "playCount": row[6],
-        "duration": row[7],
-        "creator": row[8],
-        "isPublic": bool(row[9]),
-        "createdAt": row[10],
-        "updatedAt": row[11]
-    }
+    # Get songs for this playlist, each listed once at its first position
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
+        FROM (
+            SELECT songId, MIN(position) AS position FROM playlist_songs
+            WHERE playlistId = ? GROUP BY songId
+        ) ps
+        JOIN songs s ON s.id = ps.songId
+        JOIN artists ar ON s.artistId = ar.id 
+        LEFT JOIN albums al ON s.albumId = al.id 
+        ORDER BY ps.position
+    ''', (playlist_id,))
+    song_rows = cursor.fetchall()
     
-    conn.close()
-    return playlist
+    hydrator = Hydrator(cursor)
+    songs = hydrator.build_songs(song_rows, projection)
+    related = {}
+    if format == "normalized":
+        related = hydrator.sideload(songs)
+        songs = related.pop("songs")
+    
+    return {**serializers.playlist(row, song_ids, songs), **related}
 
 # Playlist request models
 class PlaylistCreate(BaseModel):
@@ -894,24 +790,26 @@ class PlaylistUpdate(BaseModel):
 class SongToPlaylist(BaseModel):
     songId: str
 
+class PlaylistSongMove(BaseModel):
+    index: int
+
 @router.post("/api/playlists")
-async def create_playlist(playlist: PlaylistCreate):
-    conn = sqlite3.connect('music.db')
+def create_playlist(playlist: PlaylistCreate, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     playlist_id = str(uuid.uuid4())
     now = datetime.now().isoformat()
     
     cursor.execute('''
-        INSERT INTO playlists (id, name, description, coverUrl, songIds, songCount, playCount, duration, creator, isPublic, createdAt, updatedAt)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO playlists (id, name, description, coverUrl, songCount, playCount, duration, creator, isPublic, createdAt, updatedAt)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         playlist_id, playlist.name, playlist.description, playlist.coverUrl,
-        json.dumps([]), 0, 0, 0, "user", playlist.isPublic, now, now
+        0, 0, 0, "user", playlist.isPublic, now, now
     ))
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {
         "success": True,
@@ -933,8 +831,7 @@ async def create_playlist(playlist: PlaylistCreate):
     }
 
 @router.put("/api/playlists/{playlist_id}")
-async def update_playlist(playlist_id: str, playlist: PlaylistUpdate):
-    conn = sqlite3.connect('music.db')
+def update_playlist(playlist_id: str, playlist: PlaylistUpdate, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Check if playlist exists
@@ -942,7 +839,6 @@ async def update_playlist(playlist_id: str, playlist: PlaylistUpdate):
     existing = cursor.fetchone()
     
     if not existing:
-        conn.close()
         raise HTTPException(status_code=404, detail="Playlist not found")
     
     # Build update query dynamically
@@ -970,57 +866,39 @@ async def update_playlist(playlist_id: str, playlist: PlaylistUpdate):
     cursor.execute(query, update_values)
     
     conn.commit()
+    response_cache.invalidate("playlists")
     
     # Get updated playlist
     cursor.execute('SELECT * FROM playlists WHERE id = ?', (playlist_id,))
     row = cursor.fetchone()
-    conn.close()
-    
-    playlist_data = {
-        "id": row[0],
-        "name": row[1],
-        "description": row[2],
-        "coverUrl": row[3],
-        "songIds": parse_json_field(row[4]),
-        "songs": [],  # Not loaded for update response
-        "songCount": row[5],
-        "playCount": row[6],
-        "duration": row[7],
-        "creator": row[8],
-        "isPublic": bool(row[9]),
-        "createdAt": row[10],
-        "updatedAt": row[11]
-    }
     
-    return playlist_data
+    # Songs are not loaded for the update response
+    return serializers.playlist(row, get_playlist_song_ids(cursor, [playlist_id])[playlist_id], songs=[])
 
 @router.delete("/api/playlists/{playlist_id}")
-async def delete_playlist(playlist_id: str):
-    conn = sqlite3.connect('music.db')
+def delete_playlist(playlist_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     cursor.execute('DELETE FROM playlists WHERE id=?', (playlist_id,))
     
     if cursor.rowcount == 0:
-        conn.close()
         raise HTTPException(status_code=404, detail="Playlist not found")
     
+    cursor.execute('DELETE FROM playlist_songs WHERE playlistId=?', (playlist_id,))
+    
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True}
 
 @router.post("/api/playlists/{playlist_id}/songs")
-async def add_song_to_playlist(playlist_id: str, song_data: SongToPlaylist):
-    conn = sqlite3.connect('music.db')
+def add_song_to_playlist(playlist_id: str, song_data: SongToPlaylist, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Check if playlist exists
-    cursor.execute('SELECT songIds, songCount, duration FROM playlists WHERE id = ?', (playlist_id,))
-    playlist_row = cursor.fetchone()
+    cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
     
-    if not playlist_row:
-        conn.close()
+    if not cursor.fetchone():
         raise HTTPException(status_code=404, detail="Playlist not found")
     
     # Check if song exists
@@ -1028,184 +906,131 @@ async def add_song_to_playlist(playlist_id: str, song_data: SongToPlaylist):
     song_row = cursor.fetchone()
     
     if not song_row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Song not found")
     
-    song_ids = parse_json_field(playlist_row[0])
-    song_ids.append(song_data.songId)
-    new_song_count = len(song_ids)
-    new_duration = playlist_row[2] + song_row[0]
+    append_playlist_song(cursor, playlist_id, song_data.songId)
     
     cursor.execute('''
-        UPDATE playlists SET songIds=?, songCount=?, duration=?, updatedAt=?
+        UPDATE playlists SET songCount=(SELECT COUNT(*) FROM playlist_songs WHERE playlistId=?), duration=duration + ?, updatedAt=?
         WHERE id=?
     ''', (
-        json.dumps(song_ids), new_song_count, new_duration,
+        playlist_id, song_row[0],
         datetime.now().isoformat(), playlist_id
     ))
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
     
     return {"success": True}
 
 @router.delete("/api/playlists/{playlist_id}/songs/{song_id}")
-async def remove_song_from_playlist(playlist_id: str, song_id: str):
-    conn = sqlite3.connect('music.db')
+def remove_song_from_playlist(playlist_id: str, song_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     # Check if playlist exists
-    cursor.execute('SELECT songIds, songCount, duration FROM playlists WHERE id = ?', (playlist_id,))
-    playlist_row = cursor.fetchone()
+    cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
     
-    if not playlist_row:
-        conn.close()
+    if not cursor.fetchone():
         raise HTTPException(status_code=404, detail="Playlist not found")
     
     # Check if song exists
     cursor.execute('SELECT duration FROM songs WHERE id = ?', (song_id,))
     song_row = cursor.fetchone()
     
-    song_ids = parse_json_field(playlist_row[0])
-    
-    if song_id not in song_ids:
-        conn.close()
+    if not remove_playlist_song(cursor, playlist_id, song_id):
         raise HTTPException(status_code=404, detail="Song not found in playlist")
     
-    song_ids.remove(song_id)
-    new_song_count = len(song_ids)
-    new_duration = max(0, playlist_row[2] - (song_row[0] if song_row else 0))
-    
     cursor.execute('''
-        UPDATE playlists SET songIds=?, songCount=?, duration=?, updatedAt=?
+        UPDATE playlists SET songCount=(SELECT COUNT(*) FROM playlist_songs WHERE playlistId=?), duration=MAX(0, duration - ?), updatedAt=?
         WHERE id=?
     ''', (
-        json.dumps(song_ids), new_song_count, new_duration,
+        playlist_id, song_row[0] if song_row else 0,
         datetime.now().isoformat(), playlist_id
     ))
     
     conn.commit()
-    conn.close()
+    response_cache.invalidate("playlists")
+    
+    return {"success": True}
+
+@router.put("/api/playlists/{playlist_id}/songs/{song_id}")
+def move_song_in_playlist(playlist_id: str, song_id: str, move_data: PlaylistSongMove, conn: sqlite3.Connection = Depends(get_db)):
+    """Move a song to a new index in the playlist"""
+    cursor = conn.cursor()
+    
+    # Check if playlist exists
+    cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
+    
+    if not cursor.fetchone():
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    
+    if not move_playlist_song(cursor, playlist_id, song_id, move_data.index):
+        raise HTTPException(status_code=404, detail="Song not found in playlist")
+    
+    cursor.execute('UPDATE playlists SET updatedAt=? WHERE id=?', (datetime.now().isoformat(), playlist_id))
+    
+    conn.commit()
+    response_cache.invalidate("playlists")
     
     return {"success": True}
 
 # Moods API
 @router.get("/api/moods")
-async def get_moods():
-    conn = sqlite3.connect('music.db')
+@cached("moods", "songs")
+def get_moods(conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM moods ORDER BY createdAt DESC')
     rows = cursor.fetchall()
-    conn.close()
-    
-    moods = []
-    for row in rows:
-        mood = {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "icon": row[3],
-            "color": row[4],
-            "coverUrl": ensure_https_url(row[5]),
-            "songCount": row[6],
-            "createdAt": row[7],
-            "updatedAt": row[8]
-        }
-        moods.append(mood)
+    
+    moods = [serializers.mood(row) for row in rows]
     
     return moods
 
 @router.get("/api/moods/{mood_id}")
-async def get_mood(mood_id: str):
-    conn = sqlite3.connect('music.db')
+@conditional("moods", "songs")
+def get_mood(mood_id: str, conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM moods WHERE id=?', (mood_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if not row:
         raise HTTPException(status_code=404, detail="Mood not found")
     
-    mood = {
-        "id": row[0],
-        "name": row[1],
-        "description": row[2],
-        "icon": row[3],
-        "color": row[4],
-        "coverUrl": row[5],
-        "songCount": row[6],
-        "createdAt": row[7],
-        "updatedAt": row[8]
-    }
-    
-    return mood
+    return serializers.mood(row)
 
 @router.get("/api/moods/{mood_id}/songs")
-async def get_mood_songs(mood_id: str, page: int = Query(1, ge=1), limit: int = Query(20, ge=1, le=100)):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_mood_songs(
+    mood_id: str,
+    page: int = Query(1, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    projection: SongProjection = Depends(song_projection),
+    conn: sqlite3.Connection = Depends(get_db)
+):
     cursor = conn.cursor()
     
-    # Verify mood exists
-    cursor.execute('SELECT id FROM moods WHERE id=?', (mood_id,))
-    if not cursor.fetchone():
-        conn.close()
+    # Verify mood exists; its songCount is kept current by triggers
+    cursor.execute('SELECT songCount FROM moods WHERE id=?', (mood_id,))
+    mood_row = cursor.fetchone()
+    if not mood_row:
         raise HTTPException(status_code=404, detail="Mood not found")
     
-    # Get total count
-    cursor.execute('''
-        SELECT COUNT(*) FROM songs s 
-        WHERE s.moodIds LIKE ?
-    ''', (f'%{mood_id}%',))
-    total = cursor.fetchone()[0]
+    total = mood_row[0]
     
     # Get paginated results
-    offset = (page - 1) * limit
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    clause, params = page_query(MOOD_SONG_SORT, page, limit, page_cursor, ['sm.moodId = ?'], [mood_id])
+    cursor.execute(f'''
+        SELECT {projection.columns(MOOD_SONG_SORT.key)}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
-        WHERE s.moodIds LIKE ?
-        ORDER BY s.playCount DESC
-        LIMIT ? OFFSET ?
-    ''', (f'%{mood_id}%', limit, offset))
+        JOIN song_moods sm ON sm.songId = s.id
+        {clause}
+    ''', params)
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        if mood_id in mood_ids:  # Double check the mood is actually in the list
-            moods = get_moods_for_song(cursor, mood_ids)
-            
-            # Get all artists for this song
-            song_artists = get_song_artists(cursor, row[0])
-            primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-            
-            album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-            
-            song = {
-                "id": row[0],
-                "title": row[1],
-                "artistId": row[2],
-                "artist": primary_artist,  # Primary artist for backward compatibility
-                "artists": song_artists,   # All artists
-                "albumId": row[3],
-                "album": album_data,
-                "duration": row[4],
-                "audioUrl": row[5],
-                "coverUrl": ensure_https_url(row[6]),
-                "lyrics": row[7],
-                "moodIds": mood_ids,
-                "moods": moods,
-                "playCount": row[9],
-                "liked": bool(row[10]),
-                "genre": row[11],
-                "createdAt": row[12],
-                "updatedAt": row[13]
-            }
-            songs.append(song)
-    
-    conn.close()
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
     total_pages = (total + limit - 1) // limit
     
@@ -1215,155 +1040,126 @@ async def get_mood_songs(mood_id: str, page: int = Query(1, ge=1), limit: int =
         "total": total,
         "page": page,
         "limit": limit,
-        "totalPages": total_pages
+        "totalPages": total_pages,
+        "nextCursor": MOOD_SONG_SORT.next_cursor(rows, limit)
     }
 
 # Search API
+@router.get("/api/search/suggest")
+@conditional("songs", "artists", "albums")
+def search_suggest(q: str = Query(..., min_length=1), limit: int = Query(5, ge=1, le=20), conn: sqlite3.Connection = Depends(get_db)):
+    """Search-as-you-type: ids and names of songs, artists and albums with a word starting with q"""
+    suggestions.ensure_loaded(conn.cursor())
+    
+    return {"success": True, **suggestions.search(q, limit)}
+
 @router.get("/api/search")
-async def search_content(q: str = Query(..., min_length=1)):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays", "playlists")
+def search_content(q: str = Query(..., min_length=1), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
     query = f"%{q.lower()}%"
     
+    # The trigram index needs at least three characters; shorter queries
+    # (e.g. two-character Chinese words) scan with LIKE instead
+    use_index = len(q) >= MIN_FTS_QUERY_LENGTH and has_search_index(cursor)
+    match = fts_phrase(q)
+    
     # Search songs (include songs by all associated artists, not just primary artist)
-    cursor.execute('''
-        SELECT DISTINCT s.*, ar.name as artist_name, al.title as album_title 
-        FROM songs s 
-        JOIN artists ar ON s.artistId = ar.id 
-        LEFT JOIN albums al ON s.albumId = al.id 
-        LEFT JOIN song_artists sa ON s.id = sa.songId
-        LEFT JOIN artists sar ON sa.artistId = sar.id
-        WHERE LOWER(s.title) LIKE ? OR LOWER(ar.name) LIKE ? OR LOWER(s.genre) LIKE ? OR LOWER(sar.name) LIKE ?
-        ORDER BY s.playCount DESC
-        LIMIT 20
-    ''', (query, query, query, query))
+    if use_index:
+        # bm25 is negative, lower is better; popular songs get up to 2x weight
+        cursor.execute(f'''
+            SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
+            FROM songs_fts f
+            JOIN songs s ON s.rowid = f.rowid AND s.id = f.id
+            JOIN artists ar ON s.artistId = ar.id 
+            LEFT JOIN albums al ON s.albumId = al.id 
+            WHERE songs_fts MATCH ?
+            ORDER BY bm25(songs_fts, 0.0, 10.0, 5.0, 1.0) * (1.0 + s.playCount / (s.playCount + 100.0))
+            LIMIT 20
+        ''', (match,))
+    else:
+        cursor.execute(f'''
+            SELECT DISTINCT {projection.columns()}, ar.name as artist_name, al.title as album_title 
+            FROM songs s 
+            JOIN artists ar ON s.artistId = ar.id 
+            LEFT JOIN albums al ON s.albumId = al.id 
+            LEFT JOIN song_artists sa ON s.id = sa.songId
+            LEFT JOIN artists sar ON sa.artistId = sar.id
+            WHERE LOWER(s.title) LIKE ? OR LOWER(ar.name) LIKE ? OR LOWER(s.genre) LIKE ? OR LOWER(sar.name) LIKE ?
+            ORDER BY s.playCount DESC
+            LIMIT 20
+        ''', (query, query, query, query))
     song_rows = cursor.fetchall()
     
-    songs = []
-    for row in song_rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(song_rows, projection)
     
     # Search artists
-    cursor.execute('''
-        SELECT * FROM artists 
-        WHERE LOWER(name) LIKE ? OR LOWER(bio) LIKE ?
-        ORDER BY followers DESC
-        LIMIT 20
-    ''', (query, query))
+    if use_index:
+        cursor.execute('''
+            SELECT a.* FROM artists_fts f
+            JOIN artists a ON a.rowid = f.rowid AND a.id = f.id
+            WHERE artists_fts MATCH ?
+            ORDER BY bm25(artists_fts, 0.0, 10.0, 1.0) * (1.0 + a.followers / (a.followers + 1000.0))
+            LIMIT 20
+        ''', (match,))
+    else:
+        cursor.execute('''
+            SELECT * FROM artists 
+            WHERE LOWER(name) LIKE ? OR LOWER(bio) LIKE ?
+            ORDER BY followers DESC
+            LIMIT 20
+        ''', (query, query))
     artist_rows = cursor.fetchall()
     
-    artists = []
-    for row in artist_rows:
-        artist = {
-            "id": row[0],
-            "name": row[1],
-            "bio": row[2],
-            "avatar": row[3],
-            "coverUrl": ensure_https_url(row[4]),
-            "followers": row[5],
-            "songCount": row[6],
-            "albumCount": row[7],
-            "genres": parse_json_field(row[8]),
-            "verified": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11]
-        }
-        artists.append(artist)
+    artists = [serializers.artist(row) for row in artist_rows]
     
     # Search albums (include albums by all associated artists, not just primary artist)
-    cursor.execute('''
-        SELECT DISTINCT a.*, ar.name as artist_name FROM albums a 
-        JOIN artists ar ON a.artistId = ar.id 
-        LEFT JOIN album_artists aa ON a.id = aa.albumId
-        LEFT JOIN artists aar ON aa.artistId = aar.id
-        WHERE LOWER(a.title) LIKE ? OR LOWER(ar.name) LIKE ? OR LOWER(a.genre) LIKE ? OR LOWER(aar.name) LIKE ?
-        ORDER BY a.songCount DESC
-        LIMIT 20
-    ''', (query, query, query, query))
+    if use_index:
+        cursor.execute('''
+            SELECT a.*, ar.name as artist_name FROM albums_fts f
+            JOIN albums a ON a.rowid = f.rowid AND a.id = f.id
+            JOIN artists ar ON a.artistId = ar.id 
+            WHERE albums_fts MATCH ?
+            ORDER BY bm25(albums_fts, 0.0, 10.0, 5.0, 1.0) * (1.0 + a.songCount / (a.songCount + 10.0))
+            LIMIT 20
+        ''', (match,))
+    else:
+        cursor.execute('''
+            SELECT DISTINCT a.*, ar.name as artist_name FROM albums a 
+            JOIN artists ar ON a.artistId = ar.id 
+            LEFT JOIN album_artists aa ON a.id = aa.albumId
+            LEFT JOIN artists aar ON aa.artistId = aar.id
+            WHERE LOWER(a.title) LIKE ? OR LOWER(ar.name) LIKE ? OR LOWER(a.genre) LIKE ? OR LOWER(aar.name) LIKE ?
+            ORDER BY a.songCount DESC
+            LIMIT 20
+        ''', (query, query, query, query))
     album_rows = cursor.fetchall()
     
-    albums = []
-    for row in album_rows:
-        # Get all artists for this album
-        album_artists = get_album_artists(cursor, row[0])
-        primary_artist = next((a for a in album_artists if a.get('isPrimary')), album_artists[0] if album_artists else None)
-        
-        album = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": album_artists,  # All artists
-            "coverUrl": ensure_https_url(row[3]),
-            "releaseDate": row[4],
-            "songCount": row[5],
-            "duration": row[6],
-            "genre": row[7],
-            "description": row[8],
-            "createdAt": row[9],
-            "updatedAt": row[10]
-        }
-        albums.append(album)
+    albums = Hydrator(cursor).build_albums(album_rows)
     
     # Search playlists
-    cursor.execute('''
-        SELECT * FROM playlists 
-        WHERE isPublic = 1 AND (LOWER(name) LIKE ? OR LOWER(description) LIKE ?)
-        ORDER BY playCount DESC
-        LIMIT 20
-    ''', (query, query))
+    if use_index:
+        cursor.execute('''
+            SELECT p.* FROM playlists_fts f
+            JOIN playlists p ON p.rowid = f.rowid AND p.id = f.id
+            WHERE playlists_fts MATCH ? AND p.isPublic = 1
+            ORDER BY bm25(playlists_fts, 0.0, 10.0, 1.0) * (1.0 + p.playCount / (p.playCount + 100.0))
+            LIMIT 20
+        ''', (match,))
+    else:
+        cursor.execute('''
+            SELECT * FROM playlists 
+            WHERE isPublic = 1 AND (LOWER(name) LIKE ? OR LOWER(description) LIKE ?)
+            ORDER BY playCount DESC
+            LIMIT 20
+        ''', (query, query))
     playlist_rows = cursor.fetchall()
     
-    playlists = []
-    for row in playlist_rows:
-        playlist = {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2],
-            "coverUrl": ensure_https_url(row[3]),
-            "songIds": parse_json_field(row[4]),
-            "songs": [],  # Not populated for search results
-            "songCount": row[5],
-            "playCount": row[6],
-            "duration": row[7],
-            "creator": row[8],
-            "isPublic": bool(row[9]),
-            "createdAt": row[10],
-            "updatedAt": row[11]
-        }
-        playlists.append(playlist)
+    song_ids_by_playlist = get_playlist_song_ids(cursor, [row["id"] for row in playlist_rows])
     
-    conn.close()
+    # Songs are not populated for search results
+    playlists = [serializers.playlist(row, song_ids_by_playlist[row["id"]], songs=[]) for row in playlist_rows]
     
     return {
         "success": True,
@@ -1375,19 +1171,20 @@ async def search_content(q: str = Query(..., min_length=1)):
 
 # Recommendations API
 @router.get("/api/recommendations")
-async def get_recommendations(
+def get_recommendations(
     limit: int = Query(20, ge=1, le=50),
     type: Optional[str] = Query(None),
     moodId: Optional[str] = Query(None),
     artistId: Optional[str] = Query(None),
-    genreId: Optional[str] = Query(None)
+    genreId: Optional[str] = Query(None),
+    projection: SongProjection = Depends(song_projection),
+    conn: sqlite3.Connection = Depends(get_db)
 ):
-    conn = sqlite3.connect('music.db')
     cursor = conn.cursor()
     
     # Base query
-    base_query = '''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    base_query = f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -1398,8 +1195,8 @@ async def get_recommendations(
     
     # Apply filters
     if moodId:
-        conditions.append('s.moodIds LIKE ?')
-        params.append(f'%{moodId}%')
+        conditions.append('s.id IN (SELECT songId FROM song_moods WHERE moodId = ?)')
+        params.append(moodId)
     
     if artistId:
         conditions.append('s.artistId = ?')
@@ -1431,49 +1228,17 @@ async def get_recommendations(
     cursor.execute(full_query, params)
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
-    conn.close()
     return songs
 
 @router.get("/api/trending/songs")
-async def get_trending_songs(limit: int = Query(20, ge=1, le=50)):
-    conn = sqlite3.connect('music.db')
+@conditional("songs", "artists", "albums", "moods", "plays")
+def get_trending_songs(limit: int = Query(20, ge=1, le=50), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -1482,49 +1247,17 @@ async def get_trending_songs(limit: int = Query(20, ge=1, le=50)):
     ''', (limit,))
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
-    conn.close()
     return songs
 
 @router.get("/api/hot/songs")
-async def get_hot_songs(limit: int = Query(20, ge=1, le=50)):
-    conn = sqlite3.connect('music.db')
+@cached("songs", "artists", "albums", "moods", volatile=("plays",))
+def get_hot_songs(limit: int = Query(20, ge=1, le=50), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -1533,49 +1266,17 @@ async def get_hot_songs(limit: int = Query(20, ge=1, le=50)):
     ''', (limit,))
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
-    conn.close()
     return songs
 
 @router.get("/api/new/songs")
-async def get_new_songs(limit: int = Query(20, ge=1, le=50)):
-    conn = sqlite3.connect('music.db')
+@cached("songs", "artists", "albums", "moods", volatile=("plays",))
+def get_new_songs(limit: int = Query(20, ge=1, le=50), projection: SongProjection = Depends(song_projection), conn: sqlite3.Connection = Depends(get_db)):
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT s.*, ar.name as artist_name, al.title as album_title 
+    cursor.execute(f'''
+        SELECT {projection.columns()}, ar.name as artist_name, al.title as album_title 
         FROM songs s 
         JOIN artists ar ON s.artistId = ar.id 
         LEFT JOIN albums al ON s.albumId = al.id 
@@ -1584,38 +1285,6 @@ async def get_new_songs(limit: int = Query(20, ge=1, le=50)):
     ''', (limit,))
     rows = cursor.fetchall()
     
-    songs = []
-    for row in rows:
-        mood_ids = parse_json_field(row[8])
-        moods = get_moods_for_song(cursor, mood_ids)
-        
-        # Get all artists for this song
-        song_artists = get_song_artists(cursor, row[0])
-        primary_artist = next((a for a in song_artists if a.get('isPrimary')), song_artists[0] if song_artists else None)
-        
-        album_data = get_album_by_id(cursor, row[3]) if row[3] else None
-        
-        song = {
-            "id": row[0],
-            "title": row[1],
-            "artistId": row[2],
-            "artist": primary_artist,  # Primary artist for backward compatibility
-            "artists": song_artists,   # All artists
-            "albumId": row[3],
-            "album": album_data,
-            "duration": row[4],
-            "audioUrl": row[5],
-            "coverUrl": ensure_https_url(row[6]),
-            "lyrics": row[7],
-            "moodIds": mood_ids,
-            "moods": moods,
-            "playCount": row[9],
-            "liked": bool(row[10]),
-            "genre": row[11],
-            "createdAt": row[12],
-            "updatedAt": row[13]
-        }
-        songs.append(song)
+    songs = Hydrator(cursor).build_songs(rows, projection)
     
-    conn.close()
     return songs
\ No newline at end of file